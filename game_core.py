@@ -48,18 +48,62 @@ def derive_prime_from_password(pw_bytes: bytes) -> int:
 def matrix_minor(mat, i, j):
     return [row[:j] + row[j+1:] for r,row in enumerate(mat) if r != i]
 
+def _pivot_row(A, col, start, m):
+    for r in range(start, len(A)):
+        if A[r][col] % m != 0:
+            return r
+    return None
+
 def det_mod(mat, m):
+    """Determinante mod m (primo) por eliminación gaussiana, O(n³)."""
+    n = len(mat)
+    A = [[x % m for x in row] for row in mat]
+    det = 1
+    for col in range(n):
+        p = _pivot_row(A, col, col, m)
+        if p is None: return 0
+        if p != col:
+            A[col], A[p] = A[p], A[col]
+            det = -det
+        piv = A[col][col]
+        det = (det * piv) % m
+        inv_p = inv_int(piv, m)
+        prow = A[col]
+        for r in range(col+1, n):
+            f = (A[r][col] * inv_p) % m
+            if f:
+                row = A[r]
+                for k in range(col, n):
+                    row[k] = (row[k] - f * prow[k]) % m
+    return det % m
+
+def mat_inverse_mod(mat, m):
+    """Inversa mod m (primo) por Gauss-Jordan sobre [M | I], O(n³)."""
     n = len(mat)
-    if n == 1: return mat[0][0] % m
-    if n == 2: return (mat[0][0]*mat[1][1] - mat[0][1]*mat[1][0]) % m
-    total = 0
-    for j in range(n):
-        sign = -1 if (j % 2) else 1
-        total = (total + sign * mat[0][j] * det_mod(matrix_minor(mat,0,j), m)) % m
-    return total % m
+    A = [[x % m for x in row] + [1 if i == j else 0 for j in range(n)] for i, row in enumerate(mat)]
+    for col in range(n):
+        p = _pivot_row(A, col, col, m)
+        if p is None: raise ValueError("M no invertible")
+        if p != col:
+            A[col], A[p] = A[p], A[col]
+        inv_p = inv_int(A[col][col], m)
+        prow = A[col] = [(x * inv_p) % m for x in A[col]]
+        for r in range(n):
+            if r == col: continue
+            f = A[r][col]
+            if f:
+                row = A[r]
+                for k in range(col, 2*n):
+                    row[k] = (row[k] - f * prow[k]) % m
+    return [row[n:] for row in A]
 
 def adjugate_mod(mat, m):
+    """adj(M) = det(M)·M⁻¹ si M es invertible; si no, expansión por cofactores."""
     n = len(mat)
+    d = det_mod(mat, m)
+    if d != 0:
+        inv = mat_inverse_mod(mat, m)
+        return [[(d * inv[i][j]) % m for j in range(n)] for i in range(n)]
     cof = [[0]*n for _ in range(n)]
     for i in range(n):
         for j in range(n):
@@ -74,8 +118,31 @@ def mat_vec_mul(M, v, m):
         out[i] = s % m
     return out
 
+# ======= S-box por tablas (cache por primo m) =======
+# m < ~1300, así que S y S⁻¹ completas ocupan pocos KB; se construyen una vez por m
+# y las comparten el juego, la demo, el motor por lotes y el validador del server.
+_SBOX_TABLES: Dict[int, Tuple[List[int], Optional[List[int]]]] = {}
+
+def sbox_tables(m: int) -> Tuple[List[int], Optional[List[int]]]:
+    """(S, S⁻¹) indexables por x en [0, m). S⁻¹ es None si x^3 no es biyectiva mod m."""
+    tabs = _SBOX_TABLES.get(m)
+    if tabs is None:
+        S = [pow(x, 3, m) for x in range(m)]
+        Sinv = None
+        if (m - 1) % 3 != 0 and is_prime(m):
+            Sinv = [0] * m
+            for x, y in enumerate(S):
+                Sinv[y] = x
+        tabs = _SBOX_TABLES[m] = (S, Sinv)
+    return tabs
+
 def sbox(x: int, m: int) -> int:
-    return pow(x, 3, m)
+    return sbox_tables(m)[0][x % m]
+
+def sbox_inv(y: int, m: int) -> int:
+    Sinv = sbox_tables(m)[1]
+    if Sinv is None: raise ValueError("S-box no invertible para este m")
+    return Sinv[y % m]
 
 def pkcs7_pad(data: List[int], block_size: int) -> List[int]:
     pad = block_size - (len(data) % block_size)
@@ -148,6 +215,8 @@ class GameState:
     v_blocks: List[List[int]] = field(default_factory=list)
     expected_pwd_ascii: List[int] = field(default_factory=list)
     expected_msg_ascii: List[int] = field(default_factory=list)
+    # Offset fusionado del paso D por bloque: (b + t_i) mod m
+    d_offsets: List[List[int]] = field(default_factory=list)
 
 def initial_state(password: str, message: str, n: int = 2) -> GameState:
     if len(password) != 4 or len(message) != 4:
@@ -165,10 +234,195 @@ def initial_state(password: str, message: str, n: int = 2) -> GameState:
         password=password, message=message, n=n, m=m, M=M, b=b, IV=IV, key_sum=key_sum,
         ascii_pw_done=False, ascii_msg_done=False, current_block=0, current_phase="TPW",
         prev_vec=IV[:], v_blocks=v_blocks,
-        expected_pwd_ascii=pw_bytes, expected_msg_ascii=msg_bytes
+        expected_pwd_ascii=pw_bytes, expected_msg_ascii=msg_bytes,
+        d_offsets=round_offsets(len(v_blocks), n, m, b, key_sum)
     )
     return st
 
+def round_offsets(blocks: int, n: int, m: int, b: List[int], key_sum: int) -> List[List[int]]:
+    """(b + t_i) mod m para i=0..blocks-1, por pasos: t_{i+1}[j] = t_i[j] + (j+1)."""
+    t = [(key_sum + j + 1) % m for j in range(n)]
+    out = []
+    for _ in range(blocks):
+        out.append([(b[j] + t[j]) % m for j in range(n)])
+        t = [(t[j] + j + 1) % m for j in range(n)]
+    return out
+
+# ======= Reto compartido (trayectoria precomputada) =======
+# Todos los equipos corren con el mismo password/mensaje y sólo las respuestas
+# correctas avanzan el estado: la trayectoria esperada es determinista. Se calcula
+# una vez por reto y cada equipo es sólo un cursor sobre ella.
+PHASES = ("A", "B", "C", "D")
+_ERR_NAMES = {"TPW": "ASCII password incorrecto", "TMSG": "ASCII mensaje incorrecto"}
+
+@dataclass
+class Challenge:
+    password: str
+    message: str
+    n: int
+    m: int
+    M: List[List[int]]
+    b: List[int]
+    IV: List[int]
+    key_sum: int
+    v_blocks: List[List[int]]
+    c_blocks: List[List[int]]
+    steps: List[StepSpec]         # TPW, TMSG y luego A,B,C,D por bloque
+    expected: List[List[int]]     # respuesta esperada de cada paso
+    payloads: List[Dict[str, Any]]   # mensaje "step" de cada paso (sin campos de turno)
+
+    def __len__(self):
+        return len(self.steps)
+
+    def step_index(self, block: int, phase: str) -> Optional[int]:
+        if phase == "TPW": return 0
+        if phase == "TMSG": return 1
+        if phase in PHASES and 0 <= block < len(self.v_blocks):
+            return 2 + 4*block + PHASES.index(phase)
+        return None
+
+def build_challenge(password: str, message: str, n: int = 2) -> Challenge:
+    st = initial_state(password, message, n)   # valida entradas y deriva m, M, b, IV
+    m, M = st.m, st.M
+    S = sbox_tables(m)[0]
+    steps = [next_step(st)]
+    expected = [st.expected_pwd_ascii]
+    st.ascii_pw_done = True
+    steps.append(next_step(st))
+    expected.append(st.expected_msg_ascii)
+
+    prev, c_blocks = st.IV[:], []
+    for i, v in enumerate(st.v_blocks):
+        t_i = tweak(i, n, m, st.key_sum)
+        off = st.d_offsets[i]
+        u = [(v[j] + prev[j] + t_i[j]) % m for j in range(n)]
+        up = [S[x] for x in u]
+        w = mat_vec_mul(M, up, m)
+        c = [(w[j] + off[j]) % m for j in range(n)]
+        steps += [
+            StepSpec(i, "A", {"v": v, "prev": prev, "t": t_i, "m": m}, "u = (v + prev + t) mod m", "u", n),
+            StepSpec(i, "B", {"u": u, "m": m, "sbox": "x^3 mod m"}, "u_prime = S(u)", "u_prime", n),
+            StepSpec(i, "C", {"M": M, "u_prime": up, "m": m}, "w = M * u_prime mod m", "w", n),
+            StepSpec(i, "D", {"w": w, "b": st.b, "t": t_i, "m": m}, "c = (w + b + t) mod m", "c", n),
+        ]
+        expected += [u, up, w, c]
+        c_blocks.append(c)
+        prev = c
+
+    payloads = [{"type": "step", "block": sp.block, "phase": sp.phase, "inputs": sp.inputs,
+                 "op": sp.op, "output_name": sp.output_name} for sp in steps]
+    return Challenge(password=password, message=message, n=n, m=m, M=M, b=st.b, IV=st.IV,
+                     key_sum=st.key_sum, v_blocks=st.v_blocks, c_blocks=c_blocks,
+                     steps=steps, expected=expected, payloads=payloads)
+
+@dataclass
+class ChallengeCursor:
+    """Progreso de un equipo sobre un Challenge: posición en la trayectoria y errores."""
+    challenge: Challenge
+    pos: int = 0
+    errors: int = 0
+
+    # vista compatible con GameState para scoreboard y consola admin
+    n = property(lambda self: self.challenge.n)
+    m = property(lambda self: self.challenge.m)
+    M = property(lambda self: self.challenge.M)
+    b = property(lambda self: self.challenge.b)
+    IV = property(lambda self: self.challenge.IV)
+    v_blocks = property(lambda self: self.challenge.v_blocks)
+
+    @property
+    def finished(self) -> bool:
+        return self.pos >= len(self.challenge.steps)
+
+    @property
+    def current_block(self) -> int:
+        if self.finished: return len(self.challenge.v_blocks)
+        return max(self.challenge.steps[self.pos].block, 0)
+
+    @property
+    def current_phase(self) -> str:
+        return "DONE" if self.finished else self.challenge.steps[self.pos].phase
+
+    @property
+    def c_blocks(self) -> List[List[int]]:
+        return self.challenge.c_blocks[:max(self.pos - 2, 0) // 4]
+
+def cursor_step(cur: ChallengeCursor) -> StepSpec:
+    if cur.finished:
+        return StepSpec(len(cur.challenge.v_blocks), "DONE", {}, "finished", "", cur.challenge.n)
+    return cur.challenge.steps[cur.pos]
+
+def cursor_payload(cur: ChallengeCursor) -> Optional[Dict[str, Any]]:
+    """Mensaje "step" ya armado del paso actual (None si terminó)."""
+    return None if cur.finished else cur.challenge.payloads[cur.pos]
+
+def cursor_validate(cur: ChallengeCursor, phase: str, vector: List[int]) -> Tuple[bool, Optional[str]]:
+    """Como validate_step, pero la comparación es contra el vector precomputado: O(n)."""
+    ch = cur.challenge
+    if phase not in _ERR_NAMES and phase not in PHASES:
+        return False, "Fase desconocida."
+    if cur.finished:
+        cur.errors += 1
+        return False, "El reto ya está resuelto."
+    spec = ch.steps[cur.pos]
+    if phase != spec.phase:
+        cur.errors += 1
+        return False, f"Fase fuera de orden. Toca {spec.phase}."
+    exp = ch.expected[cur.pos]
+    if vector == exp:
+        cur.pos += 1
+        return True, None
+    cur.errors += 1
+    if phase in _ERR_NAMES:
+        return False, f"{_ERR_NAMES[phase]}. Esperado {exp}"
+    return False, f"Incorrecto. Esperado {spec.output_name}={exp}"
+
+# ===== modo delta: parámetros estáticos una vez + un vector por paso =====
+# Único input que cambia en cada fase (la salida del paso anterior, o c_{i-1}/IV en A).
+DELTA_FIELD = {"A": "prev", "B": "u", "C": "u_prime", "D": "w"}
+
+def challenge_static(ch: Challenge) -> Dict[str, Any]:
+    """Mensaje "challenge": todo lo que no cambia entre pasos (se envía una vez por reto)."""
+    return {"type": "challenge", "n": ch.n, "m": ch.m, "M": ch.M, "b": ch.b, "IV": ch.IV,
+            "key_sum": ch.key_sum, "v_blocks": ch.v_blocks,
+            "password_hint": ch.password, "message_hint": ch.message, "len": 4}
+
+def step_delta(ch: Challenge, pos: int) -> Dict[str, Any]:
+    """Mensaje "step_delta" del paso pos (sin campos de turno): fase, bloque y vector nuevo."""
+    sp = ch.steps[pos]
+    key = DELTA_FIELD.get(sp.phase)
+    return {"type": "step_delta", "block": sp.block, "phase": sp.phase,
+            "vec": sp.inputs[key] if key else []}
+
+def step_from_delta(static: Dict[str, Any], delta: Dict[str, Any]) -> Dict[str, Any]:
+    """Reconstruye en el cliente el mensaje "step" completo (mismos campos que el server)."""
+    phase, i, vec = delta["phase"], delta["block"], delta.get("vec", [])
+    n, m = static["n"], static["m"]
+    if phase == "TPW":
+        sp = StepSpec(-1, "TPW", {"password_hint": static["password_hint"], "len": static["len"]},
+                      "translate_password_to_ascii", "ascii", 4)
+    elif phase == "TMSG":
+        sp = StepSpec(-1, "TMSG", {"message_hint": static["message_hint"], "len": static["len"]},
+                      "translate_plaintext_to_ascii", "ascii", 4)
+    elif phase == "A":
+        t_i = tweak(i, n, m, static["key_sum"])
+        sp = StepSpec(i, "A", {"v": static["v_blocks"][i], "prev": vec, "t": t_i, "m": m}, "u = (v + prev + t) mod m", "u", n)
+    elif phase == "B":
+        sp = StepSpec(i, "B", {"u": vec, "m": m, "sbox": "x^3 mod m"}, "u_prime = S(u)", "u_prime", n)
+    elif phase == "C":
+        sp = StepSpec(i, "C", {"M": static["M"], "u_prime": vec, "m": m}, "w = M * u_prime mod m", "w", n)
+    elif phase == "D":
+        t_i = tweak(i, n, m, static["key_sum"])
+        sp = StepSpec(i, "D", {"w": vec, "b": static["b"], "t": t_i, "m": m}, "c = (w + b + t) mod m", "c", n)
+    else:
+        raise ValueError(f"Fase desconocida: {phase}")
+    out = {"type": "step", "block": sp.block, "phase": sp.phase, "inputs": sp.inputs,
+           "op": sp.op, "output_name": sp.output_name}
+    for k in ("turn_cid", "you_turn"):
+        if k in delta:
+            out[k] = delta[k]
+    return out
+
 def next_step(state: GameState) -> StepSpec:
     n, m = state.n, state.m
     i = state.current_block
@@ -214,9 +468,8 @@ def validate_step(state: GameState, phase: str, vector: List[int]) -> Tuple[bool
             return False, f"ASCII mensaje incorrecto. Esperado {state.expected_msg_ascii}"
 
         # a partir de aquí hay que estar en bloque i
-        t_i = tweak(i, n, m, state.key_sum)
-
         if phase == "A":
+            t_i = tweak(i, n, m, state.key_sum)
             comp = [(state.v_blocks[i][j] + state.prev_vec[j] + t_i[j]) % m for j in range(n)]
             if vector == comp:
                 state.u = vector
@@ -229,7 +482,8 @@ def validate_step(state: GameState, phase: str, vector: List[int]) -> Tuple[bool
             if state.u is None:
                 state.errors += 1
                 return False, "Completa fase A primero."
-            comp = [sbox(x, m) for x in state.u]
+            S = sbox_tables(m)[0]
+            comp = [S[x % m] for x in state.u]
             if vector == comp:
                 state.uprime = vector
                 state.current_phase = "C"
@@ -253,7 +507,12 @@ def validate_step(state: GameState, phase: str, vector: List[int]) -> Tuple[bool
             if state.w is None:
                 state.errors += 1
                 return False, "Completa fase C primero."
-            comp = [(state.w[j] + state.b[j] + t_i[j]) % m for j in range(n)]
+            if i < len(state.d_offsets):
+                off = state.d_offsets[i]
+            else:
+                t_i = tweak(i, n, m, state.key_sum)
+                off = [(state.b[j] + t_i[j]) % m for j in range(n)]
+            comp = [(state.w[j] + off[j]) % m for j in range(n)]
             if vector == comp:
                 state.c_blocks.append(vector)
                 state.prev_vec = vector[:]
@@ -10,23 +10,23 @@
 # Proyecto: HASCILL
 # Repo: https://github.com/sebastiandperez/HASCILL-Crypto-Race
 
-import asyncio, json, struct, argparse, time
+import asyncio, argparse, time
+from collections import deque
 
-async def send_json(w, obj):
-    data = json.dumps(obj, ensure_ascii=False).encode("utf-8")
-    w.write(struct.pack(">I", len(data)) + data)
+from game_core import step_from_delta
+from hascill_wire import PROTO_JSON, encode, read_frame
+
+async def send_json(w, obj, proto: int = PROTO_JSON):
+    w.write(encode(obj, proto))
     await w.drain()
 
 async def recv_json(r):
-    try:
-        hdr = await r.readexactly(4)
-        ln = struct.unpack(">I", hdr)[0]
-        data = await r.readexactly(ln)
-        return json.loads(data.decode("utf-8"))
-    except asyncio.IncompleteReadError:
-        return None
-    except Exception:
-        return None
+    # entiende frames JSON (v1) y binarios (v2) indistintamente
+    return await read_frame(r)
+
+async def ainput(prompt: str) -> str:
+    """input() en un thread: mientras el jugador escribe, el loop sigue (heartbeat, mensajes)."""
+    return await asyncio.get_running_loop().run_in_executor(None, input, prompt)
 
 async def heartbeat_task(writer):
     while True:
@@ -36,39 +36,106 @@ async def heartbeat_task(writer):
         except Exception:
             return
 
+async def connect_join(host: str, port: int, join: dict, max_redirects: int = 3):
+    """Conecta, saluda y envía join; sigue el "redirect" del modo --workers.
+
+    Devuelve (reader, writer, primer mensaje tras el join).
+    """
+    for _ in range(max_redirects + 1):
+        reader, writer = await asyncio.open_connection(host, port)
+        print(f"[CLIENT] Conectado a {host}:{port}")
+        hello = await recv_json(reader)
+        if hello:
+            print(hello.get("msg"), f"(proto={hello.get('proto')})")
+        await send_json(writer, join)
+        first = await recv_json(reader)
+        if not (first and first.get("type") == "redirect"):
+            return reader, writer, first
+        port = int(first["port"])
+        print(f"[CLIENT] La sala '{first.get('room')}' vive en otro worker → puerto {port}")
+        writer.close()
+    raise RuntimeError("Demasiadas redirecciones")
+
+async def reconnect(host: str, port: int, join: dict, session: str, attempts: int = 5):
+    """Tras un corte, reintenta el join con el token de sesión (mismo id y lugar en el turno).
+
+    Devuelve lo mismo que connect_join, o None si no hubo caso.
+    """
+    delay = 0.5
+    for k in range(attempts):
+        try:
+            return await connect_join(host, port, dict(join, session=session))
+        except (OSError, RuntimeError) as e:
+            print(f"[CLIENT] Reconexión {k+1}/{attempts} falló ({e}); reintento en {delay:.1f}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 8.0)
+    return None
+
 async def main():
     ap = argparse.ArgumentParser(description="Hill+ Client (async)")
     ap.add_argument("--host", default="127.0.0.1")
     ap.add_argument("--port", type=int, default=5050)
     ap.add_argument("--team", type=int, required=True)
+    ap.add_argument("--room", default=None, help="id de sala (por defecto la sala principal)")
+    ap.add_argument("--proto", type=int, choices=(1, 2), default=2,
+                    help="protocolo: 1 = JSON, 2 = binario compacto (si el server lo acepta)")
+    ap.add_argument("--delta", action="store_true",
+                    help="recibir sólo lo que cambia en cada paso (parámetros del reto una vez)")
     args = ap.parse_args()
 
-    reader, writer = await asyncio.open_connection(args.host, args.port)
-    print(f"[CLIENT] Conectado a {args.host}:{args.port}")
-
-    hello = await recv_json(reader)
-    if hello:
-        print(hello.get("msg"), f"(proto={hello.get('proto')})")
-
-    await send_json(writer, {"type":"join","team":args.team})
+    join = {"type":"join","team":args.team,"proto":args.proto,"delta":args.delta}
+    if args.room:
+        join["room"] = args.room
+    reader, writer, first = await connect_join(args.host, args.port, join)
+    pending = deque([first])
 
     my_id = None
+    proto = PROTO_JSON
+    session = None  # token para retomar la sesión si se corta la conexión
+    static = None   # parámetros del reto (modo delta)
     hb = asyncio.create_task(heartbeat_task(writer))
     frozen = False
 
     while True:
-        msg = await recv_json(reader)
+        if pending:
+            msg = pending.popleft()
+        else:
+            msg = await recv_json(reader)
         if msg is None:
-            print("[CLIENT] Conexión cerrada.")
             hb.cancel()
-            return
+            if session is None or frozen:
+                print("[CLIENT] Conexión cerrada.")
+                return
+            print("[CLIENT] Conexión perdida; reconectando con la sesión…")
+            res = await reconnect(args.host, args.port, join, session)
+            if res is None:
+                print("[CLIENT] No se pudo reconectar.")
+                return
+            reader, writer, first = res
+            pending.append(first)
+            hb = asyncio.create_task(heartbeat_task(writer))
+            continue
 
         t = msg.get("type")
+        if t == "resume":
+            # puesta al día en un solo frame: joined, equipo, turno y el paso en curso
+            pending.extend(msg.get("msgs", []))
+            continue
+        if t == "challenge":
+            static = msg
+            continue
+        if t == "step_delta" and static is not None:
+            msg = step_from_delta(static, msg)   # mismo formato que un "step" completo
+            t = "step"
 
         if t == "joined":
             my_id = msg.get("your_id")
+            proto = msg.get("proto", PROTO_JSON)   # un server viejo no lo envía: JSON
+            session = msg.get("session")
             info = msg.get("info", {})
-            print(f"🆔 Tu ID: {my_id} | Rotación: {info.get('rotate','?')}")
+            if msg.get("resumed"):
+                print(f"🔌 Sesión retomada: sigues siendo el jugador {my_id}")
+            print(f"🆔 Tu ID: {my_id} | Sala: {msg.get('room','default')} | Rotación: {info.get('rotate','?')}")
             print(f"📝 Password: '{info.get('password')}', Message: '{info.get('message')}'")
             print("ℹ️ ", info.get("note",""))
 
@@ -76,7 +143,7 @@ async def main():
             print(f"📊 [EQUIPO {msg.get('team')}] Conectados: {msg.get('connected')} | ⏳ {msg.get('ready_count')}/{msg.get('connected')} listos")
 
         elif t == "task" and msg.get("task") == "ready":
-            s = input("➤ Escribe 'READY' cuando estés listo: ").strip().lower()
+            s = (await ainput("➤ Escribe 'READY' cuando estés listo: ")).strip().lower()
             if s == "ready":
                 await send_json(writer, {"type":"ready"})
             else:
@@ -107,13 +174,13 @@ async def main():
 
             if you_turn:
                 exp = 4 if phase in ("TPW","TMSG") else 2
-                vec_str = input(f"• Tu turno: ingresa vector ({exp} enteros separados por coma): ").strip()
+                vec_str = (await ainput(f"• Tu turno: ingresa vector ({exp} enteros separados por coma): ")).strip()
                 try:
                     vec = [int(x) for x in vec_str.replace(" ","").split(",") if x!=""]
                 except:
                     print("Formato inválido.")
                     continue
-                await send_json(writer, {"type":"step_answer","phase":phase,"block":block,"vector":vec})
+                await send_json(writer, {"type":"step_answer","phase":phase,"block":block,"vector":vec}, proto)
             else:
                 print("   (No es tu turno. Observa y prepárate)")
 
@@ -10,50 +10,511 @@
 # Proyecto: HASCILL
 # Repo: https://github.com/sebastiandperez/HASCILL-Crypto-Race
 
-import asyncio, json, struct, time, argparse, logging, shlex
+import asyncio, json, struct, time, argparse, logging, shlex, re, math, reprlib, secrets
 from dataclasses import dataclass, field
 from typing import Dict, Optional, Tuple, List
-from collections import deque
+from collections import deque, OrderedDict
 
 from game_core import (
-    GameState, initial_state, next_step, validate_step
+    Challenge, ChallengeCursor, build_challenge, challenge_static, cursor_validate, step_delta
 )
+from hascill_journal import Journal
+from hascill_metrics import LAG_BUCKETS, Histogram, metric, render, sample_loop_lag, start_metrics_server
+from hascill_wire import PROTO_BIN, PROTO_JSON, decode_body, delta_head, encode, frame, step_head, step_tail
 
 HOST, PORT = "0.0.0.0", 5050
 MAX_TEAMS = 6
 N = 2
-PROTO_VER = 1
+PROTO_VER = PROTO_BIN   # máxima versión que acepta el server (1 = JSON, 2 = binario)
 HEARTBEAT_SEC = 20
-RATE_LIMIT_WINDOW = 2.0
-RATE_LIMIT_MAX = 6
+IDLE_TIMEOUT = 0.0    # s sin recibir ningún frame antes de cortar la conexión (0 = nunca)
+JOIN_TIMEOUT = 30.0   # s para enviar el join tras el hello (si idle_timeout es 0)
+TURN_TIMEOUT = 0.0    # s máx. por turno antes de pasarlo al siguiente jugador (0 = sin límite)
+SESSION_GRACE = 90.0  # s que un jugador caído conserva id y lugar en el turno (0 = se va al caer)
+WHEEL_TICK = 1.0      # resolución de la rueda de timers
+WHEEL_SLOTS = 128     # slots de la rueda (timers más largos dan vueltas)
+# token bucket por conexión y tipo de mensaje: (tokens/s, ráfaga); "*" cubre el resto de tipos
+RATE_LIMITS: Dict[str, Tuple[float, float]] = {
+    "step_answer": (3.0, 6),
+    "ready": (1.0, 4),
+    "pong": (1.0, 4),
+    "*": (5.0, 10),
+}
+DRAIN_TIMEOUT = 5.0   # s máx. que la tarea escritora espera a un cliente
+OUTQ_MAX = 256        # frames pendientes por conexión
+OUTQ_POLICY = "drop"  # al desbordar: "drop" (descarta ping/turn viejos) o "disconnect"
+DROPPABLE = ("ping", "turn", "throttle")   # mensajes que un frame posterior deja obsoletos
+DEFAULT_ROOM = "default"
+MAX_ROOMS = 512
+ROOM_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,32}$")
+CHALLENGE_CACHE_MAX = 256   # retos (password, mensaje) compartidos entre salas
+MAX_FRAME = 1_000_000       # bytes máx. de un frame (sin la cabecera de 4)
+INBOX_HIGH = 64             # mensajes sin leer antes de pausar la lectura del socket
+
+# ===== métricas del hot path (se exponen con --metrics-port, ver hascill_metrics) =====
+H_VALIDATE = Histogram("hascill_validate_seconds", "Validación de un step_answer, por fase esperada", label="phase")
+H_ENCODE = Histogram("hascill_encode_seconds", "Codificación de un frame saliente, por protocolo", label="proto")
+H_DECODE = Histogram("hascill_decode_seconds", "Decodificación de un frame entrante")
+H_FANOUT = Histogram("hascill_fanout_seconds", "Codificar y encolar un mensaje a todo un grupo", label="type")
+H_LOOP_LAG = Histogram("hascill_loop_lag_seconds", "Retraso del event loop al despertar un sleep", LAG_BUCKETS)
+HISTOGRAMS = (H_VALIDATE, H_ENCODE, H_DECODE, H_FANOUT, H_LOOP_LAG)
+
+# ===== journal de respuestas rechazadas =====
+# lo que manda el cliente sólo se anota tal cual si tiene la forma de una respuesta;
+# si no, un repr recortado: un frame de basura no puede inflar events.log
+_CLIP = reprlib.Repr()
+_CLIP.maxlist = _CLIP.maxtuple = _CLIP.maxdict = 8
+_CLIP.maxstring = _CLIP.maxlong = _CLIP.maxother = 24
+ANSWER_PHASES = ("TPW", "TMSG", "A", "B", "C", "D")
+
+def journal_answer(phase, block, vec, exp_len: int) -> dict:
+    """Campos phase/block/vec de un "answer" para el journal, acotados en tamaño."""
+    out = {"phase": phase if phase in ANSWER_PHASES else _CLIP.repr(phase),
+           "block": block if type(block) is int and -1 <= block < 1 << 16 else _CLIP.repr(block)}
+    if isinstance(vec, list) and len(vec) == exp_len and all(type(x) is int and 0 <= x < 1 << 16 for x in vec):
+        out["vec"] = vec
+    else:
+        out["vec"] = _CLIP.repr(vec)
+        out["vec_len"] = len(vec) if isinstance(vec, (list, str)) else None
+    return out
 
 # ===== framing =====
-async def send_json(w: asyncio.StreamWriter, obj: dict):
+def encode_frame(obj: dict, proto: int = PROTO_JSON) -> bytes:
+    t0 = time.perf_counter()
+    f = encode(obj, proto)
+    H_ENCODE.observe(time.perf_counter() - t0, proto)
+    return f
+
+async def send_json(w, obj: dict):
     try:
-        data = json.dumps(obj, ensure_ascii=False).encode("utf-8")
-        w.write(struct.pack(">I", len(data)) + data)
+        w.write(encode_frame(obj))
         await w.drain()
     except Exception:
         pass
 
-async def recv_json(r: asyncio.StreamReader):
-    try:
-        hdr = await r.readexactly(4)
-        (ln,) = struct.unpack(">I", hdr)
-        if ln <= 0 or ln > 1_000_000: return None
-        data = await r.readexactly(ln)
-        return json.loads(data.decode("utf-8"))
-    except asyncio.IncompleteReadError:
-        return None
-    except Exception:
-        return None
+# ===== transporte: parser de frames sobre asyncio.Protocol =====
+class FrameConn(asyncio.Protocol):
+    """Conexión del server: parsea frames [u32 BE len][cuerpo v1/v2] directo de los chunks.
+
+    Un data_received puede decodificar muchos frames: se recorre el chunk con un
+    cursor sobre memoryview y sólo lo que queda incompleto se copia al buffer.
+    Hace de lector (recv) y de escritor (write/drain/close, la interfaz que usa
+    Outbox), así handle_conn recibe este mismo objeto como reader y writer.
+    """
+    def __init__(self, handler):
+        self._handler = handler
+        self._loop = asyncio.get_running_loop()
+        self.transport: Optional[asyncio.Transport] = None
+        self._buf = bytearray()
+        self._inbox: deque = deque()
+        self._waiter: Optional[asyncio.Future] = None
+        self._eof = False
+        self._read_paused = False
+        self._write_paused = False
+        self._drainers: List[asyncio.Future] = []
+        self._closed = self._loop.create_future()
+        self._task: Optional[asyncio.Task] = None
+
+    # ---- asyncio.Protocol ----
+    def connection_made(self, transport):
+        self.transport = transport
+        self._task = self._loop.create_task(self._handler(self, self))
+        self._task.add_done_callback(self._handler_done)
+
+    def _handler_done(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Error en conexión {self.get_extra_info('peername')}: {task.exception()}")
+            self.transport.close()
+
+    def data_received(self, data: bytes):
+        if self._eof:
+            return
+        if self._buf:
+            self._buf += data
+            mv = memoryview(self._buf)
+        else:
+            mv = memoryview(data)
+        pos, end = 0, len(mv)
+        while end - pos >= 4:
+            ln = int.from_bytes(mv[pos:pos+4], "big")
+            if ln <= 0 or ln > MAX_FRAME:
+                self._fail()
+                break
+            if end - pos - 4 < ln:
+                break
+            try:
+                t0 = time.perf_counter()
+                self._inbox.append(decode_body(mv[pos+4:pos+4+ln]))
+                H_DECODE.observe(time.perf_counter() - t0)
+            except ValueError:
+                self._fail()
+                break
+            pos += 4 + ln
+        if self._buf:
+            mv.release()
+            if self._buf:        # _fail() pudo vaciarlo
+                del self._buf[:pos]
+        else:
+            if pos < end and not self._eof:
+                self._buf = bytearray(mv[pos:])   # sólo se copia el frame incompleto
+            mv.release()
+        if len(self._inbox) >= INBOX_HIGH and not self._read_paused:
+            self._read_paused = True
+            self.transport.pause_reading()
+        self._wake()
+
+    def eof_received(self):
+        self._eof = True
+        self._wake()
+
+    def connection_lost(self, exc):
+        self._eof = True
+        self._wake()
+        for f in self._drainers:
+            if not f.done():
+                f.set_exception(ConnectionResetError("conexión cerrada"))
+        self._drainers.clear()
+        if not self._closed.done():
+            self._closed.set_result(None)
+
+    def pause_writing(self):
+        self._write_paused = True
+
+    def resume_writing(self):
+        self._write_paused = False
+        for f in self._drainers:
+            if not f.done():
+                f.set_result(None)
+        self._drainers.clear()
+
+    def _fail(self):
+        # frame inválido (largo fuera de rango o cuerpo roto): recv devuelve None
+        self._eof = True
+        self._buf = bytearray()
+        self.transport.pause_reading()
+
+    def _wake(self):
+        w = self._waiter
+        if w is not None and not w.done():
+            w.set_result(None)
+
+    # ---- lado lector ----
+    async def recv(self) -> Optional[dict]:
+        """Siguiente mensaje decodificado; None al cerrar o ante un frame inválido."""
+        while not self._inbox:
+            if self._eof:
+                return None
+            self._waiter = self._loop.create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        msg = self._inbox.popleft()
+        if self._read_paused and len(self._inbox) <= INBOX_HIGH // 2 and not self._eof:
+            self._read_paused = False
+            self.transport.resume_reading()
+        return msg
+
+    # ---- lado escritor (interfaz de StreamWriter que usan Outbox y send_json) ----
+    def write(self, data: bytes):
+        self.transport.write(data)
+
+    def writelines(self, frames):
+        self.transport.writelines(frames)
+
+    async def drain(self):
+        if self._closed.done():
+            raise ConnectionResetError("conexión cerrada")
+        if not self._write_paused:
+            return
+        f = self._loop.create_future()
+        self._drainers.append(f)
+        await f
+
+    def get_extra_info(self, name: str, default=None):
+        return self.transport.get_extra_info(name, default)
+
+    def is_closing(self) -> bool:
+        return self.transport.is_closing()
+
+    def close(self):
+        self.transport.close()
+
+    async def wait_closed(self):
+        await asyncio.shield(self._closed)
+
+async def start_frame_server(handler, host: str, port: int, **kw):
+    """Como asyncio.start_server, pero cada conexión es un FrameConn."""
+    loop = asyncio.get_running_loop()
+    return await loop.create_server(lambda: FrameConn(handler), host, port, **kw)
+
+# ===== rate limit =====
+class TokenBucket:
+    """Bucket de tokens O(1): se recarga a `rate` por segundo hasta `burst`."""
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate, self.burst = rate, burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+
+    def take(self, now: float) -> bool:
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+def parse_rate_limits(specs: List[str]) -> Dict[str, Tuple[float, float]]:
+    """RATE_LIMITS con los overrides "tipo=tasa/ráfaga" de la CLI (p.ej. step_answer=3/6)."""
+    limits = dict(RATE_LIMITS)
+    for spec in specs:
+        try:
+            kind, val = spec.split("=", 1)
+            rate, burst = (float(x) for x in val.split("/", 1))
+        except ValueError:
+            raise ValueError(f"rate limit inválido '{spec}' (formato tipo=tasa/ráfaga)")
+        if not kind or rate <= 0 or burst < 1:
+            raise ValueError(f"rate limit inválido '{spec}' (tasa > 0, ráfaga >= 1)")
+        limits[kind] = (rate, burst)
+    return limits
+
+# ===== timers =====
+class Timer:
+    __slots__ = ("cb", "args", "rounds", "cancelled")
+
+    def __init__(self, cb, args: tuple, rounds: int):
+        self.cb, self.args, self.rounds = cb, args, rounds
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class TimerWheel:
+    """Rueda de timers hasheada: agendar y cancelar son O(1) y cada tick sólo
+    recorre su slot, así el costo no depende del total de conexiones.
+
+    Los callbacks son síncronos; el trabajo async se lanza como tarea.
+    """
+    def __init__(self, tick: float = WHEEL_TICK, slots: int = WHEEL_SLOTS):
+        self.tick = tick
+        self.slots: List[List[Timer]] = [[] for _ in range(slots)]
+        self.cursor = 0
+
+    def __len__(self):
+        return sum(len(s) for s in self.slots)
+
+    def call_later(self, delay: float, cb, *args) -> Timer:
+        ticks = max(1, math.ceil(delay / self.tick))
+        size = len(self.slots)
+        t = Timer(cb, args, (ticks - 1) // size)
+        self.slots[(self.cursor + ticks) % size].append(t)
+        return t
+
+    def advance(self):
+        self.cursor = (self.cursor + 1) % len(self.slots)
+        due = self.slots[self.cursor]
+        keep = self.slots[self.cursor] = []   # lo que agenden los callbacks cae aquí, no en `due`
+        for t in due:
+            if t.cancelled:
+                continue
+            if t.rounds:
+                t.rounds -= 1
+                keep.append(t)
+                continue
+            try:
+                t.cb(*t.args)
+            except Exception as e:
+                logging.error(f"Error en timer {getattr(t.cb, '__name__', t.cb)}: {e}")
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        nxt = loop.time()
+        while True:
+            nxt += self.tick
+            await asyncio.sleep(max(0.0, nxt - loop.time()))
+            self.advance()
+
+# ===== cola de salida =====
+class Outbox:
+    """Cola de salida acotada de una conexión, servida por su propia tarea escritora.
+
+    La lógica de juego sólo encola frames ya codificados (put no bloquea);
+    el drain del socket ocurre aquí, así un cliente lento no frena a su equipo.
+    """
+    def __init__(self, writer: "FrameConn", maxsize: int = OUTQ_MAX, policy: str = OUTQ_POLICY):
+        assert policy in ("drop", "disconnect")
+        self.writer = writer
+        self.maxsize = maxsize
+        self.policy = policy
+        self.q: deque = deque()       # (tipo, frame)
+        self.wake = asyncio.Event()
+        self.closed = False
+        self.sent = 0
+        self.dropped = 0
+        self.high = 0                 # profundidad máxima observada
+        self.task = asyncio.create_task(self._run())
+
+    def __len__(self):
+        return len(self.q)
+
+    def put(self, frame: bytes, kind: str = "") -> bool:
+        if self.closed:
+            return False
+        if len(self.q) >= self.maxsize and not self._make_room(kind):
+            return False
+        self.q.append((kind, frame))
+        if len(self.q) > self.high:
+            self.high = len(self.q)
+        self.wake.set()
+        return True
+
+    def _make_room(self, kind: str) -> bool:
+        if self.policy == "drop":
+            for k, (qk, _) in enumerate(self.q):
+                if qk in DROPPABLE:
+                    del self.q[k]
+                    self.dropped += 1
+                    return True
+            if kind in DROPPABLE:
+                self.dropped += 1
+                return False
+        logging.warning(f"cola de salida llena ({self.maxsize}) hacia {self.writer.get_extra_info('peername')}: desconectando")
+        self.close(flush=False)
+        return False
+
+    async def _run(self):
+        w = self.writer
+        try:
+            while True:
+                if not self.q:
+                    self.wake.clear()
+                    await self.wake.wait()
+                    continue
+                frames = [f for _, f in self.q]
+                self.q.clear()
+                w.writelines(frames)
+                self.sent += len(frames)
+                await asyncio.wait_for(w.drain(), DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logging.warning(f"drain lento (> {DRAIN_TIMEOUT}s) hacia {w.get_extra_info('peername')}: desconectando")
+            self.close(flush=False)
+        except (ConnectionError, RuntimeError):
+            self.close(flush=False)
+        except Exception as e:   # cualquier otro fallo: sin escritora la conexión no drenaría nunca
+            logging.error(f"Error en la escritora hacia {w.get_extra_info('peername')}: {e!r}")
+            self.close(flush=False)
+
+    def close(self, flush: bool = True):
+        """Cierra la conexión. Con flush, los frames pendientes salen antes del FIN."""
+        if self.closed:
+            return
+        self.closed = True
+        if self.task is not asyncio.current_task():
+            self.task.cancel()
+        try:
+            if flush:
+                self.writer.writelines([f for _, f in self.q])
+                self.writer.close()
+            else:
+                self.writer.transport.abort()
+        except Exception:
+            pass
+        self.q.clear()
+
+# ===== frames "step" pre-codificados =====
+class StepFrames:
+    """Frames "step" de un Challenge, codificados una sola vez.
+
+    Cada paso guarda su JSON sin la llave final; al empujarlo sólo se
+    empalman turn_cid y las dos variantes de you_turn como bytes. Para v2
+    guarda el cuerpo binario sin la cola (turn_cid, you_turn), que va al final.
+    Lo mismo para los "step_delta" del modo delta, más el frame "challenge"
+    con los parámetros estáticos que esas conexiones reciben una sola vez.
+    """
+    _YES = b', "you_turn": true}'
+    _NO = b', "you_turn": false}'
+
+    def __init__(self, challenge: Challenge):
+        self.challenge = challenge
+        self.heads = [json.dumps(p, ensure_ascii=False).encode("utf-8")[:-1] for p in challenge.payloads]
+        self.bin_heads = [step_head(p) for p in challenge.payloads]
+        deltas = [step_delta(challenge, k) for k in range(len(challenge))]
+        self.delta_heads = [json.dumps(d, ensure_ascii=False).encode("utf-8")[:-1] for d in deltas]
+        self.delta_bin_heads = [delta_head(d) for d in deltas]
+        self.static_frame = encode_frame(challenge_static(challenge))
+
+    def frames(self, pos: int, turn_cid: Optional[int], proto: int = PROTO_JSON,
+               delta: bool = False) -> Tuple[bytes, bytes]:
+        """(frame para quien tiene el turno, frame para el resto)."""
+        if proto >= PROTO_BIN:
+            head = (self.delta_bin_heads if delta else self.bin_heads)[pos]
+            return frame(head + step_tail(turn_cid, True)), frame(head + step_tail(turn_cid, False))
+        head = (self.delta_heads if delta else self.heads)[pos] + b', "turn_cid": ' + (b"null" if turn_cid is None else str(turn_cid).encode())
+        yes, no = head + self._YES, head + self._NO
+        return struct.pack(">I", len(yes)) + yes, struct.pack(">I", len(no)) + no
+
+# Salas con el mismo password/mensaje comparten Challenge y StepFrames.
+_CHALLENGES: "OrderedDict[Tuple[str, str, int], Tuple[Challenge, StepFrames]]" = OrderedDict()
+
+def get_challenge(password: str, message: str, n: int = N) -> Tuple[Challenge, StepFrames]:
+    k = (password, message, n)
+    hit = _CHALLENGES.get(k)
+    if hit is not None:
+        _CHALLENGES.move_to_end(k)
+        return hit
+    ch = build_challenge(password, message, n)
+    hit = _CHALLENGES[k] = (ch, StepFrames(ch))
+    if len(_CHALLENGES) > CHALLENGE_CACHE_MAX:
+        _CHALLENGES.popitem(last=False)
+    return hit
+
+# respuesta única a todo frame rechazado por rate limit, ya codificada por versión
+THROTTLE_MSG = {"type":"error","msg":"⏱️ Demasiados intentos. Espera un momento e inténtalo de nuevo."}
+THROTTLE_FRAMES = {p: encode_frame(THROTTLE_MSG, p) for p in (PROTO_JSON, PROTO_BIN)}
 
 # ===== server state =====
 @dataclass
 class ClientConn:
-    reader: asyncio.StreamReader
-    writer: asyncio.StreamWriter
-    last_steps: deque = field(default_factory=lambda: deque(maxlen=32))
+    reader: FrameConn
+    writer: FrameConn
+    outbox: Outbox
+    buckets: Dict[str, TokenBucket] = field(default_factory=dict)   # por tipo de mensaje
+    throttled: int = 0                                              # frames rechazados
+    last_seen: float = field(default_factory=time.monotonic)        # último frame recibido
+    proto: int = PROTO_JSON   # versión negociada en el join
+    delta: bool = False       # recibe step_delta en vez de step completos
+    static_of: Optional[Challenge] = field(default=None, repr=False)   # reto cuyo "challenge" ya recibió
+
+    def send(self, obj: dict) -> bool:
+        return self.outbox.put(encode_frame(obj, self.proto), obj.get("type", ""))
+
+    def close(self, flush: bool = True):
+        self.outbox.close(flush)
+
+def broadcast(conns: List[ClientConn], obj: dict):
+    """Codifica obj una vez por versión de protocolo presente y lo encola en cada conexión."""
+    t0 = time.perf_counter()
+    kind = obj.get("type", "")
+    frames: Dict[int, bytes] = {}
+    for cc in conns:
+        f = frames.get(cc.proto)
+        if f is None:
+            f = frames[cc.proto] = encode_frame(obj, cc.proto)
+        cc.outbox.put(f, kind)
+    H_FANOUT.observe(time.perf_counter() - t0, kind)
+
+def queue_stats(conns: List[ClientConn]) -> dict:
+    """Métrica de colas de salida: profundidad actual/máxima y descartes."""
+    obs = [cc.outbox for cc in conns]
+    return {"conns": len(obs),
+            "depth": sum(len(o) for o in obs),
+            "depth_max": max((len(o) for o in obs), default=0),
+            "high_water": max((o.high for o in obs), default=0),
+            "sent": sum(o.sent for o in obs),
+            "dropped": sum(o.dropped for o in obs),
+            "throttled": sum(cc.throttled for cc in conns)}
 
 @dataclass
 class TeamSrvState:
@@ -61,68 +522,204 @@ class TeamSrvState:
     conns: Dict[int, ClientConn] = field(default_factory=dict)
     ready: set = field(default_factory=set)
     turn_order: deque = field(default_factory=deque)  # client_ids
-    game: Optional[GameState] = None
+    game: Optional[ChallengeCursor] = None
     started_at: Optional[float] = None
     win_time: Optional[float] = None
+    # protege conns/ready/turn_order/game de este equipo; los demás equipos no esperan
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+    turn_key: Optional[Tuple[Optional[int], int]] = None   # (jugador, paso) con deadline armado
+    turn_seq: int = 0                                       # invalida deadlines viejos
+    sessions: Dict[int, str] = field(default_factory=dict)    # cid -> token de sesión (miembros)
+    detached: Dict[int, float] = field(default_factory=dict)  # cid caído en gracia -> instante de caída
+
+    def record(self) -> dict:
+        """Registro persistible del equipo (ver hascill_journal)."""
+        g = self.game
+        return {"game": g is not None, "pos": g.pos if g else 0, "errors": g.errors if g else 0,
+                "started_at": self.started_at, "win_time": self.win_time,
+                "order": list(self.turn_order), "ready": sorted(self.ready), "members": list(self.conns),
+                "sessions": {str(c): tok for c, tok in self.sessions.items()}, "detached": list(self.detached)}
 
     def current_player(self) -> Optional[int]:
         return self.turn_order[0] if self.turn_order else None
 
+    def skip_detached(self):
+        """Si el turno cae en un jugador caído, lo pasa al siguiente conectado (conserva su lugar)."""
+        for _ in range(len(self.turn_order)):
+            if self.turn_order[0] in self.conns:
+                return
+            self.turn_order.rotate(-1)
+
     def rotate_phase(self):
         if self.turn_order:
             self.turn_order.rotate(-1)
+            self.skip_detached()
 
     def rotate_block(self):
         if self.turn_order:
             self.turn_order.rotate(-1)
+            self.skip_detached()
 
-class HillServer:
-    def __init__(self, password: str, message: str, rotate: str):
+class Room:
+    """Una carrera: reto, equipos 1..6, turnos, scoreboard y poderes de admin propios."""
+    def __init__(self, room_id: str, password: str, message: str, rotate: str,
+                 wheel: Optional[TimerWheel] = None, turn_timeout: float = TURN_TIMEOUT,
+                 journal: Optional[Journal] = None, session_grace: float = SESSION_GRACE):
         assert rotate in ("phase","block")
-        self.password = password
-        self.message  = message
+        self.room_id  = room_id
         self.rotate   = rotate
+        self.wheel = wheel
+        self.turn_timeout = turn_timeout
+        self.journal = journal
+        self.session_grace = session_grace
+        self.sessions: Dict[str, Tuple[int, int]] = {}   # token -> (team, cid)
+        # reto compartido: se calcula una vez por password/mensaje
+        self.set_challenge(password, message)
 
         self.teams: Dict[int, TeamSrvState] = {}
-        self.next_client_id = 0
 
         self.start_flag = False
         self.start_time: Optional[float] = None
         self.winner_team: Optional[int] = None
         self.game_over = False
         self.paused = False
+        self.closed = False
 
+        # sólo para la transición lobby → countdown; el countdown corre fuera del lock
         self.lock = asyncio.Lock()
-        self._hb_task: Optional[asyncio.Task] = None
+        self._start_task: Optional[asyncio.Task] = None
 
-        logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s')
+    def set_challenge(self, password: str, message: str):
+        """Fija password/mensaje y toma el reto y sus frames "step" del cache compartido."""
+        self.challenge, self.step_frames = get_challenge(password, message, N)
+        self.password, self.message = password, message
+
+    def conns(self) -> List[ClientConn]:
+        return [cc for ts in self.teams.values() for cc in ts.conns.values()]
+
+    # ------- persistencia -------
+    def record(self) -> dict:
+        return {"password": self.password, "message": self.message, "rotate": self.rotate,
+                "start_flag": self.start_flag, "start_time": self.start_time, "paused": self.paused,
+                "game_over": self.game_over, "winner": self.winner_team}
+
+    def restore(self, rs: dict, teams: Dict[str, dict]):
+        """Rehace sala y equipos desde el modelo del journal (sin conexiones vivas)."""
+        self.start_flag, self.start_time = rs["start_flag"], rs["start_time"]
+        self.paused, self.game_over, self.winner_team = rs["paused"], rs["game_over"], rs["winner"]
+        for tid, t in teams.items():
+            ts = self.get_team(int(tid))
+            ts.game = ChallengeCursor(self.challenge, t["pos"], t["errors"]) if t["game"] else None
+            ts.started_at, ts.win_time = t["started_at"], t["win_time"]
+            ts.turn_order = deque(t["order"])
+            # nadie sigue conectado tras un reinicio: con la carrera en curso los miembros con
+            # sesión quedan en gracia; el resto (o todos, en lobby o tras game_over) se va
+            if self.session_grace > 0 and ts.game is not None and not self.game_over:
+                for c, tok in t.get("sessions", {}).items():
+                    self.attach_session(ts, int(c), tok)
+                    self.detach(ts, int(c))
+            ts.turn_order = deque(c for c in ts.turn_order if c in ts.detached)
+
+    # ------- sesiones -------
+    def attach_session(self, ts: TeamSrvState, cid: int, token: str):
+        ts.sessions[cid] = token
+        self.sessions[token] = (ts.team_id, cid)
+
+    def drop_session(self, ts: TeamSrvState, cid: int):
+        ts.detached.pop(cid, None)
+        tok = ts.sessions.pop(cid, None)
+        if tok is not None:
+            self.sessions.pop(tok, None)
+
+    def detach(self, ts: TeamSrvState, cid: int):
+        """Marca al jugador como caído: conserva id y lugar en turn_order hasta que venza la gracia."""
+        stamp = ts.detached[cid] = time.monotonic()
+        if self.wheel is not None:
+            self.wheel.call_later(self.session_grace, self._grace_expired, ts, cid, stamp)
+        ts.skip_detached()
+
+    def drop_detached(self, ts: TeamSrvState):
+        """Fin de la carrera (game_over, reset, reto nuevo): los caídos ya no tienen paso que retomar."""
+        for cid in list(ts.detached):
+            self.drop_session(ts, cid)
+            if cid in ts.turn_order:
+                ts.turn_order.remove(cid)
+
+    def _grace_expired(self, ts: TeamSrvState, cid: int, stamp: float):
+        if ts.detached.get(cid) == stamp and not self.closed:
+            asyncio.create_task(self._expire_session(ts, cid, stamp))
+
+    async def _expire_session(self, ts: TeamSrvState, cid: int, stamp: float):
+        async with ts.lock:
+            if ts.detached.get(cid) != stamp:
+                return   # volvió (o fue expulsado) mientras tanto
+            was_turn = ts.game is not None and ts.current_player() == cid
+            self.drop_session(ts, cid)
+            if cid in ts.turn_order:
+                ts.turn_order.remove(cid)
+            ts.skip_detached()
+            self._journal("leave", ts, team=ts.team_id, cid=cid)
+        logging.info(f"Sesión vencida: cliente {cid} sala {self.room_id} equipo {ts.team_id}")
+        await self.send_turn_status(ts, step_follows=was_turn)
+        if was_turn:
+            await self.push_next_task(ts)
+
+    def catch_up(self, ts: TeamSrvState, cid: int, cc: ClientConn) -> List[dict]:
+        """Lo que una conexión necesita para retomar el paso en curso: [challenge,] step."""
+        g = ts.game
+        if g is None or g.finished or not self.start_flag or self.game_over or self.paused:
+            return []
+        cur = ts.current_player()
+        out = []
+        if cc.delta:
+            if cc.static_of is not g.challenge:
+                out.append(challenge_static(g.challenge))
+                cc.static_of = g.challenge
+            step = step_delta(g.challenge, g.pos)
+        else:
+            step = dict(g.challenge.payloads[g.pos])
+        step.update(turn_cid=cur, you_turn=(cid == cur))
+        out.append(step)
+        return out
+
+    def _journal(self, ev: str, *teams: TeamSrvState, room_state: bool = False, **fields):
+        """Anota un evento con la foto posterior de la sala y/o de los equipos que tocó."""
+        if self.journal is None:
+            return
+        rec = {"ev": ev, "room": self.room_id, **fields}
+        if room_state:
+            rec["room_state"] = self.record()
+        if teams:
+            rec["teams"] = {str(t.team_id): t.record() for t in teams}
+        self.journal.append(rec)
 
     # ------- util broadcast -------
     async def broadcast_team(self, ts: TeamSrvState, obj: dict):
-        for cc in list(ts.conns.values()):
-            await send_json(cc.writer, obj)
+        broadcast(list(ts.conns.values()), obj)
 
     async def broadcast_all(self, obj: dict):
-        for ts in self.teams.values():
-            for cc in list(ts.conns.values()):
-                await send_json(cc.writer, obj)
+        broadcast(self.conns(), obj)
 
-    async def get_team(self, tid: int) -> TeamSrvState:
-        async with self.lock:
-            if tid not in self.teams:
-                ts = TeamSrvState(team_id=tid)
-                self.teams[tid] = ts
-            return self.teams[tid]
+    def get_team(self, tid: int) -> TeamSrvState:
+        ts = self.teams.get(tid)
+        if ts is None:
+            ts = self.teams[tid] = TeamSrvState(team_id=tid)
+        return ts
 
-    async def send_turn_status(self, ts: TeamSrvState):
+    async def send_turn_status(self, ts: TeamSrvState, step_follows: bool = False):
+        """step_follows: le sigue un push_next_task, cuyo step_delta ya lleva el turno."""
         cur = ts.current_player()
+        order = list(ts.turn_order)
         for cid, cc in ts.conns.items():
-            await send_json(cc.writer, {"type":"turn","current":cur,"you_turn":(cid==cur),"order":list(ts.turn_order)})
+            if step_follows and cc.delta:
+                continue
+            cc.send({"type":"turn","current":cur,"you_turn":(cid==cur),"order":order})
 
     # ------- scoreboard -------
     def build_scoreboard(self) -> List[dict]:
+        """Lectura sin locks: foto de los equipos; cada cursor sólo avanza su posición."""
         rows = []
-        for tid, ts in self.teams.items():
+        for tid, ts in list(self.teams.items()):
             g = ts.game
             if g is None:
                 rows.append({"team": tid, "finished": False, "blocks_done": 0, "total_blocks": 0,
@@ -145,7 +742,8 @@ class HillServer:
         return rows
 
     def print_scoreboard(self, rows: List[dict]):
-        print("\n====== SCOREBOARD ======")
+        print("\n====== SCOREBOARD ======" if self.room_id == DEFAULT_ROOM
+              else f"\n====== SCOREBOARD [{self.room_id}] ======")
         if self.winner_team is not None:
             print(f"Ganador: Equipo {self.winner_team}")
         print(f"{'Team':<6}{'Estado':<10}{'Bloques':<10}{'Fase':<8}{'Errores':<8}{'Tiempo(s)':<10}")
@@ -161,108 +759,49 @@ class HillServer:
         self.print_scoreboard(rows)
         await self.broadcast_all({"type":"scoreboard","winner": self.winner_team, "rows": rows})
 
-    # ------- heartbeat -------
-    async def heartbeat_loop(self):
-        while True:
-            await asyncio.sleep(HEARTBEAT_SEC)
-            await self.broadcast_all({"type":"ping","ts": time.time(), "proto": PROTO_VER})
+    async def on_disconnect(self, team_id: int, cid: int, conn: Optional[ClientConn] = None):
+        """Baja de una conexión. Con sesión, gracia > 0 y la carrera en curso el jugador queda
+        "caído" y puede volver; en lobby o tras game_over se va como siempre.
 
-    # ------- network -------
-    async def handle_conn(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
-        addr = writer.get_extra_info("peername")
-        await send_json(writer, {"type":"hello","proto": PROTO_VER,"msg":"Únete con {'type':'join','team':N} (1..6)"})
-        msg = await recv_json(reader)
-        if not msg or msg.get("type") != "join":
-            await send_json(writer, {"type":"error","msg":"Debes unirte con {'type':'join','team':N}"})
-            writer.close(); await writer.wait_closed(); return
-        try:
-            team_id = int(msg.get("team"))
-            assert 1 <= team_id <= MAX_TEAMS
-        except Exception:
-            await send_json(writer, {"type":"error","msg":f"team debe estar entre 1 y {MAX_TEAMS}"})
-            writer.close(); await writer.wait_closed(); return
-
-        ts = await self.get_team(team_id)
-        async with self.lock:
-            self.next_client_id += 1
-            cid = self.next_client_id
-            ts.conns[cid] = ClientConn(reader, writer)
-            ts.ready.discard(cid)
-            if not self.start_flag and cid not in ts.turn_order:
-                ts.turn_order.append(cid)
-        logging.info(f"Cliente {cid} equipo {team_id} desde {addr}")
-
-        await send_json(writer, {"type":"joined","team":team_id,"your_id":cid,"info":{
-            "password": self.password, "message": self.message,
-            "note":"Todos marcan READY. Tras START: TPW, TMSG, A, B, C, D. Turnos rotativos.",
-            "rotate": self.rotate
-        }})
-        await self.broadcast_team(ts, {"type":"team_status","team":team_id,
-            "connected":len(ts.conns),"ready_count":len(ts.ready),
-            "ready_all": len(ts.conns)>0 and len(ts.ready)==len(ts.conns)})
-        await send_json(writer, {"type":"task","task":"ready","msg":"Envía {'type':'ready'} cuando TÚ estés listo."})
-        await self.send_turn_status(ts)
-
-        if self._hb_task is None:
-            self._hb_task = asyncio.create_task(self.heartbeat_loop())
-
-        try:
-            while True:
-                m = await recv_json(reader)
-                if m is None:
-                    await self.on_disconnect(team_id, cid)
-                    return
-                t = m.get("type")
-
-                # rate-limit
-                now = time.time()
-                cc = ts.conns.get(cid)
-                if cc:
-                    cc.last_steps.append(now)
-                    while cc.last_steps and (now - cc.last_steps[0] > RATE_LIMIT_WINDOW):
-                        cc.last_steps.popleft()
-                    if t == "step_answer" and len(cc.last_steps) > RATE_LIMIT_MAX:
-                        await send_json(cc.writer, {"type":"error","msg":"⏱️ Demasiados intentos. Espera un momento e inténtalo de nuevo."})
-                        continue
-
-                if t == "ready":
-                    await self.on_ready(team_id, cid)
-                elif t == "step_answer":
-                    if self.game_over or self.paused:
-                        await send_json(ts.conns[cid].writer, {"type":"error","msg":"Partida congelada."})
-                        continue
-                    await self.on_step_answer(team_id, cid, m)
-                elif t == "pong":
-                    pass
-                else:
-                    await send_json(writer, {"type":"hint","msg":"Usa {'type':'ready'} o {'type':'step_answer',...}"})
-        except Exception as e:
-            logging.error(f"Error con cliente {cid} t{team_id}: {e}")
-            await self.on_disconnect(team_id, cid)
-
-    async def on_disconnect(self, team_id: int, cid: int):
-        ts = await self.get_team(team_id)
-        async with self.lock:
+        conn: la conexión que se cayó; si el cid ya fue retomado por otra, no se toca.
+        """
+        ts = self.get_team(team_id)
+        async with ts.lock:
+            if conn is not None and ts.conns.get(cid) is not conn:
+                return
+            was_turn = ts.game is not None and ts.current_player() == cid
             cc = ts.conns.pop(cid, None)
             ts.ready.discard(cid)
-            try:
-                if cid in ts.turn_order:
-                    ts.turn_order.remove(cid)
-            except ValueError:
-                pass
+            racing = ts.game is not None and not self.game_over
+            if cc and cid in ts.sessions and self.session_grace > 0 and racing and not self.closed:
+                self.detach(ts, cid)
+                self._journal("detach", ts, team=team_id, cid=cid)
+            else:
+                self.drop_session(ts, cid)
+                try:
+                    if cid in ts.turn_order:
+                        ts.turn_order.remove(cid)
+                except ValueError:
+                    pass
+                if cc:
+                    self._journal("leave", ts, team=team_id, cid=cid)
         if cc:
-            try: cc.writer.close(); await cc.writer.wait_closed()
+            cc.close()
+            try: await cc.writer.wait_closed()
             except: pass
         await self.broadcast_team(ts, {"type":"team_status","team":team_id,
             "connected":len(ts.conns),"ready_count":len(ts.ready),
             "ready_all": len(ts.conns)>0 and len(ts.ready)==len(ts.conns)})
-        await self.send_turn_status(ts)
+        await self.send_turn_status(ts, step_follows=was_turn)
+        if was_turn:   # el paso pendiente pasa al nuevo dueño del turno
+            await self.push_next_task(ts)
 
     async def on_ready(self, team_id: int, cid: int):
-        ts = await self.get_team(team_id)
-        async with self.lock:
+        ts = self.get_team(team_id)
+        async with ts.lock:
             ts.ready.add(cid)
             ready_all = len(ts.conns)>0 and len(ts.ready) == len(ts.conns)
+            self._journal("ready", ts, team=team_id, cid=cid)
         logging.info(f"READY equipo {team_id}: {len(ts.ready)}/{len(ts.conns)}")
         await self.broadcast_team(ts, {"type":"team_status","team":team_id,
             "connected":len(ts.conns),"ready_count":len(ts.ready),
@@ -274,12 +813,26 @@ class HillServer:
 
     async def maybe_start_global(self):
         async with self.lock:
-            if self.start_flag or self.game_over: return
+            if self.start_flag or self.game_over or self.starting: return
             active = [t for t in self.teams.values() if len(t.conns)>0]
             if not active: return
             all_ready = all(len(t.ready)==len(t.conns) for t in active)
             if all_ready:
-                await self._do_start()
+                self.schedule_start()
+
+    @property
+    def starting(self) -> bool:
+        return self._start_task is not None and not self._start_task.done()
+
+    def schedule_start(self, countdown: int = 3):
+        """Lanza countdown + inicio como tarea aparte: joins y desconexiones siguen fluyendo."""
+        self.cancel_start()
+        self._start_task = asyncio.create_task(self._do_start(countdown))
+
+    def cancel_start(self):
+        if self.starting:
+            self._start_task.cancel()
+        self._start_task = None
 
     async def _do_start(self, countdown: int = 3):
         # broadcast countdown
@@ -293,32 +846,80 @@ class HillServer:
             if len(t.conns) == 0:
                 t.game = None
                 continue
-            t.game = initial_state(self.password, self.message, N)
+            t.game = ChallengeCursor(self.challenge)
             t.started_at = time.time()
             t.win_time = None
             # cola de turnos (conectados)
             t.turn_order = deque([cid for cid in t.conns.keys()])
+        self._journal("start", *self.teams.values(), room_state=True)
         await self.broadcast_all({"type":"start","msg":"¡Comienza la carrera!"})
         # primer paso para cada equipo
         for t in self.teams.values():
             if t.game is not None:
-                await self.send_turn_status(t)
+                await self.send_turn_status(t, step_follows=True)
                 await self.push_next_task(t)
 
     async def push_next_task(self, ts: TeamSrvState):
         if self.game_over or self.paused or ts.game is None:
             return
-        spec = next_step(ts.game)
+        g = ts.game
+        if g.finished:
+            return
+        t0 = time.perf_counter()
         cur = ts.current_player()
-        payload = {"type":"step","block":spec.block,"phase":spec.phase,
-                   "inputs":spec.inputs,"op":spec.op,"output_name":spec.output_name,
-                   "turn_cid":cur}
+        self._arm_turn_deadline(ts, cur, g.pos)
+        frames = self.step_frames
+        if frames.challenge is not g.challenge:   # cursor de un reto anterior
+            frames = StepFrames(g.challenge)
+        variants: Dict[Tuple[int, bool], Tuple[bytes, bytes]] = {}
         for cid, cc in ts.conns.items():
-            payload["you_turn"] = (cid == cur)
-            await send_json(cc.writer, payload)
+            if cc.delta and cc.static_of is not g.challenge:
+                cc.outbox.put(frames.static_frame, "challenge")   # una vez por reto y conexión
+                cc.static_of = g.challenge
+            k = (cc.proto, cc.delta)
+            v = variants.get(k)
+            if v is None:
+                v = variants[k] = frames.frames(g.pos, cur, cc.proto, cc.delta)
+            cc.outbox.put(v[0] if cid == cur else v[1], "step")
+        H_FANOUT.observe(time.perf_counter() - t0, "step")
+
+    # ------- deadline de turno -------
+    def _arm_turn_deadline(self, ts: TeamSrvState, cur: Optional[int], pos: int):
+        """Arma el deadline al cambiar de jugador o de paso (los reintentos no lo renuevan)."""
+        if self.wheel is None or self.turn_timeout <= 0 or (cur, pos) == ts.turn_key:
+            return
+        ts.turn_key = (cur, pos)
+        ts.turn_seq += 1
+        self.wheel.call_later(self.turn_timeout, self._turn_expired, ts, ts.turn_seq)
+
+    def _turn_expired(self, ts: TeamSrvState, seq: int):
+        if (seq != ts.turn_seq or self.closed or self.game_over or ts.game is None
+                or ts.game.finished or self.teams.get(ts.team_id) is not ts):
+            return   # ya respondieron, se reinició o la sala cerró: timer obsoleto
+        if self.paused:
+            self.wheel.call_later(self.turn_timeout, self._turn_expired, ts, seq)
+            return
+        asyncio.create_task(self._skip_turn(ts, seq))
+
+    async def _skip_turn(self, ts: TeamSrvState, seq: int):
+        async with ts.lock:
+            if seq != ts.turn_seq or ts.game is None or ts.game.finished:
+                return
+            skipped = ts.current_player()
+            ts.rotate_phase()
+            ts.turn_key = None   # re-arma aunque el turno vuelva al mismo jugador
+            self._journal("skip", ts, team=ts.team_id, cid=skipped)
+            logging.info(f"Turno vencido sala {self.room_id} equipo {ts.team_id}: cliente {skipped}")
+            await self.broadcast_team(ts, {"type":"info","msg":f"⏰ Se acabó el tiempo del jugador {skipped}. Turno al siguiente."})
+            await self.send_turn_status(ts, step_follows=True)
+            await self.push_next_task(ts)
 
     async def on_step_answer(self, team_id: int, cid: int, msg: dict):
-        ts = await self.get_team(team_id)
+        ts = self.get_team(team_id)
+        async with ts.lock:
+            await self._step_answer(ts, cid, msg)
+
+    async def _step_answer(self, ts: TeamSrvState, cid: int, msg: dict):
         if ts.game is None: return
         phase = msg.get("phase"); block = msg.get("block"); vec = msg.get("vector")
 
@@ -327,19 +928,24 @@ class HillServer:
         if cid != cur:
             cc = ts.conns.get(cid)
             if cc:
-                await send_json(cc.writer, {"type":"error","msg":"⛔ No es tu turno. Espera tu turno."})
+                cc.send({"type":"error","msg":"⛔ No es tu turno. Espera tu turno."})
             return
 
         # aridad esperada
         exp_len = 4 if phase in ("TPW","TMSG") else ts.game.n
         if not (isinstance(vec, list) and len(vec) == exp_len and all(isinstance(x,int) for x in vec)):
             ts.game.errors += 1
+            self._journal("answer", ts, team=ts.team_id, cid=cid, ok=False,
+                          **journal_answer(phase, block, vec, exp_len))
             cc = ts.conns.get(cid)
-            if cc: await send_json(cc.writer, {"type":"error","msg":f"Vector inválido. Debe ser lista de {exp_len} enteros."})
+            if cc: cc.send({"type":"error","msg":f"Vector inválido. Debe ser lista de {exp_len} enteros."})
             await self.push_next_task(ts)  # mismo paso
             return
 
-        ok, err = validate_step(ts.game, phase, vec)
+        expected = ts.game.current_phase   # etiqueta acotada: no la fase que diga el cliente
+        t0 = time.perf_counter()
+        ok, err = cursor_validate(ts.game, phase, vec)
+        H_VALIDATE.observe(time.perf_counter() - t0, expected)
 
         if ok:
             await self.broadcast_team(ts, {"type":"ok","for": f"{phase}" if block==-1 else f"block{block}_phase{phase}"})
@@ -348,6 +954,10 @@ class HillServer:
                     self.winner_team = ts.team_id
                 ts.win_time = time.time()
                 self.game_over = True
+                for t in self.teams.values():
+                    self.drop_detached(t)
+                self._journal("answer", ts, room_state=True, team=ts.team_id, cid=cid,
+                              phase=phase, block=block, vec=vec, ok=True)
                 await self.publish_scoreboard()
                 await self.broadcast_all({"type":"game_over","winner": self.winner_team})
                 return
@@ -358,40 +968,46 @@ class HillServer:
             else:
                 if phase == "D":
                     ts.rotate_block()
+            self._journal("answer", ts, team=ts.team_id, cid=cid, phase=phase, block=block, vec=vec, ok=True)
 
-            await self.send_turn_status(ts)
+            await self.send_turn_status(ts, step_follows=True)
             await self.push_next_task(ts)
         else:
             ts.game.errors += 1
+            self._journal("answer", ts, team=ts.team_id, cid=cid, ok=False,
+                          **journal_answer(phase, block, vec, exp_len))
             cc = ts.conns.get(cid)
-            if cc: await send_json(cc.writer, {"type":"error","msg": err or "Error"})
+            if cc: cc.send({"type":"error","msg": err or "Error"})
             await self.push_next_task(ts)  # reintento
 
     # ========== Poderes de admin ==========
     async def admin_kick(self, team: int, client_id: Optional[int]):
-        ts = await self.get_team(team)
-        removed = 0
-        if client_id is None:
-            # kick equipo completo
-            for cid, cc in list(ts.conns.items()):
-                try: cc.writer.close(); await cc.writer.wait_closed()
-                except: pass
-                removed += 1
-            ts.conns.clear()
-            ts.ready.clear()
-            ts.turn_order.clear()
-        else:
-            cc = ts.conns.pop(client_id, None)
-            if cc:
-                try: cc.writer.close(); await cc.writer.wait_closed()
-                except: pass
+        ts = self.get_team(team)
+        async with ts.lock:
+            if client_id is None:
+                # kick equipo completo
+                gone = list(ts.conns.values())
+                for c in list(ts.sessions):
+                    self.drop_session(ts, c)
+                ts.conns.clear()
+                ts.ready.clear()
+                ts.turn_order.clear()
+            else:
+                cc = ts.conns.pop(client_id, None)
+                gone = [cc] if cc else []
                 ts.ready.discard(client_id)
+                self.drop_session(ts, client_id)   # expulsado: su token ya no sirve
                 try:
                     if client_id in ts.turn_order:
                         ts.turn_order.remove(client_id)
                 except ValueError:
                     pass
-                removed = 1
+            self._journal("kick", ts, team=team, cid=client_id)
+        for cc in gone:
+            cc.close()
+            try: await cc.writer.wait_closed()
+            except: pass
+        removed = len(gone)
         await self.broadcast_team(ts, {"type":"team_status","team":team,
             "connected":len(ts.conns),"ready_count":len(ts.ready),
             "ready_all": len(ts.conns)>0 and len(ts.ready)==len(ts.conns)})
@@ -402,6 +1018,9 @@ class HillServer:
         if self.start_flag and not self.game_over:
             print("[ADMIN] Ya estaba iniciado.")
             return
+        if self.starting:
+            print("[ADMIN] Ya hay un countdown en curso.")
+            return
         # limpia banderas de fin o pausa
         self.game_over = False
         self.winner_team = None
@@ -411,14 +1030,15 @@ class HillServer:
             # prepara lista de turnos
             t.turn_order = deque([cid for cid in t.conns.keys()])
             t.ready = set(t.conns.keys())
-        await self._do_start(countdown=2)
+        self._journal("start_now", *self.teams.values(), room_state=True)
+        self.schedule_start(countdown=2)
         print("[ADMIN] start-now ejecutado.")
 
     async def admin_set_message(self, msg: str):
         if len(msg) != 4 or any(ord(c) > 127 for c in msg):
             print("[ADMIN] set-message: Debe ser ASCII de 4 chars.")
             return
-        self.message = msg
+        self.set_challenge(self.password, msg)
         await self._reset_challenge("Nuevo plaintext cargado. Marquen READY.")
         print(f"[ADMIN] Mensaje actualizado: '{msg}'")
 
@@ -426,12 +1046,13 @@ class HillServer:
         if len(pw) != 4 or any(ord(c) > 127 for c in pw):
             print("[ADMIN] set-password: Debe ser ASCII de 4 chars.")
             return
-        self.password = pw
+        self.set_challenge(pw, self.message)
         await self._reset_challenge("Nueva contraseña cargada. Marquen READY.")
         print(f"[ADMIN] Password actualizado: '{pw}'")
 
     async def _reset_challenge(self, info_text: str):
         # congelar cualquier partida en curso y reiniciar a “lobby”
+        self.cancel_start()
         self.game_over = False
         self.paused = False
         self.start_flag = False
@@ -441,21 +1062,23 @@ class HillServer:
             t.game = None
             t.started_at = None
             t.win_time = None
+            self.drop_detached(t)
             # mantener conexiones y turnos actuales
+        self._journal("challenge", *self.teams.values(), room_state=True)
         await self.broadcast_all({"type":"info","msg": info_text})
         # pedir READY nuevamente
         for t in self.teams.values():
             await self.broadcast_team(t, {"type":"team_status","team":t.team_id,
                 "connected":len(t.conns),"ready_count":len(t.ready),
                 "ready_all": len(t.conns)>0 and len(t.ready)==len(t.conns)})
-            for cid, cc in t.conns.items():
-                await send_json(cc.writer, {"type":"task","task":"ready","msg":"Se cargó un nuevo reto. Envía {'type':'ready'}"})
+            await self.broadcast_team(t, {"type":"task","task":"ready","msg":"Se cargó un nuevo reto. Envía {'type':'ready'}"})
 
     async def admin_pause(self):
         if not self.start_flag or self.game_over:
             print("[ADMIN] No hay partida activa para pausar.")
             return
         self.paused = True
+        self._journal("pause", room_state=True)
         await self.broadcast_all({"type":"info","msg":"⏸️ Partida pausada por admin"})
         print("[ADMIN] Pausado.")
 
@@ -464,6 +1087,7 @@ class HillServer:
             print("[ADMIN] No estaba pausado.")
             return
         self.paused = False
+        self._journal("resume", room_state=True)
         await self.broadcast_all({"type":"info","msg":"▶️ Partida reanudada"})
         # reempuja el paso actual de cada equipo
         for t in self.teams.values():
@@ -472,6 +1096,7 @@ class HillServer:
 
     async def admin_reset(self):
         # reinicia partida (mantiene conexiones), vuelve a lobby
+        self.cancel_start()
         self.game_over = False
         self.paused = False
         self.start_flag = False
@@ -482,15 +1107,16 @@ class HillServer:
             t.started_at = None
             t.win_time = None
             t.ready.clear()
+            self.drop_detached(t)
             # turn_order se conserva (jugadores conectados)
+        self._journal("reset", *self.teams.values(), room_state=True)
         await self.broadcast_all({"type":"info","msg":"♻️ Reset de partida. Marquen READY para iniciar."})
         # pedir READY
         for t in self.teams.values():
             await self.broadcast_team(t, {"type":"team_status","team":t.team_id,
                 "connected":len(t.conns),"ready_count":len(t.ready),
                 "ready_all": len(t.conns)>0 and len(t.ready)==len(t.conns)})
-            for cid, cc in t.conns.items():
-                await send_json(cc.writer, {"type":"task","task":"ready","msg":"Envía {'type':'ready'} para nueva partida."})
+            await self.broadcast_team(t, {"type":"task","task":"ready","msg":"Envía {'type':'ready'} para nueva partida."})
         print("[ADMIN] Reset ejecutado.")
 
     async def admin_set_rotate(self, mode: str):
@@ -501,10 +1127,15 @@ class HillServer:
             print("[ADMIN] set-rotate: no se puede cambiar durante partida. Usa reset.")
             return
         self.rotate = mode
+        self._journal("rotate_mode", room_state=True)
         print(f"[ADMIN] Rotación establecida: {mode}")
 
     async def admin_status(self):
-        print(f"[STATUS] rotate={self.rotate} started={self.start_flag} paused={self.paused} game_over={self.game_over}")
+        print(f"[STATUS {self.room_id}] rotate={self.rotate} started={self.start_flag} paused={self.paused} game_over={self.game_over}")
+        q = queue_stats(self.conns())
+        print(f"  colas: conexiones={q['conns']} pendientes={q['depth']} max={q['depth_max']} "
+              f"pico={q['high_water']} enviados={q['sent']} descartados={q['dropped']} "
+              f"limitados={q['throttled']}")
         for tid, ts in self.teams.items():
             conn = len(ts.conns); ready = len(ts.ready)
             cur = ts.current_player()
@@ -515,11 +1146,13 @@ class HillServer:
                 st = ts.game.current_phase
                 blk = f"{ts.game.current_block}/{len(ts.game.v_blocks)}"
                 err = ts.game.errors
-            print(f"  team {tid}: conectados={conn} ready={ready} turno={cur} fase={st} bloque={blk} errores={err}")
+            cola = max((len(cc.outbox) for cc in ts.conns.values()), default=0)
+            print(f"  team {tid}: conectados={conn} caídos={len(ts.detached)} ready={ready} turno={cur} fase={st} bloque={blk} errores={err} cola={cola}")
 
     async def admin_team_info(self, team: int):
-        ts = await self.get_team(team)
-        print(f"[TEAM {team}] conectados={len(ts.conns)} ready={len(ts.ready)} turno={ts.current_player()}")
+        ts = self.get_team(team)
+        print(f"[TEAM {team}] conectados={len(ts.conns)} ready={len(ts.ready)} turno={ts.current_player()}"
+              f" caídos={sorted(ts.detached)}")
         if not ts.game:
             print("  sin juego (en lobby)")
             return
@@ -529,22 +1162,342 @@ class HillServer:
         print(f"  M={g.M}")
         print(f"  b={g.b}  IV={g.IV}")
 
+    async def admin_scoreboard(self):
+        self.print_scoreboard(self.build_scoreboard())
+
     async def admin_broadcast(self, text: str):
         await self.broadcast_all({"type":"info","msg":text})
         print("[ADMIN] broadcast enviado.")
 
-    # ------- READY & START -------
-    async def on_ready(self, team_id: int, cid: int):
-        ts = await self.get_team(team_id)
-        async with self.lock:
-            ts.ready.add(cid)
-            ready_all = len(ts.conns)>0 and len(ts.ready) == len(ts.conns)
-        logging.info(f"READY equipo {team_id}: {len(ts.ready)}/{len(ts.conns)}")
-        await self.broadcast_team(ts, {"type":"team_status","team":team_id,
+class HillServer:
+    """Red y registro de salas: un solo event loop aloja muchas carreras independientes.
+
+    Con `shard` (modo --workers, ver hascill_cluster) este proceso sólo aloja las
+    salas que le tocan por hash; un join a otra sala recibe un "redirect".
+    """
+    def __init__(self, password: str, message: str, rotate: str,
+                 outq_max: int = OUTQ_MAX, outq_policy: str = OUTQ_POLICY, shard=None,
+                 rate_limits: Optional[Dict[str, Tuple[float, float]]] = None,
+                 idle_timeout: float = IDLE_TIMEOUT, turn_timeout: float = TURN_TIMEOUT,
+                 journal: Optional[Journal] = None, session_grace: float = SESSION_GRACE):
+        assert outq_policy in ("drop","disconnect")
+        self.outq_max = outq_max
+        self.outq_policy = outq_policy
+        self.rate_limits = dict(rate_limits or RATE_LIMITS)
+        self.throttled: Dict[str, int] = {}   # rechazos por tipo (histórico, incluye conexiones cerradas)
+        self.shard = shard
+        self.rooms: Dict[str, Room] = {}
+        self.next_client_id = 0
+        self.idle_timeout = idle_timeout
+        self.turn_timeout = turn_timeout
+        self.session_grace = session_grace
+        self.resumed = 0  # reconexiones que retomaron su sesión
+        self.reaped = 0   # conexiones cortadas por inactividad
+        # heartbeats, reaping de inactivos y deadlines de turno comparten una rueda
+        self.wheel = TimerWheel()
+        self._wheel_task: Optional[asyncio.Task] = None
+        self.journal = journal
+        self._lag_task: Optional[asyncio.Task] = None
+
+        logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s')
+        if journal is not None and journal.restored:
+            self.restore(journal.state)
+            logging.info(f"Estado restaurado de {journal.dir}: seq {journal.seq} "
+                         f"({journal.tail} eventos tras el snapshot), {len(self.rooms)} salas")
+        elif self.owns(DEFAULT_ROOM):
+            self.create_room(DEFAULT_ROOM, password, message, rotate)
+
+    def _new_room(self, room_id: str, password: str, message: str, rotate: str) -> Room:
+        return Room(room_id, password, message, rotate, wheel=self.wheel, turn_timeout=self.turn_timeout,
+                    journal=self.journal, session_grace=self.session_grace)
+
+    def restore(self, state: dict):
+        """Rehace salas, equipos y contador de ids desde el estado del journal."""
+        for room_id, r in state["rooms"].items():
+            rs = r["room"]
+            room = self.rooms[room_id] = self._new_room(room_id, rs["password"], rs["message"], rs["rotate"])
+            room.restore(rs, r["teams"])
+        self.next_client_id = max(self.next_client_id, state["next_cid"])
+
+    def owns(self, room_id: str) -> bool:
+        return self.shard is None or self.shard.owner(room_id) == self.shard.me
+
+    # ------- salas -------
+    def create_room(self, room_id: str, password: str, message: str, rotate: str = "phase") -> Room:
+        if not ROOM_ID_RE.match(room_id):
+            raise ValueError("id de sala inválido (1..32 caracteres de [A-Za-z0-9_-])")
+        if room_id in self.rooms:
+            raise ValueError(f"La sala '{room_id}' ya existe")
+        if len(self.rooms) >= MAX_ROOMS:
+            raise ValueError(f"Máximo de salas alcanzado ({MAX_ROOMS})")
+        if rotate not in ("phase","block"):
+            raise ValueError("rotate debe ser phase|block")
+        room = self._new_room(room_id, password, message, rotate)
+        self.rooms[room_id] = room
+        room._journal("room_create", room_state=True)
+        return room
+
+    async def close_room(self, room_id: str):
+        """Saca la sala del registro y desconecta a sus clientes."""
+        if room_id == DEFAULT_ROOM:
+            raise ValueError("La sala por defecto no se puede cerrar")
+        room = self.rooms.pop(room_id, None)
+        if room is None:
+            raise ValueError(f"La sala '{room_id}' no existe")
+        room.closed = True
+        room.cancel_start()
+        room._journal("room_close")
+        await room.broadcast_all({"type":"info","msg":"🚪 Sala cerrada por admin"})
+        for ts in room.teams.values():
+            for cc in ts.conns.values():
+                cc.close()
+            ts.conns.clear()
+            ts.ready.clear()
+            ts.turn_order.clear()
+
+    def queue_stats(self) -> dict:
+        return queue_stats([cc for room in self.rooms.values() for cc in room.conns()])
+
+    # ------- interfaz de admin (la misma que ofrece ClusterAdmin en modo --workers) -------
+    async def room_call(self, room_id: str, method: str, *args):
+        """Ejecuta un poder de admin (Room.admin_*) sobre una sala."""
+        room = self.rooms.get(room_id)
+        if room is None:
+            raise ValueError(f"La sala '{room_id}' no existe")
+        if not method.startswith("admin_"):
+            raise ValueError(f"Método no permitido: {method}")
+        return await getattr(room, method)(*args)
+
+    async def room_info(self) -> List[dict]:
+        rows = []
+        for rid, room in self.rooms.items():
+            st = "game_over" if room.game_over else "pausa" if room.paused else "en curso" if room.start_flag else "lobby"
+            rows.append({"room": rid, "teams": len(room.teams), "conns": len(room.conns()), "state": st,
+                         "winner": room.winner_team, "password": room.password, "message": room.message,
+                         "worker": self.shard.me if self.shard else None})
+        return rows
+
+    async def admin_create_room(self, room_id: str, password: str, message: str, rotate: str = "phase"):
+        self.create_room(room_id, password, message, rotate)
+
+    async def admin_close_room(self, room_id: str):
+        await self.close_room(room_id)
+
+    async def admin_stats(self) -> dict:
+        return dict(self.queue_stats(), rooms=len(self.rooms), throttled_by_type=dict(self.throttled),
+                    reaped=self.reaped, resumed=self.resumed, timers=len(self.wheel))
+
+    # ------- métricas -------
+    def metrics_lines(self) -> List[str]:
+        """Gauges y contadores que el server ya lleva, leídos en el momento del scrape."""
+        q = self.queue_stats()
+        teams = [(room_id, tid, ts) for room_id, room in self.rooms.items() for tid, ts in room.teams.items()]
+        lines = metric("hascill_rooms", "Salas abiertas", len(self.rooms))
+        lines += metric("hascill_team_connections", "Conexiones por equipo",
+                        [({"room": r, "team": t}, len(ts.conns)) for r, t, ts in teams])
+        lines += metric("hascill_team_detached", "Jugadores caídos en gracia por equipo",
+                        [({"room": r, "team": t}, len(ts.detached)) for r, t, ts in teams])
+        lines += metric("hascill_outq_depth", "Frames pendientes en todas las colas de salida", q["depth"])
+        lines += metric("hascill_outq_depth_max", "Cola de salida más larga", q["depth_max"])
+        lines += metric("hascill_outq_high_water", "Pico de cola de salida (conexiones abiertas)", q["high_water"])
+        lines += metric("hascill_throttled_total", "Frames rechazados por rate-limit, por tipo",
+                        [({"type": k}, v) for k, v in sorted(self.throttled.items())], "counter")
+        lines += metric("hascill_reaped_total", "Conexiones cortadas por inactividad", self.reaped, "counter")
+        lines += metric("hascill_resumed_total", "Reconexiones que retomaron su sesión", self.resumed, "counter")
+        lines += metric("hascill_timers", "Timers pendientes en la rueda", len(self.wheel))
+        return lines
+
+    def metrics_page(self) -> str:
+        return render(HISTOGRAMS, self.metrics_lines)
+
+    def start_wheel(self):
+        """Arranca la rueda de timers (idempotente). Tras restaurar hay que hacerlo antes del
+        primer join: los timers de gracia de las sesiones restauradas ya están en ella."""
+        if self._wheel_task is None:
+            self._wheel_task = asyncio.create_task(self.wheel.run())
+
+    async def start_metrics(self, port: int):
+        """Expone /metrics en 127.0.0.1:port y arranca el muestreo del lag del event loop."""
+        if self._lag_task is None:
+            self._lag_task = asyncio.create_task(sample_loop_lag(H_LOOP_LAG))
+        return await start_metrics_server(self.metrics_page, port)
+
+    async def shutdown(self):
+        """Publica los scoreboards de las partidas iniciadas y cierra todas las conexiones."""
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+        for room in self.rooms.values():
+            if room.start_flag:
+                await room.publish_scoreboard()
+        if self.journal is not None:
+            # snapshot final antes de cortar: las desconexiones del cierre no se anotan
+            await self.journal.close()
+        for ts in (t for room in self.rooms.values() for t in room.teams.values()):
+            for cc in list(ts.conns.values()):
+                cc.close()
+                try: await cc.writer.wait_closed()
+                except: pass
+
+    # ------- heartbeat / inactividad -------
+    def _conn_tick(self, room: Room, team_id: int, cid: int, cc: ClientConn):
+        """Timer por conexión cada HEARTBEAT_SEC: ping, o corte si lleva idle_timeout sin enviar nada."""
+        ts = room.teams.get(team_id)
+        if ts is None or ts.conns.get(cid) is not cc or cc.outbox.closed:
+            return   # ya se fue (o su sesión la retomó otra conexión): el timer muere aquí
+        idle = time.monotonic() - cc.last_seen
+        if self.idle_timeout > 0 and idle > self.idle_timeout:
+            logging.warning(f"Cliente {cid} {room.room_id}/t{team_id} inactivo {idle:.0f}s: desconectando")
+            self.reaped += 1
+            cc.close(flush=False)   # handle_conn ve el EOF y hace on_disconnect
+            return
+        cc.send({"type":"ping","ts": time.time(), "proto": PROTO_VER})
+        self.wheel.call_later(HEARTBEAT_SEC, self._conn_tick, room, team_id, cid, cc)
+
+    # ------- network -------
+    async def handle_conn(self, reader: FrameConn, writer: FrameConn):
+        addr = writer.get_extra_info("peername")
+        await send_json(writer, {"type":"hello","proto": PROTO_VER,"msg":"Únete con {'type':'join','team':N,'room':ID} (team 1..6; room opcional)"})
+        try:   # quien nunca manda el join no queda colgado para siempre
+            msg = await asyncio.wait_for(reader.recv(), self.idle_timeout or JOIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            msg = None
+        if not msg or msg.get("type") != "join":
+            await send_json(writer, {"type":"error","msg":"Debes unirte con {'type':'join','team':N}"})
+            writer.close(); await writer.wait_closed(); return
+        room_id = str(msg.get("room") or DEFAULT_ROOM)
+        if not self.owns(room_id):
+            # otra réplica aloja la sala: el cliente reconecta a su puerto privado
+            await send_json(writer, {"type":"redirect","room":room_id,"port":self.shard.port_of(room_id)})
+            writer.close(); await writer.wait_closed(); return
+        room = self.rooms.get(room_id)
+        if room is None:
+            await send_json(writer, {"type":"error","msg":f"La sala '{room_id}' no existe"})
+            writer.close(); await writer.wait_closed(); return
+        token = msg.get("session")
+        resume = room.sessions.get(token) if isinstance(token, str) else None
+        if resume is not None:
+            team_id = resume[0]   # el token manda: mismo equipo e id que antes de caer
+        else:
+            try:
+                team_id = int(msg.get("team"))
+                assert 1 <= team_id <= MAX_TEAMS
+            except Exception:
+                await send_json(writer, {"type":"error","msg":f"team debe estar entre 1 y {MAX_TEAMS}"})
+                writer.close(); await writer.wait_closed(); return
+        try:   # versión de protocolo: la mayor que ambos soportan
+            proto = max(PROTO_JSON, min(int(msg.get("proto", PROTO_JSON)), PROTO_VER))
+        except (TypeError, ValueError):
+            proto = PROTO_JSON
+        delta = bool(msg.get("delta"))
+
+        ts = room.get_team(team_id)
+        old = None
+        async with ts.lock:
+            cc = ClientConn(reader, writer, Outbox(writer, self.outq_max, self.outq_policy),
+                            proto=proto, delta=delta)
+            if resume is not None and room.sessions.get(token) == resume:
+                # reconexión dentro de la gracia: mismo cid y mismo lugar en el turno
+                cid = resume[1]
+                old = ts.conns.get(cid)   # la vieja puede seguir viva si el corte fue del otro lado
+                ts.detached.pop(cid, None)
+                ts.conns[cid] = cc
+                ts.ready.discard(cid)
+                if cid not in ts.turn_order:
+                    ts.turn_order.append(cid)
+                ts.skip_detached()
+                room._journal("resume", ts, team=team_id, cid=cid)
+            else:
+                resume = None
+                self.next_client_id += 1
+                cid = self.next_client_id
+                token = secrets.token_urlsafe(16)
+                ts.conns[cid] = cc
+                ts.ready.discard(cid)
+                if cid not in ts.turn_order:   # también a mitad de carrera: entra al final de la rotación
+                    ts.turn_order.append(cid)
+                if self.session_grace > 0:
+                    room.attach_session(ts, cid, token)
+                room._journal("join", ts, team=team_id, cid=cid)
+        if old is not None:
+            old.close(flush=False)   # su handle_conn ve que el cid ya no es suyo y termina
+        logging.info(f"Cliente {cid} sala {room_id} equipo {team_id} desde {addr}"
+                     + (" (sesión retomada)" if resume else ""))
+
+        joined = {"type":"joined","team":team_id,"room":room_id,"your_id":cid,"proto":proto,"delta":delta,
+                  "session": token if self.session_grace > 0 else None, "resumed": resume is not None,
+                  "info":{
+            "password": room.password, "message": room.message,
+            "note":"Todos marcan READY. Tras START: TPW, TMSG, A, B, C, D. Turnos rotativos.",
+            "rotate": room.rotate
+        }}
+        status = {"type":"team_status","team":team_id,
             "connected":len(ts.conns),"ready_count":len(ts.ready),
-            "ready_all": ready_all})
-        await self.send_turn_status(ts)
-        await self.maybe_start_global()
+            "ready_all": len(ts.conns)>0 and len(ts.ready)==len(ts.conns)}
+        if resume is not None:
+            # un único frame de puesta al día: identidad, equipo, turno y el paso en curso
+            self.resumed += 1
+            cur = ts.current_player()
+            msgs = [joined, status]
+            if not room.start_flag:
+                msgs.append({"type":"task","task":"ready","msg":"Envía {'type':'ready'} cuando TÚ estés listo."})
+            msgs.append({"type":"turn","current":cur,"you_turn":(cid==cur),"order":list(ts.turn_order)})
+            msgs += room.catch_up(ts, cid, cc)
+            if room.game_over:
+                msgs.append({"type":"game_over","winner": room.winner_team})
+            cc.send({"type":"resume","session":token,"msgs":msgs})
+            await room.broadcast_team(ts, status)
+            for ocid, occ in ts.conns.items():
+                if ocid != cid:
+                    occ.send({"type":"turn","current":cur,"you_turn":(ocid==cur),"order":list(ts.turn_order)})
+        else:
+            cc.send(joined)
+            await room.broadcast_team(ts, status)
+            cc.send({"type":"task","task":"ready","msg":"Envía {'type':'ready'} cuando TÚ estés listo."})
+            await room.send_turn_status(ts)
+            for m in room.catch_up(ts, cid, cc):   # unido a mitad de carrera: el paso en curso
+                cc.send(m)
+
+        self.wheel.call_later(HEARTBEAT_SEC, self._conn_tick, room, team_id, cid, cc)
+        self.start_wheel()
+
+        try:
+            while True:
+                m = await reader.recv()
+                if m is None:
+                    await room.on_disconnect(team_id, cid, cc)
+                    return
+                t = m.get("type")
+
+                if ts.conns.get(cid) is not cc:   # expulsado, sala cerrada o sesión retomada por otra conexión
+                    return
+                now = cc.last_seen = time.monotonic()
+
+                # rate-limit: un token bucket por tipo de mensaje
+                key = t if isinstance(t, str) and t in self.rate_limits else "*"
+                bucket = cc.buckets.get(key)
+                if bucket is None:
+                    bucket = cc.buckets[key] = TokenBucket(*self.rate_limits[key])
+                if not bucket.take(now):
+                    cc.throttled += 1
+                    self.throttled[key] = self.throttled.get(key, 0) + 1
+                    cc.outbox.put(THROTTLE_FRAMES[cc.proto], "throttle")
+                    continue
+
+                if t == "ready":
+                    await room.on_ready(team_id, cid)
+                elif t == "step_answer":
+                    if room.game_over or room.paused:
+                        cc.send({"type":"error","msg":"Partida congelada."})
+                        continue
+                    await room.on_step_answer(team_id, cid, m)
+                elif t == "pong":
+                    pass
+                else:
+                    cc.send({"type":"hint","msg":"Usa {'type':'ready'} o {'type':'step_answer',...}"})
+        except Exception as e:
+            logging.error(f"Error con cliente {cid} {room_id}/t{team_id}: {e}")
+            await room.on_disconnect(team_id, cid, cc)
+
 
 # ======= consola admin (REPL) =======
 class AdminConsole:
@@ -558,21 +1511,51 @@ Comandos:
   reset                       Reinicia a lobby (conexiones se mantienen)
   set-rotate phase|block      Cambia política de turnos (fuera de partida)
   status                      Estado rápido de todos los equipos
+  scoreboard                  Scoreboard de la sala (sin enviarlo a los clientes)
+  stats                       Totales del servidor (salas, conexiones, colas)
   team-info <team>            Detalle del equipo
   broadcast "texto"           Mensaje a todos
+  rooms                       Lista las salas
+  room <id>                   Cambia la sala sobre la que actúan los comandos
+  room-create <id> <WXYZ> <ABCD> [phase|block]   Crea una sala nueva
+  room-close <id>             Cierra una sala y desconecta a sus clientes
   help                        Esta ayuda
   quit                        Cierra el servidor
 """
 
-    def __init__(self, server: HillServer):
+    def __init__(self, server):
+        # server: HillServer o hascill_cluster.ClusterAdmin (misma interfaz de admin)
         self.server = server
+        self.room_id = DEFAULT_ROOM
+
+    async def list_rooms(self):
+        rows = await self.server.room_info()
+        if not any(r["room"] == self.room_id for r in rows):   # la sala activa fue cerrada
+            self.room_id = DEFAULT_ROOM
+        for r in sorted(rows, key=lambda r: r["room"]):
+            mark = "*" if r["room"] == self.room_id else " "
+            worker = f" worker={r['worker']}" if r["worker"] is not None else ""
+            winner = f" ganador={r['winner']}" if r["winner"] is not None else ""
+            print(f" {mark}{r['room']:<20} equipos={r['teams']} conexiones={r['conns']} "
+                  f"estado={r['state']}{winner} password='{r['password']}' message='{r['message']}'{worker}")
+
+    async def call(self, method: str, *args):
+        try:
+            return await self.server.room_call(self.room_id, method, *args)
+        except ValueError:
+            if self.room_id == DEFAULT_ROOM:
+                raise
+            print(f"[ADMIN] La sala '{self.room_id}' ya no existe; vuelvo a '{DEFAULT_ROOM}'.")
+            self.room_id = DEFAULT_ROOM
+            raise
 
     async def run(self):
         loop = asyncio.get_running_loop()
         print(self.HELP)
         while True:
             # leer línea sin bloquear el loop
-            line = await loop.run_in_executor(None, lambda: input("admin> "))
+            prompt = "admin> " if self.room_id == DEFAULT_ROOM else f"admin[{self.room_id}]> "
+            line = await loop.run_in_executor(None, lambda: input(prompt))
             if not line:
                 continue
             try:
@@ -592,52 +1575,83 @@ Comandos:
                         print("Uso: kick <team> [client_id]")
                         continue
                     team = int(rest[0]); cid = int(rest[1]) if len(rest) >= 2 else None
-                    await self.server.admin_kick(team, cid)
+                    await self.call("admin_kick", team, cid)
                 elif cmd == "start-now":
-                    await self.server.admin_start_now()
+                    await self.call("admin_start_now")
                 elif cmd == "set-message":
                     if len(rest) != 1:
                         print("Uso: set-message <ABCD>")
                         continue
-                    await self.server.admin_set_message(rest[0])
+                    await self.call("admin_set_message", rest[0])
                 elif cmd == "set-password":
                     if len(rest) != 1:
                         print("Uso: set-password <WXYZ>")
                         continue
-                    await self.server.admin_set_password(rest[0])
+                    await self.call("admin_set_password", rest[0])
                 elif cmd == "pause":
-                    await self.server.admin_pause()
+                    await self.call("admin_pause")
                 elif cmd == "resume":
-                    await self.server.admin_resume()
+                    await self.call("admin_resume")
                 elif cmd == "reset":
-                    await self.server.admin_reset()
+                    await self.call("admin_reset")
                 elif cmd == "set-rotate":
                     if len(rest) != 1:
                         print("Uso: set-rotate phase|block")
                         continue
-                    await self.server.admin_set_rotate(rest[0])
+                    await self.call("admin_set_rotate", rest[0])
                 elif cmd == "status":
-                    await self.server.admin_status()
+                    await self.call("admin_status")
+                elif cmd == "scoreboard":
+                    await self.call("admin_scoreboard")
                 elif cmd == "team-info":
                     if len(rest) != 1:
                         print("Uso: team-info <team>")
                         continue
-                    await self.server.admin_team_info(int(rest[0]))
+                    await self.call("admin_team_info", int(rest[0]))
                 elif cmd == "broadcast":
                     if len(rest) != 1:
                         print('Uso: broadcast "texto"')
                         continue
-                    await self.server.admin_broadcast(rest[0])
+                    await self.call("admin_broadcast", rest[0])
+                elif cmd == "stats":
+                    q = await self.server.admin_stats()
+                    print(f"[STATS] salas={q['rooms']} conexiones={q['conns']} pendientes={q['depth']} "
+                          f"max={q['depth_max']} pico={q['high_water']} enviados={q['sent']} descartados={q['dropped']}")
+                    by_type = " ".join(f"{k}={v}" for k, v in sorted(q["throttled_by_type"].items()))
+                    print(f"[STATS] limitados={q['throttled']} (conectados)  histórico: {by_type or '-'}")
+                    print(f"[STATS] inactivos cortados={q['reaped']} sesiones retomadas={q['resumed']} "
+                          f"timers={q['timers']}")
+                elif cmd == "rooms":
+                    await self.list_rooms()
+                elif cmd == "room":
+                    if len(rest) != 1:
+                        print("Uso: room <id>")
+                        continue
+                    if not any(r["room"] == rest[0] for r in await self.server.room_info()):
+                        print(f"[ADMIN] La sala '{rest[0]}' no existe.")
+                        continue
+                    self.room_id = rest[0]
+                    print(f"[ADMIN] Sala activa: {self.room_id}")
+                elif cmd == "room-create":
+                    if len(rest) not in (3, 4):
+                        print("Uso: room-create <id> <WXYZ> <ABCD> [phase|block]")
+                        continue
+                    pw, msg = rest[1], rest[2]
+                    if len(pw) != 4 or len(msg) != 4 or any(ord(c) > 127 for c in pw + msg):
+                        print("[ADMIN] room-create: password y mensaje deben ser ASCII de 4 chars.")
+                        continue
+                    await self.server.admin_create_room(rest[0], pw, msg, rest[3] if len(rest) == 4 else "phase")
+                    print(f"[ADMIN] Sala '{rest[0]}' creada.")
+                elif cmd == "room-close":
+                    if len(rest) != 1:
+                        print("Uso: room-close <id>")
+                        continue
+                    await self.server.admin_close_room(rest[0])
+                    print(f"[ADMIN] Sala '{rest[0]}' cerrada.")
                 elif cmd == "quit":
                     print("Cerrando...")
-                    # mandar scoreboard si hay partida
-                    if self.server.start_flag:
-                        await self.server.publish_scoreboard()
-                    # cerrar conexiones
-                    for ts in self.server.teams.values():
-                        for cc in list(ts.conns.values()):
-                            try: cc.writer.close(); await cc.writer.wait_closed()
-                            except: pass
+                    # scoreboards de partidas iniciadas y cierre de conexiones
+                    await self.server.shutdown()
                     # matar proceso
                     raise SystemExit
                 else:
@@ -648,10 +1662,22 @@ Comandos:
                 print(f"[ADMIN] Error cmd: {e}")
 
 # ===== entrypoints =====
-async def run_server(host: str, port: int, password: str, message: str, rotate: str = "phase"):
-    srv = HillServer(password, message, rotate)
-    server = await asyncio.start_server(srv.handle_conn, host, port)
+async def run_server(host: str, port: int, password: str, message: str, rotate: str = "phase",
+                     outq_max: int = OUTQ_MAX, outq_policy: str = OUTQ_POLICY,
+                     rate_limits: Optional[Dict[str, Tuple[float, float]]] = None,
+                     idle_timeout: float = IDLE_TIMEOUT, turn_timeout: float = TURN_TIMEOUT,
+                     journal_dir: Optional[str] = None, session_grace: float = SESSION_GRACE,
+                     metrics_port: Optional[int] = None):
+    journal = Journal(journal_dir) if journal_dir else None
+    srv = HillServer(password, message, rotate, outq_max, outq_policy, rate_limits=rate_limits,
+                     idle_timeout=idle_timeout, turn_timeout=turn_timeout, journal=journal,
+                     session_grace=session_grace)
+    srv.start_wheel()
+    server = await start_frame_server(srv.handle_conn, host, port)
     print(f"[SERVER] Escuchando en {host}:{port}")
+    if metrics_port:
+        await srv.start_metrics(metrics_port)
+        print(f"[SERVER] Métricas en http://127.0.0.1:{metrics_port}/metrics")
     print(f"[SERVER] Password='{password}'  Message='{message}'  n={N}  rotate={rotate}")
     # lanzar consola admin
     console = AdminConsole(srv)
@@ -668,8 +1694,41 @@ def main():
     ap.add_argument("--password", required=True)
     ap.add_argument("--message", required=True)
     ap.add_argument("--rotate", choices=["phase","block"], default="phase")
+    ap.add_argument("--outq-max", type=int, default=OUTQ_MAX, help="frames pendientes máx. por conexión")
+    ap.add_argument("--outq-policy", choices=["drop","disconnect"], default=OUTQ_POLICY,
+                    help="al llenarse la cola: descartar ping/turn viejos o desconectar")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="procesos worker con SO_REUSEPORT; cada sala vive en uno (ver hascill_cluster)")
+    ap.add_argument("--worker-port", type=int, default=None,
+                    help="primer puerto privado de los workers (por defecto port+1)")
+    ap.add_argument("--rate-limit", action="append", default=[], metavar="TIPO=TASA/RAFAGA",
+                    help="token bucket por conexión para un tipo de mensaje ('*' = resto); repetible. "
+                         "Por defecto: " + ", ".join(f"{k}={r:g}/{b:g}" for k, (r, b) in RATE_LIMITS.items()))
+    ap.add_argument("--idle-timeout", type=float, default=IDLE_TIMEOUT,
+                    help="s sin recibir frames antes de desconectar a un cliente (0 = nunca)")
+    ap.add_argument("--turn-timeout", type=float, default=TURN_TIMEOUT,
+                    help="s máx. por turno; al vencer pasa al siguiente jugador (0 = sin límite)")
+    ap.add_argument("--journal", default=None, metavar="DIR",
+                    help="bitácora de eventos + snapshots en DIR; si ya existe, restaura la carrera al arrancar")
+    ap.add_argument("--session-grace", type=float, default=SESSION_GRACE,
+                    help="s que un jugador caído puede reconectar con su token y conservar id y turno (0 = desactiva)")
+    ap.add_argument("--metrics-port", type=int, default=None, metavar="PORT",
+                    help="métricas Prometheus en http://127.0.0.1:PORT/metrics (con --workers, el worker k usa PORT+k)")
     args = ap.parse_args()
-    asyncio.run(run_server(args.host, args.port, args.password, args.message, args.rotate))
+    try:
+        rate_limits = parse_rate_limits(args.rate_limit)
+    except ValueError as e:
+        ap.error(str(e))
+    if args.workers > 1:
+        from hascill_cluster import run_cluster
+        run_cluster(args.host, args.port, args.password, args.message, args.rotate, args.workers,
+                    args.outq_max, args.outq_policy, args.worker_port, rate_limits,
+                    args.idle_timeout, args.turn_timeout, args.journal, args.session_grace,
+                    args.metrics_port)
+        return
+    asyncio.run(run_server(args.host, args.port, args.password, args.message, args.rotate,
+                           args.outq_max, args.outq_policy, rate_limits, args.idle_timeout, args.turn_timeout,
+                           args.journal, args.session_grace, args.metrics_port))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# HASCILL — Crypto Race — Implementación de referencia (educativa)
+# © 2025 Sebastián Dario Pérez Pantoja — MIT (ver LICENSE) — SPDX-License-Identifier: MIT
+# Si reutilizas, conserva esta línea de atribución.
+
+"""
+hascill_batch.py — Motor por lotes (sin trazas) para HASCILL.
+- Cifra muchos mensajes independientes a la vez: el pipeline A0 → (B, C, D)×R
+  se ejecuta como operaciones de arreglo sobre el eje de mensajes.
+- El encadenamiento CBC sólo es secuencial a lo largo del índice de bloque.
+- Produce exactamente los mismos bloques que `encrypt_verbose`.
+- Descifrado paralelo: en CBC cada bloque sólo necesita c_{i-1}, así que las
+  rondas inversas de todos los bloques son independientes (un pase vectorizado
+  o un pool de procesos para entradas muy grandes) y A0⁻¹ es una resta desplazada.
+- Usa NumPy si está disponible; si no, cae a una implementación en Python puro.
+
+Ejemplo:
+    from hascill_batch import encrypt_messages
+    cts = encrypt_messages("PAZ9", ["Hils", "Hola mundo"], n=4, rounds=10)
+    txt = decrypt_messages("PAZ9", cts, n=4, rounds=10)
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Sequence, Tuple, Union
+
+try:
+    import numpy as np
+except ImportError:  # fallback en Python puro
+    np = None
+
+from hascill_demo import (
+    HascillKey, ascii_list, blocks_of, get_key, list_to_ascii,
+    mat_vec_mul, pkcs7_pad, pkcs7_unpad,
+)
+
+# Por debajo de este nº de bloques (mensajes × bloques) el pool no compensa.
+PARALLEL_MIN_BLOCKS = 4096
+
+# ========= empaquetado de mensajes =========
+
+def pack_messages(messages: Sequence[str], n: int) -> Tuple[List[List[List[int]]], List[int]]:
+    """Aplica PKCS#7 a cada mensaje y rellena con bloques cero hasta el máximo.
+
+    Devuelve (bloques[msg][blk][j], n_bloques_reales_por_mensaje). Los bloques
+    de relleno van al final, así que no alteran el cifrado de los reales (CBC).
+    """
+    per_msg = [blocks_of(pkcs7_pad(ascii_list(s), n), n) for s in messages]
+    counts = [len(b) for b in per_msg]
+    L = max(counts, default=0)
+    for b in per_msg:
+        b.extend([[0] * n for _ in range(L - len(b))])
+    return per_msg, counts
+
+# ========= núcleo por lotes =========
+
+def _np_offsets(key: HascillKey):
+    """Tabla de offsets del key como arreglos: T0 (m, n) y OFF (m, R, n)."""
+    rows = key.offset_table()
+    T0 = np.asarray([t0 for t0, _ in rows], dtype=np.int64)
+    OFF = np.asarray([offs for _, offs in rows], dtype=np.int64)
+    return T0, OFF
+
+def _encrypt_batch_numpy(blocks, key: HascillKey):
+    m, rounds = key.m, key.rounds
+    V = np.asarray(blocks, dtype=np.int64) % m        # (B, L, n)
+    B, L, n = V.shape
+    Ms_np = [np.asarray(Mr, dtype=np.int64).T for Mr in key.Ms]   # x @ M^T == (M·x)^T
+    S = np.asarray(key.S, dtype=np.int64)
+    T0, OFF = _np_offsets(key)
+    out = np.empty_like(V)
+    prev = np.broadcast_to(np.asarray(key.IV, dtype=np.int64), (B, n))
+    for i in range(L):
+        t0, offs = T0[i % m], OFF[i % m]
+        x = (V[:, i, :] + prev + t0) % m                         # A0
+        for r in range(1, rounds + 1):
+            x = S[x]                                              # B_r
+            x = x @ Ms_np[r-1] % m                                # C_r
+            x = (x + offs[r-1]) % m                               # D_r
+        out[:, i, :] = x
+        prev = x
+    return out
+
+def _encrypt_batch_py(blocks, key: HascillKey):
+    n, m, rounds = key.n, key.m, key.rounds
+    Ms, S = key.Ms, key.S
+    L = len(blocks[0]) if blocks else 0
+    out = [[None] * L for _ in blocks]
+    prevs = [list(key.IV) for _ in blocks]
+    for i in range(L):
+        t0, offs = key.round_offsets(i)
+        for k, msg in enumerate(blocks):
+            blk, prev = msg[i], prevs[k]
+            x = [(blk[j] + prev[j] + t0[j]) % m for j in range(n)]
+            for r in range(1, rounds + 1):
+                o = offs[r-1]
+                x = [S[xx] for xx in x]
+                x = mat_vec_mul(Ms[r-1], x, m)
+                x = [(x[j] + o[j]) % m for j in range(n)]
+            out[k][i] = x
+            prevs[k] = x
+    return out
+
+def encrypt_batch(password: Union[str, HascillKey], blocks, n: int = 4, rounds: int = 10):
+    """Cifra un lote de mensajes ya paddeados.
+
+    `blocks` tiene forma (mensajes, bloques, n) o (bloques, n) para un solo
+    mensaje. Devuelve la misma forma: ndarray con NumPy, listas anidadas sin él.
+    `password` puede ser un HascillKey (entonces manda su n y rounds).
+    """
+    key = get_key(password, n, rounds)
+    n = key.n
+    if np is not None:
+        arr = np.asarray(blocks, dtype=np.int64)
+        single = arr.ndim == 2
+        if single:
+            arr = arr[None, :, :]
+        if arr.ndim != 3 or arr.shape[2] != n:
+            raise ValueError(f"Se esperaba forma (mensajes, bloques, {n}). Recibido: {arr.shape}")
+        out = _encrypt_batch_numpy(arr, key)
+        return out[0] if single else out
+
+    single = bool(blocks) and isinstance(blocks[0][0], int)
+    batch = [blocks] if single else blocks
+    for msg in batch:
+        for blk in msg:
+            if len(blk) != n:
+                raise ValueError(f"Cada bloque debe tener n={n} enteros. Recibido: {blk}")
+    out = _encrypt_batch_py(batch, key)
+    return out[0] if single else out
+
+def encrypt_messages(password: Union[str, HascillKey], messages: Sequence[str], n: int = 4,
+                     rounds: int = 10) -> List[List[List[int]]]:
+    """Cifra varios textos ASCII; devuelve los bloques cifrados de cada uno (listas)."""
+    if not messages:
+        return []
+    key = get_key(password, n, rounds)
+    blocks, counts = pack_messages(messages, key.n)
+    out = encrypt_batch(key, blocks)
+    if np is not None:
+        out = out.tolist()
+    return [out[k][:counts[k]] for k in range(len(messages))]
+
+# ========= descifrado paralelo =========
+
+def _invert_rounds(X, i0, key: HascillKey):
+    """Deshace D/C/B de R..1 para los bloques i0.. de X (sin A0⁻¹).
+
+    X: ndarray (B, L, n) o listas [msg][blk][j]. Función de módulo para que
+    pueda ejecutarse en un ProcessPoolExecutor.
+    """
+    m, rounds = key.m, key.rounds
+    Minvs, Sinv = key.Minvs, key.Sinv
+    if np is not None:
+        Sinv = np.asarray(Sinv, dtype=np.int64)
+        X = np.asarray(X, dtype=np.int64) % m
+        _, L, n = X.shape
+        OFF = _np_offsets(key)[1][np.arange(i0, i0 + L) % m]             # (L, R, n)
+        for r in range(rounds, 0, -1):
+            X = (X - OFF[:, r-1, :]) % m                                  # D_r⁻¹
+            X = X @ np.asarray(Minvs[r-1], dtype=np.int64).T % m         # C_r⁻¹
+            X = Sinv[X]                                                   # B_r⁻¹
+        return X
+
+    out = []
+    for msg in X:
+        rows = []
+        for k, c in enumerate(msg):
+            n = len(c)
+            offs = key.round_offsets(i0 + k)[1]
+            x = list(c)
+            for r in range(rounds, 0, -1):
+                o = offs[r-1]
+                x = [(x[j] - o[j]) % m for j in range(n)]
+                x = mat_vec_mul(Minvs[r-1], x, m)
+                x = [Sinv[xx] for xx in x]
+            rows.append(x)
+        out.append(rows)
+    return out
+
+def _invert_rounds_parallel(X, L, key: HascillKey, workers: int):
+    """Reparte el eje de bloques en `workers` tramos contiguos."""
+    step = -(-L // workers)
+    cuts = list(range(0, L, step))
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        futs = [ex.submit(_invert_rounds, X[:, a:a+step] if np is not None else [msg[a:a+step] for msg in X],
+                          a, key) for a in cuts]
+        parts = [f.result() for f in futs]
+    if np is not None:
+        return np.concatenate(parts, axis=1)
+    return [sum((p[k] for p in parts), []) for k in range(len(X))]
+
+def decrypt_batch(password: Union[str, HascillKey], blocks, n: int = 4, rounds: int = 10, workers: int = 0):
+    """Descifra un lote de ciphertexts; devuelve los bloques con padding.
+
+    `blocks` con forma (mensajes, bloques, n) o (bloques, n). Con `workers` > 1
+    y suficientes bloques, las rondas inversas se reparten en un pool de procesos.
+    """
+    key = get_key(password, n, rounds)
+    n, m, IV = key.n, key.m, key.IV
+
+    if np is not None:
+        C = np.asarray(blocks, dtype=np.int64)
+        single = C.ndim == 2
+        if single:
+            C = C[None, :, :]
+        if C.ndim != 3 or C.shape[2] != n:
+            raise ValueError(f"Se esperaba forma (mensajes, bloques, {n}). Recibido: {C.shape}")
+        B, L, _ = C.shape
+    else:
+        single = bool(blocks) and isinstance(blocks[0][0], int)
+        C = [blocks] if single else blocks
+        for msg in C:
+            for blk in msg:
+                if len(blk) != n:
+                    raise ValueError(f"Cada bloque debe tener n={n} enteros. Recibido: {blk}")
+        B, L = len(C), (len(C[0]) if C else 0)
+
+    if workers > 1 and L >= workers and B * L >= PARALLEL_MIN_BLOCKS:
+        X = _invert_rounds_parallel(C, L, key, workers)
+    else:
+        X = _invert_rounds(C, 0, key)
+
+    # A0⁻¹ como una sola resta desplazada: prev_i = c_{i-1}, prev_0 = IV
+    if np is not None:
+        prev = np.empty_like(C)
+        prev[:, 0, :] = np.asarray(IV, dtype=np.int64)
+        prev[:, 1:, :] = C[:, :-1, :]
+        T0 = _np_offsets(key)[0][np.arange(L) % m]
+        V = (X - prev - T0) % m
+        return V[0] if single else V
+
+    T0 = [key.round_offsets(i)[0] for i in range(L)]
+    V = []
+    for xs, cs in zip(X, C):
+        prevs = [list(IV)] + [list(c) for c in cs[:-1]]
+        V.append([[(x[j] - p[j] - t[j]) % m for j in range(n)]
+                  for x, p, t in zip(xs, prevs, T0)])
+    return V[0] if single else V
+
+def decrypt_messages(password: Union[str, HascillKey], ciphertexts: Sequence[List[List[int]]], n: int = 4,
+                     rounds: int = 10, workers: int = 0) -> List[str]:
+    """Descifra varios ciphertexts (listas de bloques) y quita PKCS#7 a cada uno."""
+    if not ciphertexts:
+        return []
+    key = get_key(password, n, rounds)
+    counts = [len(c) for c in ciphertexts]
+    L = max(counts)
+    padded = [list(c) + [[0] * key.n] * (L - len(c)) for c in ciphertexts]
+    out = decrypt_batch(key, padded, workers=workers)
+    if np is not None:
+        out = out.tolist()
+    texts = []
+    for k, cnt in enumerate(counts):
+        flat = [x for blk in out[k][:cnt] for x in blk]
+        texts.append(list_to_ascii(pkcs7_unpad(flat)))
+    return texts
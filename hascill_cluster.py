@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# HASCILL — Crypto Race — Implementación de referencia (educativa)
+# Copyright (c) 2025 Sebastián Dario Pérez Pantoja
+# Autor: Sebastián Dario Pérez Pantoja — GitHub: https://github.com/sebastiandperez
+# Licencia: MIT (ver LICENSE) — SPDX-License-Identifier: MIT
+# Si reutilizas, conserva esta línea de atribución.
+#
+# Archivo: hascill_cluster.py
+# Proyecto: HASCILL
+# Repo: https://github.com/sebastiandperez/HASCILL-Crypto-Race
+
+"""
+hascill_cluster.py — Modo multi-proceso del servidor (--workers N).
+- N procesos worker, cada uno con su event loop y su HillServer, escuchan el
+  mismo puerto público con SO_REUSEPORT: el kernel reparte los accepts.
+- Cada sala vive en un solo worker, elegido por rendezvous hashing del id de
+  sala (estable entre procesos y mínimo reparto al cambiar N). Si un join llega
+  a otro worker, éste responde {"type":"redirect","room":ID,"port":P} con el
+  puerto privado del dueño y el cliente reconecta allí.
+- La consola admin corre en el proceso padre (ClusterAdmin): reenvía los poderes
+  de admin al worker dueño de la sala por un Pipe local y agrega salas y
+  métricas de todos los workers.
+"""
+
+import asyncio, hashlib, multiprocessing, os
+from typing import List, Optional
+
+from hascill_async_server import (
+    AdminConsole, HillServer, IDLE_TIMEOUT, N, OUTQ_MAX, OUTQ_POLICY, SESSION_GRACE, TURN_TIMEOUT,
+    start_frame_server
+)
+from hascill_journal import Journal
+
+# operaciones de HillServer que el padre puede invocar por IPC
+IPC_OPS = ("room_call", "room_info", "admin_create_room", "admin_close_room", "admin_stats", "shutdown")
+
+class ShardMap:
+    """Qué worker aloja cada sala y en qué puerto privado escucha."""
+    def __init__(self, me: Optional[int], ports: List[int]):
+        self.me = me          # índice de este worker (None en el proceso padre)
+        self.ports = list(ports)
+
+    def owner(self, room_id: str) -> int:
+        def score(k: int) -> bytes:
+            return hashlib.blake2b(f"{k}:{room_id}".encode("utf-8"), digest_size=8).digest()
+        return max(range(len(self.ports)), key=score)
+
+    def port_of(self, room_id: str) -> int:
+        return self.ports[self.owner(room_id)]
+
+# ===== worker =====
+async def _worker(me: int, host: str, port: int, ports: List[int], password: str, message: str,
+                  rotate: str, outq_max: int, outq_policy: str, rate_limits: Optional[dict],
+                  idle_timeout: float, turn_timeout: float, journal_dir: Optional[str],
+                  session_grace: float, metrics_port: Optional[int], conn):
+    # cada worker lleva su propia bitácora: sus salas son sólo suyas
+    journal = Journal(os.path.join(journal_dir, f"worker-{me}")) if journal_dir else None
+    srv = HillServer(password, message, rotate, outq_max, outq_policy, shard=ShardMap(me, ports),
+                     rate_limits=rate_limits, idle_timeout=idle_timeout, turn_timeout=turn_timeout,
+                     journal=journal, session_grace=session_grace)
+    srv.start_wheel()
+    public = await start_frame_server(srv.handle_conn, host, port, reuse_port=True)
+    private = await start_frame_server(srv.handle_conn, host, ports[me])
+    if metrics_port:
+        await srv.start_metrics(metrics_port + me)   # cada worker mide su propio loop
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+
+    async def serve(rid: int, op: str, args: tuple):
+        try:
+            if op not in IPC_OPS:
+                raise ValueError(f"Operación no permitida: {op}")
+            res = await getattr(srv, op)(*args)
+            if op == "shutdown":
+                stop.set()
+            reply = (rid, True, res)
+        except Exception as e:
+            reply = (rid, False, str(e))
+        conn.send(reply)
+
+    def on_ipc():
+        try:
+            rid, op, args = conn.recv()
+        except (EOFError, OSError):   # el padre murió
+            loop.remove_reader(conn.fileno())
+            stop.set()
+            return
+        asyncio.create_task(serve(rid, op, args))
+
+    loop.add_reader(conn.fileno(), on_ipc)
+    async with public, private:
+        await stop.wait()
+
+def _worker_main(*args):
+    try:
+        asyncio.run(_worker(*args))
+    except KeyboardInterrupt:
+        pass
+
+# ===== admin en el proceso padre =====
+class ClusterAdmin:
+    """Misma interfaz de admin que HillServer, resuelta por IPC contra los workers."""
+    def __init__(self, shard: ShardMap, pipes: list):
+        self.shard = shard
+        self.pipes = pipes
+        self.locks = [asyncio.Lock() for _ in pipes]
+        self._rid = 0
+
+    async def _call(self, k: int, op: str, *args):
+        loop = asyncio.get_running_loop()
+        async with self.locks[k]:
+            self._rid += 1
+            self.pipes[k].send((self._rid, op, args))
+            _, ok, res = await loop.run_in_executor(None, self.pipes[k].recv)
+        if not ok:
+            raise ValueError(res)
+        return res
+
+    async def _all(self, op: str, *args) -> list:
+        return await asyncio.gather(*(self._call(k, op, *args) for k in range(len(self.pipes))))
+
+    async def room_call(self, room_id: str, method: str, *args):
+        return await self._call(self.shard.owner(room_id), "room_call", room_id, method, *args)
+
+    async def room_info(self) -> List[dict]:
+        return [r for rows in await self._all("room_info") for r in rows]
+
+    async def admin_create_room(self, room_id: str, password: str, message: str, rotate: str = "phase"):
+        await self._call(self.shard.owner(room_id), "admin_create_room", room_id, password, message, rotate)
+
+    async def admin_close_room(self, room_id: str):
+        await self._call(self.shard.owner(room_id), "admin_close_room", room_id)
+
+    async def admin_stats(self) -> dict:
+        parts = await self._all("admin_stats")
+        total = {k: sum(p[k] for p in parts)
+                 for k in ("rooms", "conns", "depth", "sent", "dropped", "throttled", "reaped", "resumed",
+                           "timers")}
+        total["depth_max"] = max(p["depth_max"] for p in parts)
+        total["high_water"] = max(p["high_water"] for p in parts)
+        by_type: dict = {}
+        for p in parts:
+            for k, v in p["throttled_by_type"].items():
+                by_type[k] = by_type.get(k, 0) + v
+        total["throttled_by_type"] = by_type
+        return total
+
+    async def shutdown(self):
+        await self._all("shutdown")
+
+# ===== entrypoint =====
+def run_cluster(host: str, port: int, password: str, message: str, rotate: str = "phase", workers: int = 2,
+                outq_max: int = OUTQ_MAX, outq_policy: str = OUTQ_POLICY, worker_port: Optional[int] = None,
+                rate_limits: Optional[dict] = None, idle_timeout: float = IDLE_TIMEOUT,
+                turn_timeout: float = TURN_TIMEOUT, journal_dir: Optional[str] = None,
+                session_grace: float = SESSION_GRACE, metrics_port: Optional[int] = None):
+    """Lanza `workers` procesos sobre host:port y corre la consola admin en este proceso.
+
+    Los puertos privados son worker_port..worker_port+workers-1 (por defecto port+1..).
+    Con journal_dir, el worker k usa journal_dir/worker-k (restaurar exige el mismo N).
+    Con metrics_port, el worker k expone sus métricas en 127.0.0.1:metrics_port+k.
+    """
+    base = worker_port or port + 1
+    ports = [base + k for k in range(workers)]
+    methods = multiprocessing.get_all_start_methods()
+    ctx = multiprocessing.get_context("fork" if "fork" in methods else None)
+    pipes, procs = [], []
+    for k in range(workers):
+        parent, child = ctx.Pipe()
+        p = ctx.Process(target=_worker_main, daemon=True,
+                        args=(k, host, port, ports, password, message, rotate, outq_max, outq_policy,
+                              rate_limits, idle_timeout, turn_timeout, journal_dir, session_grace,
+                              metrics_port, child))
+        p.start()
+        child.close()
+        pipes.append(parent)
+        procs.append(p)
+    print(f"[SERVER] {workers} workers escuchando en {host}:{port} (privados {ports[0]}..{ports[-1]})")
+    print(f"[SERVER] Password='{password}'  Message='{message}'  n={N}  rotate={rotate}")
+    if metrics_port:
+        print(f"[SERVER] Métricas en 127.0.0.1, puertos {metrics_port}..{metrics_port + workers - 1} (/metrics)")
+
+    async def console():
+        await AdminConsole(ClusterAdmin(ShardMap(None, ports), pipes)).run()
+    try:
+        asyncio.run(console())
+    except (SystemExit, KeyboardInterrupt):
+        pass
+    finally:
+        for p in procs:
+            p.join(timeout=5)
+            if p.is_alive():
+                p.terminate()
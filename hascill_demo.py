@@ -6,19 +6,45 @@
 
 """
 hascill_demo.py — Demo interactiva de HASCILL (SPN) con n=4 y 10 rondas por defecto.
-- Cifrado/descifrado con trazas paso a paso.
+- Cifrado/descifrado con trazas paso a paso; el núcleo (encrypt/decrypt) no
+  imprime nada y sólo emite eventos a un sink opcional (consola o NDJSON).
 - Deriva todo desde la contraseña ASCII:
   m primo, subclaves por ronda (M_r, b_r), IV único y tweaks por bloque/ronda.
 - Salidas: bloques, formato CLI y Base64 compacto (2 bytes por entero).
+- Contenedor binario versionado (cabecera n/rounds/m/bloques + payload uint16
+  big-endian), leído con mmap; el Base64 queda como formato de import/export.
+- Modo streaming (--in/--out): cifra/descifra archivos de cualquier tamaño con
+  memoria constante (contenedor binario, sin trazas).
 
 Ejemplos:
     python3 hascill_demo.py --mode enc --password PAZ9 --message Hils
     python3 hascill_demo.py --mode dec --password PAZ9 --cipher "...,..." --n 4 --rounds 10
     python3 hascill_demo.py --mode dec --password PAZ9 --cipher-b64 "AAAA..." --n 4 --rounds 10
+    python3 hascill_demo.py --mode enc --password PAZ9 --message Hils --quiet --trace-ndjson traza.ndjson
+    python3 hascill_demo.py --mode enc --password PAZ9 --message Hils --out hils.hsc
+    python3 hascill_demo.py --mode dec --password PAZ9 --cipher-file hils.hsc
+    python3 hascill_demo.py --mode enc --password PAZ9 --in datos.txt --out datos.hsc
+    cat datos.hsc | python3 hascill_demo.py --mode dec --password PAZ9 --in - --out -
 """
 
-import argparse, base64
-from typing import List, Tuple
+import argparse, base64, json, mmap, os, struct, sys, threading, time
+from array import array
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple, Union
+
+try:
+    import numpy as np
+except ImportError:  # el contenedor funciona igual con array('H')
+    np = None
+
+# det/inversa mod m por eliminación gaussiana (O(n³)), compartidas con el juego
+import game_core
+from game_core import det_mod, mat_inverse_mod, sbox_tables
+
+# antes vivían aquí; se conservan como alias para quien las importe desde la demo
+matrix_minor = game_core.matrix_minor
+adjugate_mod = game_core.adjugate_mod
 
 # ========= utilidades de impresión =========
 
@@ -65,30 +91,6 @@ def next_prime_condition(start: int, cond=lambda x: True) -> int:
         if is_prime(p) and cond(p): return p
         p += 2
 
-def matrix_minor(mat: List[List[int]], i: int, j: int) -> List[List[int]]:
-    return [row[:j] + row[j+1:] for r, row in enumerate(mat) if r != i]
-
-def det_mod(mat: List[List[int]], m: int) -> int:
-    n = len(mat)
-    if n == 1: return mat[0][0] % m
-    if n == 2: return (mat[0][0]*mat[1][1] - mat[0][1]*mat[1][0]) % m
-    total = 0
-    for j in range(n):
-        sign = -1 if (j % 2) else 1
-        sub = matrix_minor(mat, 0, j)
-        total = (total + sign * mat[0][j] * det_mod(sub, m)) % m
-    return total % m
-
-def adjugate_mod(mat: List[List[int]], m: int) -> List[List[int]]:
-    n = len(mat)
-    cof = [[0]*n for _ in range(n)]
-    for i in range(n):
-        for j in range(n):
-            sub = matrix_minor(mat, i, j)
-            sign = -1 if ((i+j) % 2) else 1
-            cof[i][j] = (sign * det_mod(sub, m)) % m
-    return [[cof[j][i] % m for j in range(n)] for i in range(n)]
-
 def mat_vec_mul(M: List[List[int]], v: List[int], m: int) -> List[int]:
     n = len(M)
     out = [0]*n
@@ -99,22 +101,16 @@ def mat_vec_mul(M: List[List[int]], v: List[int], m: int) -> List[int]:
         out[i] = s % m
     return out
 
-def mat_inverse_mod(M: List[List[int]], m: int) -> List[List[int]]:
-    d = det_mod(M, m)
-    if d % m == 0: raise ValueError("M no invertible")
-    inv_d = inv_int(d, m)
-    adj = adjugate_mod(M, m)
-    n = len(M)
-    return [[(inv_d * adj[i][j]) % m for j in range(n)] for i in range(n)]
-
 # ========= S-box y padding =========
 
 def sbox(x: int, m: int) -> int:
-    return pow(x, 3, m)
+    return sbox_tables(m)[0][x % m]
 
 def sbox_inv(y: int, m: int) -> int:
-    e = inv_int(3, m - 1)   # inversa de 3 modulo (m-1)
-    return pow(y, e, m)
+    # tabla S⁻¹ (equivale a y^e con e = 3^{-1} mod (m-1)), construida una vez por m
+    Sinv = sbox_tables(m)[1]
+    if Sinv is None: raise ValueError("S-box no invertible para este m")
+    return Sinv[y % m]
 
 def pkcs7_pad(data: List[int], block_size: int) -> List[int]:
     pad = block_size - (len(data) % block_size)
@@ -201,26 +197,36 @@ def list_to_ascii(v: List[int]) -> str:
 def blocks_of(v: List[int], n: int) -> List[List[int]]:
     return [v[i:i+n] for i in range(0, len(v), n)]
 
+_SWAP = sys.byteorder == "little"   # el formato en disco/red es big-endian
+
+def values_to_bytes(vals) -> bytes:
+    """Secuencia de enteros -> uint16 big-endian, sin bucles por elemento en Python."""
+    arr = array("H")
+    try:
+        arr.extend(vals)
+    except OverflowError:
+        raise ValueError("Valor fuera de rango para 2 bytes.")
+    if _SWAP: arr.byteswap()
+    return arr.tobytes()
+
+def bytes_to_values(data) -> array:
+    """bytes/memoryview uint16 big-endian -> array('H') en orden nativo."""
+    if len(data) % 2 != 0:
+        raise ValueError("Bytes inválidos (longitud impar).")
+    arr = array("H")
+    arr.frombytes(data)
+    if _SWAP: arr.byteswap()
+    return arr
+
 def blocks_to_bytes(blocks: List[List[int]]) -> bytes:
     """Serializa cada entero en 2 bytes big-endian (suficiente para m < 65536)."""
-    out = bytearray()
-    for blk in blocks:
-        for x in blk:
-            if x < 0 or x > 0xFFFF:
-                raise ValueError("Valor fuera de rango para 2 bytes.")
-            out.append((x >> 8) & 0xFF)
-            out.append(x & 0xFF)
-    return bytes(out)
+    return values_to_bytes(x for blk in blocks for x in blk)
 
 def bytes_to_blocks(data: bytes, n: int) -> List[List[int]]:
-    if len(data) % 2 != 0:
-        raise ValueError("Bytes inválidos (longitud impar).")
-    vals = []
-    for i in range(0, len(data), 2):
-        vals.append((data[i] << 8) | data[i+1])
+    vals = bytes_to_values(data).tolist()
     if len(vals) % n != 0:
         raise ValueError(f"N° de enteros {len(vals)} no múltiplo de n={n}.")
-    return [vals[i:i+n] for i in range(0, len(vals), n)]
+    return blocks_of(vals, n)
 
 def blocks_to_b64(blocks: List[List[int]]) -> str:
     return base64.b64encode(blocks_to_bytes(blocks)).decode("ascii")
@@ -229,6 +235,74 @@ def b64_to_blocks(b64: str, n: int) -> List[List[int]]:
     data = base64.b64decode(b64.encode("ascii"))
     return bytes_to_blocks(data, n)
 
+# ========= Contenedor binario versionado =========
+# Cabecera fija big-endian + payload uint16 big-endian (mismo payload que el Base64).
+
+CONTAINER_MAGIC = b"HSCL"
+CONTAINER_VERSION = 1
+CONTAINER_HDR = struct.Struct(">4sBBHHQ")   # magic, versión, n, rounds, m, nº de bloques
+COUNT_UNKNOWN = 0xFFFFFFFFFFFFFFFF          # streaming a salida no seekable: bloques hasta EOF
+
+@dataclass(frozen=True)
+class ContainerHeader:
+    n: int
+    rounds: int
+    m: int
+    count: int = COUNT_UNKNOWN
+
+    def pack(self) -> bytes:
+        return CONTAINER_HDR.pack(CONTAINER_MAGIC, CONTAINER_VERSION, self.n, self.rounds, self.m, self.count)
+
+    @classmethod
+    def unpack(cls, buf) -> "ContainerHeader":
+        if len(buf) < CONTAINER_HDR.size:
+            raise ValueError("Contenedor truncado (cabecera incompleta).")
+        magic, ver, n, rounds, m, count = CONTAINER_HDR.unpack_from(buf, 0)
+        if magic != CONTAINER_MAGIC:
+            raise ValueError("No es un contenedor HASCILL (magic inválido).")
+        if ver != CONTAINER_VERSION:
+            raise ValueError(f"Versión de contenedor no soportada: {ver}")
+        if n == 0 or rounds == 0:
+            raise ValueError(f"Cabecera inválida: n={n}, rounds={rounds} (deben ser > 0).")
+        return cls(n, rounds, m, count)
+
+def pack_container(blocks: List[List[int]], n: int, rounds: int, m: int) -> bytes:
+    return ContainerHeader(n, rounds, m, len(blocks)).pack() + blocks_to_bytes(blocks)
+
+def unpack_container(data) -> Tuple[ContainerHeader, "array"]:
+    """bytes/memoryview/mmap -> (cabecera, valores). Con NumPy el payload es una vista sin copia."""
+    hdr = ContainerHeader.unpack(data)
+    size = len(data) - CONTAINER_HDR.size
+    avail = size // 2
+    count = avail // hdr.n if hdr.count == COUNT_UNKNOWN else hdr.count
+    if count * hdr.n > avail or (hdr.count == COUNT_UNKNOWN and size % (2 * hdr.n)):
+        raise ValueError(f"Contenedor truncado: se esperaban {count} bloques de n={hdr.n}.")
+    hdr = ContainerHeader(hdr.n, hdr.rounds, hdr.m, count)
+    if np is not None:
+        return hdr, np.frombuffer(data, dtype=">u2", count=count * hdr.n, offset=CONTAINER_HDR.size)
+    with memoryview(data) as mv, mv[CONTAINER_HDR.size:CONTAINER_HDR.size + 2 * count * hdr.n] as payload:
+        return hdr, bytes_to_values(payload)
+
+def read_container(path: str) -> Tuple[ContainerHeader, "array"]:
+    """Lee un contenedor mapeando el archivo en memoria (apto para archivos grandes)."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError("Contenedor vacío.")
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if np is not None:
+        return unpack_container(mm)   # la vista de NumPy mantiene vivo el mmap
+    try:
+        return unpack_container(mm)
+    finally:
+        mm.close()
+
+def write_container(path: str, blocks: List[List[int]], n: int, rounds: int, m: int):
+    with open(path, "wb") as f:
+        f.write(pack_container(blocks, n, rounds, m))
+
+def container_blocks(hdr: ContainerHeader, vals) -> List[List[int]]:
+    return blocks_of(vals.tolist(), hdr.n)
+
 # ========= Derivación “todo en uno” =========
 
 def derive_all_from_password(password: str, n: int, rounds: int):
@@ -238,123 +312,401 @@ def derive_all_from_password(password: str, n: int, rounds: int):
     Ms, bs, IV = derive_round_params(bytes(P), n, m, rounds=rounds)
     return P, m, key_sum, Ms, bs, IV
 
-# ========= Cifrado / Descifrado con trazas (rondas) =========
-
-def encrypt_verbose(password: str, plaintext: str, n: int = 4, rounds: int = 10) -> List[List[int]]:
-    hrule()
-    print(f"CIFRADO HASCILL — n={n}, rounds={rounds}")
-    hrule("-")
-
-    P, m, key_sum, Ms, bs, IV = derive_all_from_password(password, n, rounds)
-
-    print(f"[1] Contraseña: {password!r} → ASCII: {ascii_list(password)}")
-    print(f"[2] Primo m derivado: {m} (gcd(3,m-1)=1 para S-box cúbica)")
-    for r, Mr in enumerate(Ms, 1):
-        print_mat(f"[3] M_{r} (mod m)", Mr)
-        print_vec(f"[3] b_{r}", bs[r-1])
-    print_vec("[3] IV", IV)
-    print(f"[4] key_sum = sum(P) mod m = {key_sum}")
-    hrule("-")
-
+class HascillKey:
+    """Key schedule precomputado para (password, n, rounds).
+
+    Se construye una vez y se reutiliza en cada cifrado/descifrado: m, key_sum,
+    M_r y M_r⁻¹, b_r, IV, tablas S/S⁻¹ y tabla de offsets por ronda. Vectores y
+    filas se guardan en array('H') (m < 65536).
+    """
+    __slots__ = ("password", "n", "rounds", "P", "m", "key_sum",
+                 "Ms", "Minvs", "bs", "IV", "S", "Sinv", "_offsets")
+
+    def __init__(self, password: str, n: int = 4, rounds: int = 10):
+        P, m, key_sum, Ms, bs, IV = derive_all_from_password(password, n, rounds)
+        S, Sinv = sbox_tables(m)
+        self.password = password
+        self.n, self.rounds = n, rounds
+        self.P = array("H", P)
+        self.m, self.key_sum = m, key_sum
+        self.Ms = tuple(tuple(array("H", row) for row in Mr) for Mr in Ms)
+        self.Minvs = tuple(tuple(array("H", row) for row in mat_inverse_mod(Mr, m)) for Mr in Ms)
+        self.bs = tuple(array("H", br) for br in bs)
+        self.IV = array("H", IV)
+        self.S = array("H", S)
+        self.Sinv = array("H", Sinv)
+        self._offsets = None
+
+    def _build_offsets(self):
+        # t_{i,r}[j] = key_sum + (i+1)(j+1) + r es afín en i: del bloque i al i+1
+        # sólo se suma (j+1). Además depende de (i+1) mod m, así que m filas bastan.
+        n, m, R = self.n, self.m, self.rounds
+        step = [j + 1 for j in range(n)]
+        t = [(self.key_sum + s) % m for s in step]                   # t_{0,0}
+        # constante por ronda: b_r + r (con 1 ronda el D usa t0, sin +r)
+        base = [[(bj + (0 if R == 1 else r)) % m for bj in b] for r, b in enumerate(self.bs, 1)]
+        rows = []
+        for _ in range(m):
+            offs = tuple(array("H", [(c + tj) % m for c, tj in zip(cr, t)]) for cr in base)
+            rows.append((array("H", t), offs))
+            t = [(tj + s) % m for tj, s in zip(t, step)]
+        self._offsets = rows
+
+    def round_offsets(self, i: int) -> Tuple[array, Tuple[array, ...]]:
+        """(t_{i,0}, (b_1+t_{i,1}, ..., b_R+t_{i,R})) ya reducidos mod m.
+
+        Filas precalculadas y compartidas (no modificarlas): el paso D_r queda
+        en una sola suma por componente y sin asignar memoria por bloque.
+        """
+        if self._offsets is None:
+            self._build_offsets()
+        return self._offsets[i % self.m]
+
+    def offset_table(self) -> List[Tuple[array, Tuple[array, ...]]]:
+        """Las m filas de round_offsets (i = 0..m-1)."""
+        if self._offsets is None:
+            self._build_offsets()
+        return self._offsets
+
+    def tweak(self, i: int, r: int | None = None) -> List[int]:
+        """Igual que compute_tweak(i, n, m, key_sum, r), pero desde tabla."""
+        t0 = self.round_offsets(i)[0]
+        if r is None:
+            return list(t0)
+        m = self.m
+        return [(t + r) % m for t in t0]
+
+    def __repr__(self) -> str:
+        return f"HascillKey(n={self.n}, rounds={self.rounds}, m={self.m})"
+
+class KeyCache:
+    """Cache LRU de HascillKey por (password bytes, n, rounds).
+
+    - capacity: nº máximo de claves; al superarlo se expulsa la menos usada.
+    - ttl: segundos de vida de cada entrada (None = sin caducidad).
+    - stats(): contadores hits/misses/evictions/expirations para exportar.
+    """
+
+    def __init__(self, capacity: int = 128, ttl: Optional[float] = None):
+        if capacity < 1: raise ValueError("capacity debe ser >= 1")
+        self.capacity = capacity
+        self.ttl = ttl
+        self._data: "OrderedDict[Tuple[bytes, int, int], Tuple[float, HascillKey]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def get(self, password: str, n: int = 4, rounds: int = 10) -> HascillKey:
+        ck = (bytes(ascii_list(password)), n, rounds)
+        now = time.monotonic()
+        with self._lock:
+            ent = self._data.get(ck)
+            if ent is not None:
+                if self.ttl is None or now - ent[0] < self.ttl:
+                    self._data.move_to_end(ck)
+                    self.hits += 1
+                    return ent[1]
+                del self._data[ck]
+                self.expirations += 1
+            self.misses += 1
+        key = HascillKey(password, n, rounds)   # fuera del lock: derivación costosa
+        with self._lock:
+            self._data[ck] = (now, key)
+            self._data.move_to_end(ck)
+            while len(self._data) > self.capacity:
+                self._data.popitem(last=False)
+                self.evictions += 1
+        return key
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Union[int, float, None]]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {"size": len(self._data), "capacity": self.capacity, "ttl": self.ttl,
+                    "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "expirations": self.expirations,
+                    "hit_rate": (self.hits / total) if total else 0.0}
+
+# Cache compartida por la demo, el motor por lotes y cualquier servicio que importe este módulo.
+KEY_CACHE = KeyCache()
+
+def get_key(password: Union[str, HascillKey], n: int = 4, rounds: int = 10,
+            cache: Optional[KeyCache] = KEY_CACHE) -> HascillKey:
+    """Acepta una contraseña o un HascillKey ya construido (cache=None evita la cache)."""
+    if isinstance(password, HascillKey):
+        return password
+    if cache is None:
+        return HascillKey(password, n, rounds)
+    return cache.get(password, n, rounds)
+
+# ========= Traza estructurada (opcional) =========
+# El núcleo no imprime nada: si recibe un `trace` (callable) le entrega un
+# TraceEvent por paso. Sin trace no se construye ni formatea ningún evento.
+
+@dataclass
+class TraceEvent:
+    """Un paso de la traza: qué (step), dónde (block/round) y su valor."""
+    step: str                # "key", "A0", "B", "C", "D", "OUT", "D_inv", ..., "rule", "begin_block", ...
+    label: str = ""          # texto para el render de consola
+    value: Any = None        # vector, matriz, escalar o None
+    block: int = -1
+    round: int = 0
+
+TraceSink = Callable[[TraceEvent], None]
+
+def console_trace(ev: TraceEvent):
+    """Render de consola con el formato clásico de la demo."""
+    v = ev.value
+    if ev.step == "rule":
+        hrule(v or "=")
+    elif ev.step == "end_block":
+        hrule(".")
+    elif v is None:
+        print(ev.label)
+    elif isinstance(v, list) and v and isinstance(v[0], list):
+        print_mat(ev.label, v)
+    elif isinstance(v, list):
+        print_vec(ev.label, v)
+    else:
+        print(f"{ev.label}: {v}")
+
+class NDJSONTrace:
+    """Exporta cada evento como una línea JSON (NDJSON), sin los que sólo son de render."""
+    RENDER_ONLY = ("rule", "title", "note")
+
+    def __init__(self, f: TextIO):
+        self.f = f
+
+    def __call__(self, ev: TraceEvent):
+        if ev.step in self.RENDER_ONLY: return
+        self.f.write(json.dumps(asdict(ev), ensure_ascii=False) + "\n")
+
+def tee_trace(*sinks: Optional[TraceSink]) -> Optional[TraceSink]:
+    """Combina varios sinks; None si no queda ninguno (camino rápido)."""
+    sinks = tuple(s for s in sinks if s is not None)
+    if not sinks: return None
+    if len(sinks) == 1: return sinks[0]
+    def fan(ev: TraceEvent):
+        for s in sinks: s(ev)
+    return fan
+
+def _trace_key(trace: TraceSink, key: HascillKey, inverse: bool):
+    trace(TraceEvent("key", f"[1] Contraseña {key.password!r} → ASCII", list(key.P)))
+    trace(TraceEvent("key", "[2] Primo m derivado (gcd(3,m-1)=1 para S-box cúbica)", key.m))
+    for r in range(1, key.rounds+1):
+        trace(TraceEvent("key", f"[3] M_{r} (mod m)", [list(row) for row in key.Ms[r-1]], round=r))
+        if inverse:
+            trace(TraceEvent("key", f"[3] M_{r}^(-1)", [list(row) for row in key.Minvs[r-1]], round=r))
+        trace(TraceEvent("key", f"[3] b_{r}", list(key.bs[r-1]), round=r))
+    trace(TraceEvent("key", "[3] IV", list(key.IV)))
+    trace(TraceEvent("key", "[4] key_sum = sum(P) mod m", key.key_sum))
+    trace(TraceEvent("rule", value="-"))
+
+# ========= Cifrado / Descifrado por bloque =========
+
+def encrypt_block(key: HascillKey, i: int, blk: List[int], prev: List[int],
+                  trace: Optional[TraceSink] = None) -> List[int]:
+    """Cifra el bloque i (A0 + R rondas) dado prev = c_{i-1} (o IV)."""
+    n, m, rounds = key.n, key.m, key.rounds
+    Ms, S = key.Ms, key.S
+    t0, offs = key.round_offsets(i)
+    x = [(blk[j] + prev[j] + t0[j]) % m for j in range(n)]
+    if trace is not None:
+        trace(TraceEvent("begin_block", f"[BLOQUE {i}]", block=i))
+        trace(TraceEvent("tweak", "  tweak t0", list(t0), i))
+        trace(TraceEvent("prev", "  prev    ", list(prev), i))
+        trace(TraceEvent("v", "  v_i     ", list(blk), i))
+        trace(TraceEvent("A0", "  A0) x = v+prev+t0", x, i))
+    for r in range(1, rounds+1):
+        x = [S[xx] for xx in x]                                  # B_r
+        if trace is not None: trace(TraceEvent("B", f"  B{r}) S(x)", x, i, r))
+        x = mat_vec_mul(Ms[r-1], x, m)                           # C_r
+        if trace is not None: trace(TraceEvent("C", f"  C{r}) M_{r}·x", x, i, r))
+        o = offs[r-1]
+        x = [(x[j] + o[j]) % m for j in range(n)]                # D_r (o = b_r + t_r)
+        if trace is not None: trace(TraceEvent("D", f"  D{r}) x = x+b_{r}+t_{r}", x, i, r))
+    if trace is not None:
+        trace(TraceEvent("OUT", "  OUT) c", x, i))
+        trace(TraceEvent("end_block", block=i))
+    return x
+
+def decrypt_block(key: HascillKey, i: int, c: List[int], prev: List[int],
+                  trace: Optional[TraceSink] = None) -> List[int]:
+    """Descifra el bloque i (R..1 rondas inversas + A0⁻¹) dado prev = c_{i-1} (o IV)."""
+    n, m, rounds = key.n, key.m, key.rounds
+    Minvs, Sinv = key.Minvs, key.Sinv
+    t0, offs = key.round_offsets(i)
+    x = list(c)
+    if trace is not None:
+        trace(TraceEvent("begin_block", f"[BLOQUE {i} — inverso]", block=i))
+        trace(TraceEvent("tweak", "  tweak t0", list(t0), i))
+        trace(TraceEvent("prev", "  prev    ", list(prev), i))
+        trace(TraceEvent("c", "  c_i     ", list(c), i))
+    for r in range(rounds, 0, -1):
+        o = offs[r-1]
+        x = [(x[j] - o[j]) % m for j in range(n)]                # D_r^{-1}
+        if trace is not None: trace(TraceEvent("D_inv", f"  D{r}⁻¹) x = x - b_{r} - t_{r}", x, i, r))
+        x = mat_vec_mul(Minvs[r-1], x, m)                        # C_r^{-1}
+        if trace is not None: trace(TraceEvent("C_inv", f"  C{r}⁻¹) x = M_{r}^(-1)·x", x, i, r))
+        x = [Sinv[xx] for xx in x]                               # B_r^{-1}
+        if trace is not None: trace(TraceEvent("B_inv", f"  B{r}⁻¹) x = S^{{-1}}(x)", x, i, r))
+    v = [(x[j] - prev[j] - t0[j]) % m for j in range(n)]         # A0^{-1}
+    if trace is not None:
+        trace(TraceEvent("A0_inv", "  A0⁻¹) v = x - prev - t0", v, i))
+        trace(TraceEvent("end_block", block=i))
+    return v
+
+# ========= Cifrado / Descifrado de mensajes =========
+
+def encrypt(password: Union[str, HascillKey], plaintext: str, n: int = 4, rounds: int = 10,
+            trace: Optional[TraceSink] = None) -> List[List[int]]:
+    """Cifra un texto ASCII. Sin `trace` es el camino rápido (no imprime nada)."""
+    key = get_key(password, n, rounds)
+    n = key.n
     v_ascii = ascii_list(plaintext)
     v_pad = pkcs7_pad(v_ascii, n)
-    print_vec("[5] Plaintext ASCII", v_ascii)
-    print_vec("[5] + PKCS#7", v_pad)
     v_blocks = blocks_of(v_pad, n)
-    print(f"[5] Bloques n={n}: {len(v_blocks)} → {v_blocks}")
-    hrule("-")
-
-    prev = IV[:]
+    if trace is not None:
+        trace(TraceEvent("rule", value="="))
+        trace(TraceEvent("title", f"CIFRADO HASCILL — n={n}, rounds={key.rounds}"))
+        trace(TraceEvent("rule", value="-"))
+        _trace_key(trace, key, inverse=False)
+        trace(TraceEvent("plaintext", "[5] Plaintext ASCII", v_ascii))
+        trace(TraceEvent("padded", "[5] + PKCS#7", v_pad))
+        trace(TraceEvent("blocks", f"[5] Bloques n={n} ({len(v_blocks)})", v_blocks))
+        trace(TraceEvent("rule", value="-"))
+
+    prev = list(key.IV)
     ciphertext_blocks: List[List[int]] = []
     for i, blk in enumerate(v_blocks):
-        print(f"[BLOQUE {i}]")
-        t0 = compute_tweak(i, n, m, key_sum, r=None)
-        print_vec("  tweak t0", t0)
-        print_vec("  prev    ", prev)
-        print_vec("  v_i     ", blk)
-
-        # Pre-whitening
-        x = [(blk[j] + prev[j] + t0[j]) % m for j in range(n)]
-        print_vec("  A0) x = v+prev+t0", x)
-
-        # Rondas r=1..R
-        for r in range(1, rounds+1):
-            tr = t0 if rounds == 1 else compute_tweak(i, n, m, key_sum, r=r)
-            x = [sbox(xx, m) for xx in x]                      # B_r
-            print_vec(f"  B{r}) S(x)", x)
-            x = mat_vec_mul(Ms[r-1], x, m)                     # C_r
-            print_vec(f"  C{r}) M_{r}·x", x)
-            x = [(x[j] + bs[r-1][j] + tr[j]) % m for j in range(n)]  # D_r
-            print_vec(f"  D{r}) x = x+b_{r}+t_{r}", x)
-
-        c = x
-        print_vec("  OUT) c", c)
-        hrule(".")
-        ciphertext_blocks.append(c)
-        prev = c[:]
-
-    cli_str = format_blocks_for_cli(ciphertext_blocks)
-    b64_str = blocks_to_b64(ciphertext_blocks)
-    print("[OUT] Cipher por bloques:", ciphertext_blocks)
-    print(f'[OUT] Cipher (CLI):   {cli_str}')
-    print(f'[OUT] Cipher (B64):   {b64_str}')
-    print("      Descifrar con los mismos --n y --rounds.")
-    hrule()
+        prev = encrypt_block(key, i, blk, prev, trace)
+        ciphertext_blocks.append(prev)
+
+    if trace is not None:
+        trace(TraceEvent("cipher", "[OUT] Cipher por bloques", ciphertext_blocks))
+        trace(TraceEvent("cipher_cli", "[OUT] Cipher (CLI)", format_blocks_for_cli(ciphertext_blocks)))
+        trace(TraceEvent("cipher_b64", "[OUT] Cipher (B64)", blocks_to_b64(ciphertext_blocks)))
+        trace(TraceEvent("note", "      Descifrar con los mismos --n y --rounds."))
+        trace(TraceEvent("rule", value="="))
     return ciphertext_blocks
 
-def decrypt_verbose(password: str, ciphertext_blocks: List[List[int]], n: int = 4, rounds: int = 10) -> str:
-    hrule()
-    print(f"DESCIFRADO HASCILL — n={n}, rounds={rounds}")
-    hrule("-")
-
-    P, m, key_sum, Ms, bs, IV = derive_all_from_password(password, n, rounds)
-    Minvs = [mat_inverse_mod(Mr, m) for Mr in Ms]
-
-    print(f"[1] Contraseña: {password!r} → ASCII: {ascii_list(password)}")
-    print(f"[2] Primo m derivado: {m}")
-    for r, (Mr, Mrinv) in enumerate(zip(Ms, Minvs), 1):
-        print_mat(f"[3] M_{r}", Mr)
-        print_mat(f"[3] M_{r}^(-1)", Mrinv)
-        print_vec(f"[3] b_{r}", bs[r-1])
-    print_vec("[3] IV", IV)
-    print(f"[4] key_sum = {key_sum}")
-    hrule("-")
-
-    prev = IV[:]
+def decrypt(password: Union[str, HascillKey], ciphertext_blocks: List[List[int]], n: int = 4,
+            rounds: int = 10, trace: Optional[TraceSink] = None) -> str:
+    """Descifra bloques y quita PKCS#7. Sin `trace` es el camino rápido."""
+    key = get_key(password, n, rounds)
+    if trace is not None:
+        trace(TraceEvent("rule", value="="))
+        trace(TraceEvent("title", f"DESCIFRADO HASCILL — n={key.n}, rounds={key.rounds}"))
+        trace(TraceEvent("rule", value="-"))
+        _trace_key(trace, key, inverse=True)
+
+    prev = list(key.IV)
     recovered: List[int] = []
     for i, c in enumerate(ciphertext_blocks):
-        print(f"[BLOQUE {i} — inverso]")
-        t0 = compute_tweak(i, n, m, key_sum, r=None)
-        print_vec("  tweak t0", t0)
-        print_vec("  prev    ", prev)
-        print_vec("  c_i     ", c)
-
-        x = c[:]
-        # Rondas inversas R..1
-        for r in range(rounds, 0, -1):
-            tr = t0 if rounds == 1 else compute_tweak(i, n, m, key_sum, r=r)
-            x = [(x[j] - bs[r-1][j] - tr[j]) % m for j in range(n)]   # D_r^{-1}
-            print_vec(f"  D{r}⁻¹) x = x - b_{r} - t_{r}", x)
-            x = mat_vec_mul(Minvs[r-1], x, m)                         # C_r^{-1}
-            print_vec(f"  C{r}⁻¹) x = M_{r}^(-1)·x", x)
-            x = [sbox_inv(xx, m) for xx in x]                         # B_r^{-1}
-            print_vec(f"  B{r}⁻¹) x = S^{-1}(x)", x)
-
-        # Deshacer pre-whitening
-        v = [(x[j] - prev[j] - t0[j]) % m for j in range(n)]
-        print_vec("  A0⁻¹) v = x - prev - t0", v)
-        hrule(".")
-        recovered.extend(v)
-        prev = c[:]
+        recovered.extend(decrypt_block(key, i, c, prev, trace))
+        prev = list(c)
 
-    print_vec("[OUT] Con padding", recovered)
+    if trace is not None:
+        trace(TraceEvent("padded", "[OUT] Con padding", recovered))
     unpadded = pkcs7_unpad(recovered)
-    print_vec("[OUT] Sin padding", unpadded)
     text = list_to_ascii(unpadded)
-    print(f"[OUT] Texto plano: {text!r}")
-    hrule()
+    if trace is not None:
+        trace(TraceEvent("unpadded", "[OUT] Sin padding", unpadded))
+        trace(TraceEvent("plaintext", "[OUT] Texto plano", repr(text)))
+        trace(TraceEvent("rule", value="="))
     return text
 
+def encrypt_verbose(password: Union[str, HascillKey], plaintext: str, n: int = 4, rounds: int = 10) -> List[List[int]]:
+    """Cifrado con la traza paso a paso en consola."""
+    return encrypt(password, plaintext, n, rounds, trace=console_trace)
+
+def decrypt_verbose(password: Union[str, HascillKey], ciphertext_blocks: List[List[int]], n: int = 4, rounds: int = 10) -> str:
+    """Descifrado con la traza paso a paso en consola."""
+    return decrypt(password, ciphertext_blocks, n, rounds, trace=console_trace)
+
+# ========= Streaming (memoria constante) =========
+
+STREAM_CHUNK = 64 * 1024  # bytes por lectura
+
+def read_chunks(f: BinaryIO, size: int = STREAM_CHUNK) -> Iterator[bytes]:
+    while True:
+        chunk = f.read(size)
+        if not chunk:
+            return
+        yield chunk
+
+def encrypt_stream(password: Union[str, HascillKey], chunks: Iterable[bytes],
+                   n: int = 4, rounds: int = 10) -> Iterator[bytes]:
+    """Cifra un flujo de bytes trozo a trozo; produce el ciphertext (2 bytes/entero).
+
+    El prev de CBC y el índice de bloque pasan de un trozo al siguiente; el
+    PKCS#7 sólo se aplica al resto final.
+    """
+    key = get_key(password, n, rounds)
+    n = key.n
+    prev = list(key.IV)
+    i = 0
+    tail = b""
+    for chunk in chunks:
+        data = tail + chunk
+        cut = len(data) - len(data) % n
+        tail = data[cut:]
+        out = []
+        for k in range(0, cut, n):
+            prev = encrypt_block(key, i, data[k:k+n], prev)
+            out.append(prev)
+            i += 1
+        if out:
+            yield blocks_to_bytes(out)
+    final = pkcs7_pad(list(tail), n)
+    out = []
+    for k in range(0, len(final), n):
+        prev = encrypt_block(key, i, final[k:k+n], prev)
+        out.append(prev)
+        i += 1
+    yield blocks_to_bytes(out)
+
+def _plain_bytes(v: List[int]) -> bytes:
+    try:
+        return bytes(v)
+    except ValueError:
+        raise ValueError("Bloque descifrado fuera de rango (¿contraseña, n o rounds incorrectos?)")
+
+def decrypt_stream(password: Union[str, HascillKey], chunks: Iterable[bytes],
+                   n: int = 4, rounds: int = 10) -> Iterator[bytes]:
+    """Descifra un flujo de ciphertext (2 bytes/entero) trozo a trozo.
+
+    Retiene siempre el último bloque descifrado: sólo al llegar al final se
+    sabe que lleva el PKCS#7 y se le quita.
+    """
+    key = get_key(password, n, rounds)
+    n = key.n
+    width = 2 * n
+    prev = list(key.IV)
+    i = 0
+    tail = b""
+    pending: Optional[List[int]] = None
+    for chunk in chunks:
+        data = tail + chunk
+        cut = len(data) - len(data) % width
+        tail = data[cut:]
+        out = bytearray()
+        for c in bytes_to_blocks(data[:cut], n):
+            if pending is not None:
+                out += _plain_bytes(pending)
+            pending = decrypt_block(key, i, c, prev)
+            prev = c
+            i += 1
+        if out:
+            yield bytes(out)
+    if tail:
+        raise ValueError(f"Ciphertext truncado: sobran {len(tail)} bytes (bloque = {width} bytes).")
+    if pending is None:
+        raise ValueError("Ciphertext vacío.")
+    yield _plain_bytes(pkcs7_unpad(pending))
+
 # ========= CLI =========
 
 def parse_cipher_blocks(s: str) -> List[List[int]]:
@@ -366,6 +718,40 @@ def parse_cipher_blocks(s: str) -> List[List[int]]:
         blocks.append(nums)
     return blocks
 
+def run_stream(mode: str, password: str, in_path: str, out_path: str, n: int, rounds: int):
+    """--in/--out: '-' es stdin/stdout (binario). Sin trazas, memoria constante.
+
+    El ciphertext va en el contenedor versionado; si la salida es seekable se
+    reescribe la cabecera al final con el nº real de bloques.
+    """
+    fin = sys.stdin.buffer if in_path == "-" else open(in_path, "rb")
+    fout = sys.stdout.buffer if out_path == "-" else open(out_path, "wb")
+    try:
+        total = 0
+        if mode == "enc":
+            key = get_key(password, n, rounds)
+            hdr = ContainerHeader(key.n, key.rounds, key.m)
+            fout.write(hdr.pack())
+            for piece in encrypt_stream(key, read_chunks(fin)):
+                fout.write(piece)
+                total += len(piece)
+            if fout.seekable():
+                fout.seek(0)
+                fout.write(ContainerHeader(hdr.n, hdr.rounds, hdr.m, total // (2 * hdr.n)).pack())
+        else:
+            hdr = ContainerHeader.unpack(fin.read(CONTAINER_HDR.size))
+            key = get_key(password, hdr.n, hdr.rounds)
+            if key.m != hdr.m:
+                raise ValueError("La contraseña no corresponde a este contenedor (m distinto).")
+            for piece in decrypt_stream(key, read_chunks(fin)):
+                fout.write(piece)
+                total += len(piece)
+        fout.flush()
+    finally:
+        if fin is not sys.stdin.buffer: fin.close()
+        if fout is not sys.stdout.buffer: fout.close()
+    print(f"[OUT] {total} bytes escritos en {out_path!r}", file=sys.stderr)
+
 def main():
     ap = argparse.ArgumentParser(description="Demo HASCILL (cifrado/descifrado con trazas)")
     ap.add_argument("--mode", choices=["enc", "dec"], help="enc (cifrar) o dec (descifrar)")
@@ -373,28 +759,71 @@ def main():
     ap.add_argument("--message", help="Mensaje ASCII (para --mode enc)")
     ap.add_argument("--cipher", help="Ciphertext en bloques: \"a,b,c,d | ...\" (para --mode dec)")
     ap.add_argument("--cipher-b64", help="Ciphertext Base64 compacto (para --mode dec)")
+    ap.add_argument("--cipher-file", metavar="FILE", help="Ciphertext en contenedor binario (para --mode dec)")
     ap.add_argument("--n", type=int, default=4, help="Tamaño de bloque (default 4)")
     ap.add_argument("--rounds", type=int, default=10, help="Número de rondas (default 10)")
+    ap.add_argument("--in", dest="in_path", metavar="FILE", help="Entrada en streaming (archivo o '-' = stdin)")
+    ap.add_argument("--out", dest="out_path", metavar="FILE",
+                    help="Salida: del streaming (default '-' = stdout) o contenedor binario de --mode enc")
+    ap.add_argument("--quiet", action="store_true", help="Sin traza en consola: sólo el resultado")
+    ap.add_argument("--trace-ndjson", metavar="FILE",
+                    help="Exporta la traza como NDJSON (archivo o '-' = stdout; entonces el resultado va a stderr)")
     args = ap.parse_args()
 
+    if args.in_path:
+        if not (args.mode and args.password):
+            print("--in requiere --mode y --password.", file=sys.stderr); return
+        run_stream(args.mode, args.password, args.in_path, args.out_path or "-", n=args.n, rounds=args.rounds)
+        return
+
+    ndjson_f = None
+    result_f = sys.stdout
+    if args.trace_ndjson == "-":
+        # stdout queda sólo para el NDJSON: sin traza de consola y el resultado a stderr
+        ndjson_f, result_f = sys.stdout, sys.stderr
+        args.quiet = True
+    elif args.trace_ndjson:
+        ndjson_f = open(args.trace_ndjson, "w", encoding="utf-8")
+    trace = tee_trace(None if args.quiet else console_trace,
+                      NDJSONTrace(ndjson_f) if ndjson_f else None)
+    try:
+        run_cli(args, trace, result_f)
+    finally:
+        if ndjson_f is not None and ndjson_f is not sys.stdout:
+            ndjson_f.close()
+
+def run_cli(args, trace: Optional[TraceSink], out: TextIO = sys.stdout):
     if args.mode == "enc":
         if not (args.password and args.message):
             print("Faltan --password y --message para cifrar."); return
-        encrypt_verbose(args.password, args.message, n=args.n, rounds=args.rounds)
+        blocks = encrypt(args.password, args.message, n=args.n, rounds=args.rounds, trace=trace)
+        if args.quiet:
+            print(format_blocks_for_cli(blocks), file=out)
+            print(blocks_to_b64(blocks), file=out)
+        if args.out_path and args.out_path != "-":
+            key = get_key(args.password, args.n, args.rounds)
+            write_container(args.out_path, blocks, key.n, key.rounds, key.m)
+            print(f"[OUT] Contenedor binario: {args.out_path}", file=out)
 
     elif args.mode == "dec":
         if not args.password:
             print("Falta --password."); return
-        if args.cipher_b64:
+        if args.cipher_file:
+            hdr, vals = read_container(args.cipher_file)
+            args.n, args.rounds = hdr.n, hdr.rounds
+            blocks = container_blocks(hdr, vals)
+        elif args.cipher_b64:
             blocks = b64_to_blocks(args.cipher_b64, n=args.n)
         elif args.cipher:
             blocks = parse_cipher_blocks(args.cipher)
         else:
-            print("Debes pasar --cipher o --cipher-b64."); return
+            print("Debes pasar --cipher, --cipher-b64 o --cipher-file."); return
         for b in blocks:
             if len(b) != args.n:
                 raise ValueError(f"Cada bloque debe tener n={args.n} enteros. Recibido: {b}")
-        decrypt_verbose(args.password, blocks, n=args.n, rounds=args.rounds)
+        text = decrypt(args.password, blocks, n=args.n, rounds=args.rounds, trace=trace)
+        if args.quiet:
+            print(text, file=out)
 
     else:
         # Modo interactivo rápido
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# HASCILL — Crypto Race — Implementación de referencia (educativa)
+# Copyright (c) 2025 Sebastián Dario Pérez Pantoja
+# Autor: Sebastián Dario Pérez Pantoja — GitHub: https://github.com/sebastiandperez
+# Licencia: MIT (ver LICENSE) — SPDX-License-Identifier: MIT
+# Si reutilizas, conserva esta línea de atribución.
+#
+# Archivo: hascill_journal.py
+# Proyecto: HASCILL
+# Repo: https://github.com/sebastiandperez/HASCILL-Crypto-Race
+
+"""
+hascill_journal.py — Bitácora de eventos (append-only) + snapshots del estado de carrera.
+- Cada evento que cambia estado (join, leave, detach, resume, ready, start, answer,
+  skip, comandos admin, salas) es una línea JSON en events.log con su número de secuencia y la
+  "foto posterior" de lo que tocó: el registro de la sala y/o de los equipos.
+  Aplicar un evento es sobrescribir esos registros, así restaurar no depende de
+  re-ejecutar la lógica del server.
+- fsync por lotes: append() sólo escribe al buffer; una tarea hace flush + fsync
+  cada FSYNC_INTERVAL s en un thread (un crash pierde a lo sumo ese intervalo).
+- Cada SNAPSHOT_EVERY eventos se escribe snapshot.json (atómico: tmp + rename)
+  con el estado, su secuencia y el offset del log. Restaurar = snapshot + cola del
+  log desde ese offset: tiempo acotado aunque el log crezca.
+- El mismo log alimenta el replay offline, que además re-valida cada respuesta
+  con game_core:
+
+    python3 hascill_journal.py replay DIR_O_LOG
+"""
+
+import asyncio, json, os, sys, time
+from typing import Any, Dict, List, Optional, Tuple
+
+from game_core import ChallengeCursor, build_challenge, cursor_validate
+
+FSYNC_INTERVAL = 0.1   # s entre fsync del log
+SNAPSHOT_EVERY = 500   # eventos entre snapshots (cota de la cola a re-aplicar)
+LOG_NAME, SNAP_NAME = "events.log", "snapshot.json"
+
+# ========= modelo de estado (lo que se persiste) =========
+# {"seq": int, "next_cid": int,
+#  "rooms": {room_id: {"room": {password, message, rotate, start_flag, start_time,
+#                               paused, game_over, winner},
+#                      "teams": {"<tid>": {game, pos, errors, started_at, win_time,
+#                                          order, ready, members, sessions, detached}}}}}
+def empty_state() -> Dict[str, Any]:
+    return {"seq": 0, "next_cid": 0, "rooms": {}}
+
+def apply_event(state: Dict[str, Any], ev: Dict[str, Any]):
+    """Aplica un evento al modelo: sólo sobrescribe los registros que trae."""
+    state["seq"] = ev.get("seq", state["seq"])
+    if "cid" in ev:
+        state["next_cid"] = max(state["next_cid"], ev["cid"] or 0)
+    rid = ev.get("room")
+    if rid is None:
+        return
+    if ev["ev"] == "room_close":
+        state["rooms"].pop(rid, None)
+        return
+    room = state["rooms"].setdefault(rid, {"room": {}, "teams": {}})
+    if "room_state" in ev:
+        room["room"] = ev["room_state"]
+    for tid, rec in ev.get("teams", {}).items():
+        room["teams"][str(tid)] = rec
+
+def _dump(obj: Dict[str, Any]) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def read_events(path: str, offset: int = 0) -> Tuple[List[Dict[str, Any]], int]:
+    """Eventos desde offset y el offset del final de la última línea completa y válida."""
+    events, good = [], offset
+    if not os.path.exists(path):
+        return events, good
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break            # línea cortada por un crash a mitad de write
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                break
+            good += len(line)
+    return events, good
+
+def _fsync_dir(path: str):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+# ========= bitácora =========
+class Journal:
+    """Log de eventos + snapshots en un directorio; mantiene el estado espejo en memoria."""
+    def __init__(self, dirpath: str, fsync_interval: float = FSYNC_INTERVAL,
+                 snapshot_every: int = SNAPSHOT_EVERY):
+        os.makedirs(dirpath, exist_ok=True)
+        self.dir = dirpath
+        self.log_path = os.path.join(dirpath, LOG_NAME)
+        self.snap_path = os.path.join(dirpath, SNAP_NAME)
+        self.fsync_interval = fsync_interval
+        self.snapshot_every = snapshot_every
+        self.state, self.tail = self._load()
+        self.restored = bool(self.state["rooms"])
+        self.f = open(self.log_path, "ab")
+        self.since_snap = self.tail
+        self.appended = self.fsyncs = self.snapshots = 0
+        self._dirty = False
+        self._task: Optional[asyncio.Task] = None
+        self._snap_task: Optional[asyncio.Task] = None
+
+    def _load(self) -> Tuple[Dict[str, Any], int]:
+        state, offset = empty_state(), 0
+        if os.path.exists(self.snap_path):
+            with open(self.snap_path, "rb") as f:
+                snap = json.load(f)
+            state, offset = snap["state"], snap["offset"]
+        events, good = read_events(self.log_path, offset)
+        for ev in events:
+            apply_event(state, ev)
+        if os.path.exists(self.log_path) and os.path.getsize(self.log_path) > good:
+            with open(self.log_path, "r+b") as f:   # descarta la línea incompleta del final
+                f.truncate(good)
+        return state, len(events)
+
+    @property
+    def seq(self) -> int:
+        return self.state["seq"]
+
+    def append(self, ev: Dict[str, Any]):
+        if self.f.closed:
+            return               # cerrado en shutdown
+        ev["seq"] = self.state["seq"] + 1
+        ev["t"] = round(time.time(), 3)
+        self.f.write(_dump(ev) + b"\n")
+        apply_event(self.state, ev)
+        self.appended += 1
+        self.since_snap += 1
+        self._dirty = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return               # fuera del loop: se sincroniza en close()
+        if self._task is None:
+            self._task = loop.create_task(self._flusher())
+        if self.since_snap >= self.snapshot_every and (self._snap_task is None or self._snap_task.done()):
+            self._snap_task = loop.create_task(self.snapshot())
+
+    async def _flusher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.fsync_interval)
+            if self._dirty:
+                self._dirty = False
+                self.f.flush()
+                await loop.run_in_executor(None, os.fsync, self.f.fileno())
+                self.fsyncs += 1
+
+    async def snapshot(self):
+        """Foto del estado + offset del log; escritura atómica fuera del loop."""
+        self.f.flush()
+        data = _dump({"seq": self.seq, "offset": self.f.tell(), "state": self.state})
+        self.since_snap = 0
+        await asyncio.get_running_loop().run_in_executor(None, self._write_snapshot, data)
+        self.snapshots += 1
+
+    def _write_snapshot(self, data: bytes):
+        os.fsync(self.f.fileno())     # el log hasta offset debe estar en disco antes que el snapshot
+        tmp = self.snap_path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.snap_path)
+        _fsync_dir(self.dir)
+
+    async def close(self):
+        if self.f.closed:
+            return
+        if self._task is not None:
+            self._task.cancel()
+        if self._snap_task is not None and not self._snap_task.done():
+            await self._snap_task
+        await self.snapshot()
+        self.f.close()
+
+    def stats(self) -> Dict[str, int]:
+        return {"seq": self.seq, "appended": self.appended, "fsyncs": self.fsyncs,
+                "snapshots": self.snapshots, "since_snapshot": self.since_snap}
+
+# ========= replay offline =========
+def replay(path: str, out=sys.stdout, verbose: bool = True) -> Dict[str, Any]:
+    """Reproduce el log desde cero: línea de tiempo, re-validación de respuestas y estado final."""
+    log = os.path.join(path, LOG_NAME) if os.path.isdir(path) else path
+    events, _ = read_events(log)
+    state = empty_state()
+    challenges: Dict[Tuple[str, str], Any] = {}
+    mismatches = 0
+    t0 = events[0]["t"] if events else 0.0
+    for ev in events:
+        kind, rid = ev["ev"], ev.get("room")
+        if kind == "answer":
+            room = state["rooms"][rid]
+            rs, team = room["room"], room["teams"].get(str(ev["team"]), {})
+            key = (rs["password"], rs["message"])
+            ch = challenges.get(key) or challenges.setdefault(key, build_challenge(*key))
+            cur = ChallengeCursor(ch, pos=team.get("pos", 0), errors=team.get("errors", 0))
+            vec = ev.get("vec")
+            ok = (isinstance(vec, list) and len(vec) == (4 if ev.get("phase") in ("TPW", "TMSG") else ch.n)
+                  and cursor_validate(cur, ev.get("phase"), vec)[0])
+            if ok != ev["ok"]:
+                mismatches += 1
+                print(f"!! seq {ev['seq']}: el log dice ok={ev['ok']} y la re-validación ok={ok}", file=out)
+        apply_event(state, ev)
+        if verbose:
+            detail = {k: v for k, v in ev.items() if k not in ("seq", "t", "ev", "room", "room_state", "teams")}
+            print(f"{ev['t'] - t0:9.3f}s #{ev['seq']:<6} {rid or '-':<10} {kind:<12} {detail}", file=out)
+
+    for rid, room in state["rooms"].items():
+        rs = room["room"]
+        print(f"\n[{rid}] password={rs.get('password')!r} message={rs.get('message')!r} "
+              f"started={rs.get('start_flag')} game_over={rs.get('game_over')} winner={rs.get('winner')}", file=out)
+        for tid, t in sorted(room["teams"].items(), key=lambda kv: int(kv[0])):
+            print(f"  team {tid}: paso={t['pos']} errores={t['errors']} turnos={t['order']} "
+                  f"win_time={t['win_time']}", file=out)
+    print(f"\n{len(events)} eventos, {mismatches} divergencias", file=out)
+    return state
+
+def main():
+    if len(sys.argv) != 3 or sys.argv[1] != "replay":
+        print("Uso: python3 hascill_journal.py replay DIR_O_LOG")
+        sys.exit(2)
+    replay(sys.argv[2])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# HASCILL — Crypto Race — Implementación de referencia (educativa)
+# Copyright (c) 2025 Sebastián Dario Pérez Pantoja
+# Autor: Sebastián Dario Pérez Pantoja — GitHub: https://github.com/sebastiandperez
+# Licencia: MIT (ver LICENSE) — SPDX-License-Identifier: MIT
+# Si reutilizas, conserva esta línea de atribución.
+#
+# Archivo: hascill_metrics.py
+# Proyecto: HASCILL
+# Repo: https://github.com/sebastiandperez/HASCILL-Crypto-Race
+
+"""
+hascill_metrics.py — Métricas del server en formato de texto de Prometheus.
+- Histogram: buckets fijos elegidos al crearlo. observe() es un bisect más dos
+  sumas sobre una lista de enteros; no hay locks porque todo corre en el event
+  loop de un proceso (en --workers cada worker tiene las suyas).
+- Los acumulados por bucket se calculan recién al exportar (scrape), no al observar.
+- Lo que el server ya cuenta (colas, conexiones, rate-limit) no se duplica: se
+  lee en el momento del scrape con un callback que devuelve líneas de texto.
+- Servidor HTTP mínimo sólo en 127.0.0.1: GET /metrics.
+
+    curl -s http://127.0.0.1:9150/metrics
+"""
+
+import asyncio, logging
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+METRICS_HOST = "127.0.0.1"
+# segundos: de 5 µs (validar una fase) a 100 ms (un broadcast a cientos de conexiones)
+LATENCY_BUCKETS = (5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 0.1)
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+LAG_INTERVAL = 0.5   # s entre muestras del lag del event loop
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _fmt(v: float) -> str:
+    return repr(float(v)) if v != int(v) else str(int(v))
+
+def _labels(pairs: Iterable[Tuple[str, Any]]) -> str:
+    body = ",".join(f'{k}="{str(v)}"' for k, v in pairs)
+    return "{" + body + "}" if body else ""
+
+class _Series:
+    __slots__ = ("counts", "sum")
+
+    def __init__(self, n: int):
+        self.counts = [0] * (n + 1)   # el último es +Inf
+        self.sum = 0.0
+
+class Histogram:
+    """Histograma de buckets fijos, opcionalmente con una etiqueta (p. ej. la fase)."""
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+                 label: Optional[str] = None):
+        self.name = name
+        self.help = help
+        self.bounds = tuple(sorted(buckets))
+        self.label = label
+        self.series: Dict[Any, _Series] = {}
+
+    def observe(self, value: float, key: Any = None):
+        s = self.series.get(key)
+        if s is None:
+            s = self.series[key] = _Series(len(self.bounds))
+        s.counts[bisect_left(self.bounds, value)] += 1
+        s.sum += value
+
+    def count(self, key: Any = None) -> int:
+        s = self.series.get(key)
+        return sum(s.counts) if s else 0
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, s in sorted(self.series.items(), key=lambda kv: str(kv[0])):
+            base = [(self.label, key)] if self.label else []
+            acc = 0
+            for b, c in zip(self.bounds + (float("inf"),), s.counts):
+                acc += c
+                le = "+Inf" if b == float("inf") else _fmt(b)
+                out.append(f"{self.name}_bucket{_labels(base + [('le', le)])} {acc}")
+            out.append(f"{self.name}_sum{_labels(base)} {_fmt(s.sum)}")
+            out.append(f"{self.name}_count{_labels(base)} {acc}")
+        return out
+
+def metric(name: str, help: str, samples, kind: str = "gauge") -> List[str]:
+    """Líneas de un gauge/counter. samples: un número o [(dict de etiquetas, valor), ...]."""
+    out = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    if isinstance(samples, (int, float)):
+        samples = [({}, samples)]
+    for labels, v in samples:
+        out.append(f"{name}{_labels(labels.items())} {_fmt(v)}")
+    return out
+
+def render(histograms: Iterable[Histogram], collect: Optional[Callable[[], List[str]]] = None) -> str:
+    lines: List[str] = []
+    for h in histograms:
+        lines += h.render()
+    if collect is not None:
+        lines += collect()
+    return "\n".join(lines) + "\n"
+
+async def sample_loop_lag(hist: Histogram, interval: float = LAG_INTERVAL):
+    """Cuánto tarde despierta un sleep(interval): mide callbacks que bloquean el loop."""
+    loop = asyncio.get_running_loop()
+    while True:
+        t0 = loop.time()
+        await asyncio.sleep(interval)
+        hist.observe(max(0.0, loop.time() - t0 - interval))
+
+async def start_metrics_server(page: Callable[[], str], port: int, host: str = METRICS_HOST):
+    """Listener HTTP/1.0 mínimo: GET /metrics devuelve page(); cualquier otra ruta, 404."""
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            req = await asyncio.wait_for(reader.readline(), 5.0)
+            while (await asyncio.wait_for(reader.readline(), 5.0)) not in (b"\r\n", b"\n", b""):
+                pass   # cabeceras: no se usan
+            parts = req.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", page().encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"usa GET /metrics\n"
+            writer.write(f"HTTP/1.0 {status}\r\nContent-Type: {CONTENT_TYPE}\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError, ValueError) as e:   # ValueError: línea > límite del reader
+            logging.debug(f"Métricas: petición descartada: {e}")
+        finally:
+            writer.close()
+    return await asyncio.start_server(handle, host, port)
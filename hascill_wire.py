@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# HASCILL — Crypto Race — Implementación de referencia (educativa)
+# Copyright (c) 2025 Sebastián Dario Pérez Pantoja
+# Autor: Sebastián Dario Pérez Pantoja — GitHub: https://github.com/sebastiandperez
+# Licencia: MIT (ver LICENSE) — SPDX-License-Identifier: MIT
+# Si reutilizas, conserva esta línea de atribución.
+#
+# Archivo: hascill_wire.py
+# Proyecto: HASCILL
+# Repo: https://github.com/sebastiandperez/HASCILL-Crypto-Race
+
+"""
+hascill_wire.py — Codec del protocolo (v1 JSON y v2 binario compacto).
+- Todo frame es [u32 BE largo][cuerpo], con el mismo límite de 1.000.000 bytes.
+- v1: el cuerpo es JSON UTF-8, que siempre empieza por '{' (0x7B).
+- v2: el cuerpo empieza por un byte de tipo < 0x7B y sigue un layout fijo:
+  enteros como varint (zigzag, admiten negativos), vectores como
+  [varint largo][varints], textos como [varint largo][UTF-8].
+- Sólo los mensajes calientes tienen layout binario: step, step_delta,
+  step_answer, turn, ok, error y ping. El resto (joined, scoreboard, team_status, ...) viaja como
+  JSON también en v2, así un decodificador único entiende cualquier frame.
+- La versión se negocia en el join: {"type":"join",...,"proto":2}; el server
+  responde "joined" con el proto aceptado. Sin "proto", la conexión es v1.
+"""
+
+import json, struct
+from typing import Any, Dict, List, Optional, Tuple
+
+PROTO_JSON = 1
+PROTO_BIN = 2
+MAX_FRAME = 1_000_000
+
+T_PING, T_TURN, T_STEP, T_ANSWER, T_OK, T_ERROR, T_DELTA = 1, 2, 3, 4, 5, 6, 7
+
+PHASES = ("TPW", "TMSG", "A", "B", "C", "D")
+_PHASE_CODE = {p: k for k, p in enumerate(PHASES)}
+# op y output_name quedan implícitos por la fase (mismos textos que game_core)
+STEP_OPS = {
+    "TPW":  ("translate_password_to_ascii", "ascii"),
+    "TMSG": ("translate_plaintext_to_ascii", "ascii"),
+    "A":    ("u = (v + prev + t) mod m", "u"),
+    "B":    ("u_prime = S(u)", "u_prime"),
+    "C":    ("w = M * u_prime mod m", "w"),
+    "D":    ("c = (w + b + t) mod m", "c"),
+}
+SBOX_TEXT = "x^3 mod m"
+_F64 = struct.Struct(">d")
+
+# ========= primitivas =========
+def put_varint(out: bytearray, x: int):
+    """Entero con signo como varint zigzag (LEB128)."""
+    z = x << 1 if x >= 0 else ((-x) << 1) - 1
+    if z >> 64:
+        raise ValueError("entero fuera de rango para varint")
+    while z >= 0x80:
+        out.append((z & 0x7F) | 0x80)
+        z >>= 7
+    out.append(z)
+
+def get_varint(buf, pos: int) -> Tuple[int, int]:
+    z = shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        z |= (b & 0x7F) << shift
+        if b < 0x80:
+            break
+        shift += 7
+        if shift > 63:
+            raise ValueError("varint demasiado largo")
+    return (z >> 1) ^ -(z & 1), pos
+
+def put_vec(out: bytearray, v: List[int]):
+    put_varint(out, len(v))
+    for x in v:
+        put_varint(out, x)
+
+def get_vec(buf, pos: int) -> Tuple[List[int], int]:
+    n, pos = get_varint(buf, pos)
+    if n < 0 or n > len(buf) - pos:
+        raise ValueError("vector con largo inválido")
+    v = []
+    for _ in range(n):
+        x, pos = get_varint(buf, pos)
+        v.append(x)
+    return v, pos
+
+def put_str(out: bytearray, s: str):
+    b = s.encode("utf-8")
+    put_varint(out, len(b))
+    out += b
+
+def get_str(buf, pos: int) -> Tuple[str, int]:
+    n, pos = get_varint(buf, pos)
+    if n < 0 or pos + n > len(buf):
+        raise ValueError("texto con largo inválido")
+    return str(buf[pos:pos+n], "utf-8"), pos + n
+
+def put_opt_id(out: bytearray, cid: Optional[int]):
+    put_varint(out, -1 if cid is None else cid)
+
+def get_opt_id(buf, pos: int) -> Tuple[Optional[int], int]:
+    x, pos = get_varint(buf, pos)
+    return (None if x == -1 else x), pos
+
+# ========= step =========
+def step_head(obj: Dict[str, Any]) -> bytes:
+    """Cuerpo binario de un step sin turn_cid/you_turn (van al final, ver step_tail)."""
+    phase = obj["phase"]
+    inp = obj["inputs"]
+    out = bytearray([T_STEP, _PHASE_CODE[phase]])
+    put_varint(out, obj["block"])
+    if phase == "TPW":
+        put_str(out, inp["password_hint"]); put_varint(out, inp["len"])
+    elif phase == "TMSG":
+        put_str(out, inp["message_hint"]); put_varint(out, inp["len"])
+    else:
+        put_varint(out, inp["m"])
+        if phase == "A":
+            put_vec(out, inp["v"]); put_vec(out, inp["prev"]); put_vec(out, inp["t"])
+        elif phase == "B":
+            put_vec(out, inp["u"])
+        elif phase == "C":
+            put_varint(out, len(inp["M"]))
+            for row in inp["M"]:
+                put_vec(out, row)
+            put_vec(out, inp["u_prime"])
+        else:
+            put_vec(out, inp["w"]); put_vec(out, inp["b"]); put_vec(out, inp["t"])
+    return bytes(out)
+
+def delta_head(obj: Dict[str, Any]) -> bytes:
+    """Cuerpo binario de un step_delta sin la cola de turno: fase, bloque y vector."""
+    out = bytearray([T_DELTA, _PHASE_CODE[obj["phase"]]])
+    put_varint(out, obj["block"])
+    put_vec(out, obj["vec"])
+    return bytes(out)
+
+def step_tail(turn_cid: Optional[int], you_turn: bool) -> bytes:
+    out = bytearray()
+    put_opt_id(out, turn_cid)
+    out.append(1 if you_turn else 0)
+    return bytes(out)
+
+def _get_step(buf, pos: int) -> Dict[str, Any]:
+    phase = PHASES[buf[pos]]
+    block, pos = get_varint(buf, pos + 1)
+    if phase in ("TPW", "TMSG"):
+        hint, pos = get_str(buf, pos)
+        ln, pos = get_varint(buf, pos)
+        inputs = {"password_hint" if phase == "TPW" else "message_hint": hint, "len": ln}
+    else:
+        m, pos = get_varint(buf, pos)
+        if phase == "A":
+            v, pos = get_vec(buf, pos); prev, pos = get_vec(buf, pos); t, pos = get_vec(buf, pos)
+            inputs = {"v": v, "prev": prev, "t": t, "m": m}
+        elif phase == "B":
+            u, pos = get_vec(buf, pos)
+            inputs = {"u": u, "m": m, "sbox": SBOX_TEXT}
+        elif phase == "C":
+            rows, pos = get_varint(buf, pos)
+            M = []
+            for _ in range(rows):
+                row, pos = get_vec(buf, pos)
+                M.append(row)
+            up, pos = get_vec(buf, pos)
+            inputs = {"M": M, "u_prime": up, "m": m}
+        else:
+            w, pos = get_vec(buf, pos); b, pos = get_vec(buf, pos); t, pos = get_vec(buf, pos)
+            inputs = {"w": w, "b": b, "t": t, "m": m}
+    turn_cid, pos = get_opt_id(buf, pos)
+    op, output_name = STEP_OPS[phase]
+    return {"type": "step", "block": block, "phase": phase, "inputs": inputs,
+            "op": op, "output_name": output_name, "turn_cid": turn_cid, "you_turn": bool(buf[pos])}
+
+# ========= codec =========
+def encode_body_bin(obj: Dict[str, Any]) -> Optional[bytes]:
+    """Cuerpo v2 del mensaje, o None si su tipo no tiene layout binario."""
+    t = obj.get("type")
+    try:
+        if t == "step":
+            return step_head(obj) + step_tail(obj.get("turn_cid"), obj.get("you_turn", False))
+        if t == "step_delta":
+            return delta_head(obj) + step_tail(obj.get("turn_cid"), obj.get("you_turn", False))
+        out = bytearray()
+        if t == "step_answer":
+            out.append(T_ANSWER)
+            out.append(_PHASE_CODE[obj["phase"]])
+            put_varint(out, obj["block"])
+            put_vec(out, obj["vector"])
+        elif t == "turn":
+            out.append(T_TURN)
+            put_opt_id(out, obj.get("current"))
+            out.append(1 if obj.get("you_turn") else 0)
+            put_vec(out, obj.get("order", []))
+        elif t == "ok":
+            out.append(T_OK)
+            put_str(out, obj["for"])
+        elif t == "error":
+            out.append(T_ERROR)
+            put_str(out, obj["msg"])
+        elif t == "ping":
+            out.append(T_PING)
+            out += _F64.pack(obj["ts"])
+            put_varint(out, obj.get("proto", PROTO_BIN))
+        else:
+            return None
+        return bytes(out)
+    except (KeyError, TypeError, ValueError):
+        return None   # forma inesperada: que viaje como JSON
+
+def encode_body(obj: Dict[str, Any], proto: int = PROTO_JSON) -> bytes:
+    if proto >= PROTO_BIN:
+        body = encode_body_bin(obj)
+        if body is not None:
+            return body
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+def encode(obj: Dict[str, Any], proto: int = PROTO_JSON) -> bytes:
+    """Frame completo (con cabecera de largo) en la versión pedida."""
+    body = encode_body(obj, proto)
+    return struct.pack(">I", len(body)) + body
+
+def frame(body: bytes) -> bytes:
+    return struct.pack(">I", len(body)) + body
+
+def decode_body(buf) -> Dict[str, Any]:
+    """Decodifica un cuerpo v1 o v2 (bytes o memoryview). ValueError si está mal formado."""
+    if not len(buf):
+        raise ValueError("frame vacío")
+    tag = buf[0]
+    if tag == 0x7B:
+        return json.loads(str(buf, "utf-8"))
+    try:
+        if tag == T_STEP:
+            return _get_step(buf, 1)
+        if tag == T_DELTA:
+            phase = PHASES[buf[1]]
+            block, pos = get_varint(buf, 2)
+            vec, pos = get_vec(buf, pos)
+            turn_cid, pos = get_opt_id(buf, pos)
+            return {"type": "step_delta", "block": block, "phase": phase, "vec": vec,
+                    "turn_cid": turn_cid, "you_turn": bool(buf[pos])}
+        if tag == T_ANSWER:
+            phase = PHASES[buf[1]]
+            block, pos = get_varint(buf, 2)
+            vec, pos = get_vec(buf, pos)
+            return {"type": "step_answer", "phase": phase, "block": block, "vector": vec}
+        if tag == T_TURN:
+            cur, pos = get_opt_id(buf, 1)
+            you = bool(buf[pos])
+            order, pos = get_vec(buf, pos + 1)
+            return {"type": "turn", "current": cur, "you_turn": you, "order": order}
+        if tag == T_OK:
+            return {"type": "ok", "for": get_str(buf, 1)[0]}
+        if tag == T_ERROR:
+            return {"type": "error", "msg": get_str(buf, 1)[0]}
+        if tag == T_PING:
+            (ts,) = _F64.unpack_from(buf, 1)
+            return {"type": "ping", "ts": ts, "proto": get_varint(buf, 9)[0]}
+    except (IndexError, struct.error) as e:
+        raise ValueError(f"frame binario truncado: {e}")
+    raise ValueError(f"tipo de frame desconocido: {tag}")
+
+async def read_frame(reader) -> Optional[Dict[str, Any]]:
+    """Lee y decodifica un frame de un asyncio.StreamReader (clientes y bots)."""
+    try:
+        hdr = await reader.readexactly(4)
+        (ln,) = struct.unpack(">I", hdr)
+        if ln <= 0 or ln > MAX_FRAME:
+            return None
+        return decode_body(await reader.readexactly(ln))
+    except Exception:
+        return None
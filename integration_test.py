@@ -10,31 +10,25 @@
 # Proyecto: HASCILL
 # Repo: https://github.com/sebastiandperez/HASCILL-Crypto-Race
 
-import asyncio, json, struct, socket, random, time
+import asyncio, socket, random, time
+from collections import deque
 from typing import Optional, Tuple, List
 
-from hascill_async_server import run_server
+from game_core import build_challenge, step_from_delta
+from hascill_async_server import N, THROTTLE_MSG, run_server
+from hascill_wire import PROTO_JSON, encode, read_frame
 
 PASSWORD = "PAZ9"
 MESSAGE  = "Hils"
 ROTATE   = "phase"   # o "block"
 
 # ===== framing helpers =====
-async def send_json(w: asyncio.StreamWriter, obj: dict):
-    data = json.dumps(obj, ensure_ascii=False).encode("utf-8")
-    w.write(struct.pack(">I", len(data)) + data)
+async def send_json(w: asyncio.StreamWriter, obj: dict, proto: int = PROTO_JSON):
+    w.write(encode(obj, proto))
     await w.drain()
 
 async def recv_json(r: asyncio.StreamReader):
-    try:
-        hdr = await r.readexactly(4)
-        ln = struct.unpack(">I", hdr)[0]
-        data = await r.readexactly(ln)
-        return json.loads(data.decode("utf-8"))
-    except asyncio.IncompleteReadError:
-        return None
-    except Exception:
-        return None
+    return await read_frame(r)   # JSON (v1) o binario (v2)
 
 def pick_free_port() -> int:
     s = socket.socket()
@@ -44,26 +38,37 @@ def pick_free_port() -> int:
     return port
 
 # ======= Bot correcto =======
-async def perfect_bot(host: str, port: int, team: int, bot_name: str, done_evt: asyncio.Event):
+async def perfect_bot(host: str, port: int, team: int, bot_name: str, done_evt: asyncio.Event,
+                      proto: int = PROTO_JSON, delta: bool = False, drop_after: int = 0,
+                      report: Optional[dict] = None):
     """
     Bot que:
     - se une al equipo
     - envía READY
     - ante cada 'step' calcula la respuesta correcta a partir de inputs
     - termina cuando recibe game_over o scoreboard
+    - drop_after > 0: tras esa cantidad de respuestas corta la conexión de golpe y
+      reconecta con su token de sesión (debe volver con el mismo id)
+    - report: dict donde anota lo que vio ("resume", "wrong_id", "last_step", "winner", "finished")
     """
+    if report is None:
+        report = {}
+    join = {"type":"join","team":team,"proto":proto,"delta":delta}
     reader, writer = await asyncio.open_connection(host, port)
 
     # hello
     await recv_json(reader)
     # join
-    await send_json(writer, {"type":"join","team":team})
+    await send_json(writer, join)
 
     # joined + team_status + ready task
     # Esperamos hasta que nos pidan READY
+    session = my_id = None
     while True:
         m = await recv_json(reader)
         if m is None: return
+        if m.get("type") == "joined":
+            session, my_id = m.get("session"), m.get("your_id")
         if m.get("type") == "task" and m.get("task") == "ready":
             break
 
@@ -72,6 +77,10 @@ async def perfect_bot(host: str, port: int, team: int, bot_name: str, done_evt:
 
     frozen = False
     you_turn = False
+    static = None   # parámetros del reto en modo delta
+    inbox = deque()   # mensajes de un frame "resume"
+    answers = 0
+    last = None       # última respuesta sin "ok" (se reintenta si el rate-limit la rechaza)
 
     # Utilidad para resolver el paso
     def solve_step(step: dict) -> Optional[List[int]]:
@@ -108,15 +117,29 @@ async def perfect_bot(host: str, port: int, team: int, bot_name: str, done_evt:
         return None
 
     while True:
-        m = await recv_json(reader)
+        m = inbox.popleft() if inbox else await recv_json(reader)
         if m is None:
             return
 
         t = m.get("type")
+        if t == "resume":
+            report["resume"] = True
+            inbox.extend(m["msgs"])
+            continue
+        if t == "joined" and m.get("resumed") and m.get("your_id") != my_id:
+            print(f"[{bot_name}] ERROR: la sesión volvió con id {m.get('your_id')} en vez de {my_id}")
+            report["wrong_id"] = m.get("your_id")
+        if t == "challenge":
+            static = m
+            continue
+        if t == "step_delta":
+            m = step_from_delta(static, m)
+            t = "step"
 
         if t == "step":
             if frozen:
                 continue
+            report["last_step"] = (m["block"], m["phase"])
             you_turn = m.get("you_turn", False)
             if not you_turn:
                 continue
@@ -124,15 +147,24 @@ async def perfect_bot(host: str, port: int, team: int, bot_name: str, done_evt:
             if vec is None:
                 # no debería pasar
                 continue
-            await send_json(writer, {"type":"step_answer","phase":m["phase"],"block":m["block"],"vector":vec})
+            last = {"type":"step_answer","phase":m["phase"],"block":m["block"],"vector":vec}
+            await send_json(writer, last, proto)
+            answers += 1
+            if drop_after and answers == drop_after and session:
+                writer.transport.abort()   # corte brusco, como un Wi-Fi que se cae
+                await asyncio.sleep(0.05)
+                reader, writer = await asyncio.open_connection(host, port)
+                await recv_json(reader)
+                await send_json(writer, dict(join, session=session))
 
         elif t == "ok":
-            # ignoramos
-            pass
+            last = None
 
         elif t == "error":
-            # en principio nunca debería llegar para un bot perfecto
-            pass
+            # sólo se reintenta lo que frenó el rate-limit; otro error es un bug del server
+            if m.get("msg") == THROTTLE_MSG["msg"] and last is not None and not frozen:
+                await asyncio.sleep(0.5)
+                await send_json(writer, last, proto)
 
         elif t == "game_over":
             frozen = True
@@ -140,6 +172,8 @@ async def perfect_bot(host: str, port: int, team: int, bot_name: str, done_evt:
             # (no hacemos return aún para asegurar que el scoreboard se capture)
         elif t == "scoreboard":
             # Marcamos done
+            report["winner"] = m.get("winner")
+            report["finished"] = True
             done_evt.set()
             return
         # else: team_status, turn, countdown, start, ping...
@@ -219,10 +253,94 @@ async def scenario_six_teams_three_bots_each():
             b.cancel()
         server_task.cancel()
 
+async def scenario_mixed_protocols():
+    """2 equipos donde conviven bots JSON (v1), binarios (v2) y en modo delta en el mismo equipo."""
+    host = "127.0.0.1"
+    port = pick_free_port()
+
+    server_task = asyncio.create_task(run_server(host, port, PASSWORD, MESSAGE, ROTATE))
+    await asyncio.sleep(0.5)
+
+    done_evt = asyncio.Event()
+    bots, kinds, reports = [], [], []
+    for team in (1,2):
+        for i in range(3):
+            proto, delta = 1 + (team + i) % 2, (i == 2)
+            kinds.append((team, f"v{proto}" + ("/delta" if delta else "")))
+            reports.append({})
+            bots.append(asyncio.create_task(
+                perfect_bot(host, port, team, f"t{team}b{i+1}", done_evt,
+                            proto=proto, delta=delta, report=reports[-1])
+            ))
+
+    try:
+        await asyncio.wait_for(asyncio.gather(*bots), timeout=15.0)   # todos hasta el scoreboard
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        for b in bots:
+            b.cancel()
+        server_task.cancel()
+
+    last = build_challenge(PASSWORD, MESSAGE, N).steps[-1]
+    winners = {r.get("winner") for r in reports}
+    fails = []
+    if len(winners) != 1 or None in winners:
+        fails.append(f"ganador inconsistente o ausente: {winners}")
+    for (team, kind), r in zip(kinds, reports):
+        if not r.get("finished"):
+            fails.append(f"equipo {team} {kind}: timeout esperando scoreboard")
+        if team in winners and r.get("last_step") != (last.block, last.phase):
+            fails.append(f"equipo {team} {kind}: último paso {r.get('last_step')}, no {(last.block, last.phase)}")
+    if fails:
+        raise AssertionError("[TEST] ERROR: equipos mixtos v1/v2/delta: " + "; ".join(fails))
+    print("[TEST] OK: equipos mixtos v1/v2/delta — los bots v1, v2 y delta del ganador llegaron al último paso.")
+
+
+async def scenario_reconnect():
+    """1 equipo × 3 bots; uno corta la conexión a mitad de carrera y retoma su sesión."""
+    host = "127.0.0.1"
+    port = pick_free_port()
+
+    server_task = asyncio.create_task(run_server(host, port, PASSWORD, MESSAGE, ROTATE))
+    await asyncio.sleep(0.5)
+
+    done_evt = asyncio.Event()
+    reports = [{} for _ in range(3)]
+    bots = [asyncio.create_task(perfect_bot(host, port, 1, f"b{i+1}", done_evt, drop_after=(1 if i == 1 else 0),
+                                            report=reports[i]))
+            for i in range(3)]
+
+    try:
+        await asyncio.wait_for(bots[1], timeout=15.0)   # el que cortó tiene que llegar al scoreboard
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        for b in bots:
+            b.cancel()
+        server_task.cancel()
+
+    r = reports[1]
+    fails = []
+    if not r.get("resume"):
+        fails.append("no llegó el frame resume")
+    if "wrong_id" in r:
+        fails.append(f"volvió con id {r['wrong_id']}")
+    if not r.get("finished"):
+        fails.append("el bot que cortó no terminó la carrera")
+    if fails:
+        raise AssertionError("[TEST] ERROR: reconexión con sesión: " + "; ".join(fails))
+    print("[TEST] OK: reconexión con sesión — el equipo terminó con su jugador de vuelta.")
+
 
 # ======= main =======
 if __name__ == "__main__":
     # asyncio.run(scenario_one_team_three_bots())
     # Descomenta para correr el escenario de 2 equipos:
     # asyncio.run(scenario_two_teams_three_bots_each())
-    asyncio.run(scenario_six_teams_three_bots_each())
+    async def default_suite():
+        # un solo loop: la consola admin de cada server queda leyendo stdin en un thread
+        await scenario_mixed_protocols()      # JSON (v1), binario (v2) y delta en el mismo equipo
+        await scenario_reconnect()            # reconexión con token de sesión
+        await scenario_six_teams_three_bots_each()
+    asyncio.run(default_suite())
@@ -0,0 +1,1014 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# HASCILL — Crypto Race — Implementación de referencia (educativa)
+# Copyright (c) 2025 Sebastián Dario Pérez Pantoja
+# Autor: Sebastián Dario Pérez Pantoja — GitHub: https://github.com/sebastiandperez
+# Licencia: MIT (ver LICENSE) — SPDX-License-Identifier: MIT
+# Si reutilizas, conserva esta línea de atribución.
+#
+# Archivo: unit_test.py
+# Proyecto: HASCILL
+# Repo: https://github.com/sebastiandperez/HASCILL-Crypto-Race
+
+"""
+unit_test.py — Pruebas unitarias (sin red) de los motores y módulos del server.
+Cada test_* es una función con asserts: corre con `python3 unit_test.py`
+o con pytest si está instalado.
+"""
+
+import asyncio, contextlib, io, json, logging, os, random, tempfile, time, types
+
+import hascill_batch, hascill_demo
+from hascill_batch import PARALLEL_MIN_BLOCKS, decrypt_messages, encrypt_messages
+from collections import deque
+
+from hascill_async_server import (
+    DEFAULT_ROOM, MAX_FRAME, RATE_LIMITS, ClientConn, FrameConn, HillServer, Outbox, Room, TimerWheel,
+    StepFrames, TokenBucket, broadcast, encode_frame, parse_rate_limits
+)
+from hascill_cluster import ShardMap
+from hascill_demo import (
+    CONTAINER_HDR, COUNT_UNKNOWN, ContainerHeader, HascillKey, KeyCache, blocks_to_bytes, container_blocks, decrypt, decrypt_stream,
+    NDJSONTrace, compute_tweak, derive_all_from_password,
+    decrypt_verbose, encrypt, encrypt_stream, encrypt_verbose, get_key, pack_container, read_container,
+    run_stream, unpack_container, write_container
+)
+from hascill_journal import LOG_NAME, Journal, read_events, replay
+from hascill_metrics import Histogram, metric, render
+from hascill_wire import PROTO_BIN, PROTO_JSON, decode_body, encode, encode_body, frame
+from game_core import (
+    ChallengeCursor, adjugate_mod, build_challenge, challenge_static, cursor_payload, cursor_step,
+    cursor_validate, det_mod, mat_inverse_mod, matrix_minor,
+    initial_state, next_step, round_offsets, sbox, sbox_inv, sbox_tables, step_delta, step_from_delta, tweak,
+    validate_step
+)
+
+PASSWORD = "PAZ9"
+MESSAGES = ["Hils", "", "Hola mundo", "HASCILL - Crypto Race 2025!", "x" * 37]
+SHAPES = ((2, 1), (3, 4), (4, 10), (5, 3))   # (n, rounds)
+
+def quiet(fn, *args, **kw):
+    """Corre fn tragándose lo que imprima (las versiones *_verbose trazan en consola)."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(*args, **kw)
+
+@contextlib.contextmanager
+def pure_python(on: bool = True):
+    """Fuerza el fallback sin NumPy de hascill_batch y hascill_demo mientras dure el bloque."""
+    saved = hascill_batch.np, hascill_demo.np
+    if on:
+        hascill_batch.np = hascill_demo.np = None
+    try:
+        yield
+    finally:
+        hascill_batch.np, hascill_demo.np = saved
+
+def engines():
+    """Caminos disponibles: NumPy (si está instalado) y Python puro."""
+    return ([False] if hascill_batch.np is not None else []) + [True]
+
+# ===== motor por lotes =====
+def test_encrypt_batch_matches_verbose():
+    for n, rounds in SHAPES:
+        ref = [quiet(encrypt_verbose, PASSWORD, s, n, rounds) for s in MESSAGES]
+        for py in engines():
+            with pure_python(py):
+                got = encrypt_messages(PASSWORD, MESSAGES, n=n, rounds=rounds)
+            assert got == ref, f"encrypt_batch difiere (n={n}, rounds={rounds}, python_puro={py})"
+
+def test_decrypt_batch_roundtrip():
+    for n, rounds in SHAPES:
+        cts = encrypt_messages(PASSWORD, MESSAGES, n=n, rounds=rounds)
+        ref = [quiet(decrypt_verbose, PASSWORD, c, n, rounds) for c in cts]
+        assert ref == MESSAGES
+        for py in engines():
+            with pure_python(py):
+                got = decrypt_messages(PASSWORD, cts, n=n, rounds=rounds)
+            assert got == ref, f"decrypt_batch difiere (n={n}, rounds={rounds}, python_puro={py})"
+
+def test_decrypt_batch_process_pool():
+    rng = random.Random(7)
+    msgs = ["".join(chr(rng.randrange(32, 127)) for _ in range(rng.randrange(300, 330))) for _ in range(64)]
+    cts = encrypt_messages(PASSWORD, msgs, n=4, rounds=10)
+    assert len(msgs) * max(map(len, cts)) >= PARALLEL_MIN_BLOCKS   # sí entra al pool
+    for py in engines():
+        with pure_python(py):
+            assert decrypt_messages(PASSWORD, cts, n=4, rounds=10, workers=3) == msgs
+    assert quiet(decrypt_verbose, PASSWORD, cts[5], 4, 10) == msgs[5]
+
+# ===== álgebra mod m (game_core) =====
+def cofactor_det(mat, m):
+    """Referencia: la expansión por cofactores que reemplazó la eliminación gaussiana."""
+    n = len(mat)
+    if n == 1:
+        return mat[0][0] % m
+    return sum((-1) ** j * mat[0][j] * cofactor_det(matrix_minor(mat, 0, j), m) for j in range(n)) % m
+
+def cofactor_adj(mat, m):
+    n = len(mat)
+    if n == 1:
+        return [[1 % m]]
+    return [[(-1) ** (i + j) * cofactor_det(matrix_minor(mat, j, i), m) % m for j in range(n)] for i in range(n)]
+
+def mat_mul(A, B, m):
+    return [[sum(a * b for a, b in zip(row, col)) % m for col in zip(*B)] for row in A]
+
+def test_det_and_inverse_match_cofactors():
+    rng = random.Random(4)
+    seen = {"singular": 0, "det_no_unitario": 0}
+    for m in (7, 257, 1009):
+        for n in (1, 2, 3, 4, 5):
+            I = [[int(i == j) for j in range(n)] for i in range(n)]
+            cases = [[[rng.randrange(m) for _ in range(n)] for _ in range(n)] for _ in range(40)]
+            if n > 1:   # singulares a propósito: fila repetida, combinación lineal, columna cero
+                base = cases[0]
+                cases.append([base[0]] + base[:-1])
+                cases.append([[(2 * a + b) % m for a, b in zip(base[0], base[1])]] + base[1:])
+                cases.append([[0] + row[1:] for row in base])
+            for M in cases:
+                d = det_mod(M, m)
+                assert d == cofactor_det(M, m), (m, M)
+                assert adjugate_mod(M, m) == cofactor_adj(M, m), (m, M)
+                if d == 0:
+                    seen["singular"] += 1
+                    try:
+                        mat_inverse_mod(M, m)
+                    except ValueError:
+                        continue
+                    raise AssertionError(f"invirtió una matriz singular: {M} mod {m}")
+                seen["det_no_unitario"] += d != 1
+                inv = mat_inverse_mod(M, m)
+                assert mat_mul(M, inv, m) == I and mat_mul(inv, M, m) == I, (m, M)
+    assert seen["singular"] > 30 and seen["det_no_unitario"] > 400, seen
+
+def test_demo_keeps_moved_names():
+    assert hascill_demo.matrix_minor is matrix_minor and hascill_demo.adjugate_mod is adjugate_mod
+
+# ===== S-box por tablas =====
+def test_sbox_tables_match_pow():
+    for m in (5, 11, 257, 1013, 1289):
+        S, Sinv = sbox_tables(m)
+        assert sbox_tables(m)[0] is S, "las tablas se construyen una vez por m"
+        assert S == [pow(x, 3, m) for x in range(m)]
+        assert sorted(Sinv) == list(range(m)) and all(Sinv[S[x]] == x for x in range(m)), m
+        for x in (0, 1, m - 1, m, 3 * m + 2, -1):
+            assert sbox(x, m) == hascill_demo.sbox(x, m) == pow(x, 3, m)
+            assert sbox_inv(sbox(x, m), m) == hascill_demo.sbox_inv(sbox(x, m), m) == x % m
+    for m in (7, 13, 9):   # 3 | m-1 o m no primo: x^3 no es biyectiva
+        assert sbox_tables(m)[1] is None
+        must_fail(sbox_inv, 1, m)
+
+# ===== clave precomputada (HascillKey) =====
+def test_hascill_key_matches_derivation():
+    for n, rounds in SHAPES:
+        key = HascillKey(PASSWORD, n, rounds)
+        P, m, key_sum, Ms, bs, IV = derive_all_from_password(PASSWORD, n, rounds)
+        I = [[int(i == j) for j in range(n)] for i in range(n)]
+        assert (list(key.P), key.m, key.key_sum, list(key.IV)) == (P, m, key_sum, IV)
+        assert [[list(row) for row in Mr] for Mr in key.Ms] == Ms and [list(b) for b in key.bs] == bs
+        for Mr, Minv in zip(Ms, key.Minvs):
+            assert mat_mul(Mr, [list(row) for row in Minv], m) == I
+        S, Sinv = sbox_tables(m)
+        assert list(key.S) == S and list(key.Sinv) == Sinv
+        # una clave ya armada ignora n/rounds y cifra igual que la contraseña
+        for msg in MESSAGES:
+            c = encrypt(PASSWORD, msg, n, rounds)
+            assert encrypt(key, msg, n=99, rounds=99) == c
+            assert decrypt(key, c) == msg and decrypt(PASSWORD, c, n, rounds) == msg
+        assert get_key(key) is key and get_key(PASSWORD, n, rounds, cache=None) is not key
+
+def test_round_offsets_match_tweaks():
+    for n, rounds in SHAPES:
+        key = HascillKey(PASSWORD, n, rounds)
+        m, bs = key.m, [list(b) for b in key.bs]
+        assert len(key.offset_table()) == m
+        for i in list(range(40)) + [m - 1, m, m + 1, 3 * m + 7]:   # la tabla da la vuelta cada m bloques
+            t0, offs = key.round_offsets(i)
+            assert list(t0) == compute_tweak(i, n, m, key.key_sum) == key.tweak(i)
+            for r in range(1, rounds + 1):
+                t_r = compute_tweak(i, n, m, key.key_sum, None if rounds == 1 else r)
+                assert list(offs[r - 1]) == [(b + t) % m for b, t in zip(bs[r - 1], t_r)], (n, rounds, i, r)
+                assert key.tweak(i, r) == compute_tweak(i, n, m, key.key_sum, r)
+    # juego: offset fusionado del paso D = (b + t_i) mod m
+    for pw, msg, n in CHALLENGES:
+        st = initial_state(pw, msg, n)
+        offs = round_offsets(3 * st.m + 2, n, st.m, st.b, st.key_sum)
+        for i, o in enumerate(offs):
+            assert o == [(b + t) % st.m for b, t in zip(st.b, tweak(i, n, st.m, st.key_sum))], (pw, n, i)
+        assert st.d_offsets == offs[:len(st.v_blocks)]
+
+# ===== traza estructurada =====
+def test_ndjson_trace_one_object_per_line():
+    for n, rounds in SHAPES:
+        for msg in MESSAGES:
+            out, buf = io.StringIO(), io.StringIO()
+            with contextlib.redirect_stdout(out):
+                c = encrypt(PASSWORD, msg, n, rounds, trace=NDJSONTrace(buf))
+                assert decrypt(PASSWORD, c, n, rounds) == msg     # camino rápido
+            assert out.getvalue() == "", "el núcleo no debe imprimir"
+            text = buf.getvalue()
+            assert text.endswith("\n")
+            evs = [json.loads(line) for line in text.splitlines()]
+            assert all(set(e) == {"step", "label", "value", "block", "round"} for e in evs)
+            assert not [e for e in evs if e["step"] in NDJSONTrace.RENDER_ONLY]
+            assert [e["value"] for e in evs if e["step"] == "OUT"] == c
+            assert [(e["block"], e["round"]) for e in evs if e["step"] == "D"] == \
+                [(i, r) for i in range(len(c)) for r in range(1, rounds + 1)]
+
+# ===== reto compartido (game_core) =====
+def test_cursor_matches_validate_step():
+    rng = random.Random(13)
+    for pw, msg, n in CHALLENGES:
+        st, cur = initial_state(pw, msg, n), ChallengeCursor(build_challenge(pw, msg, n))
+        steps = 0
+        while not st.finished:
+            sp, cs = next_step(st), cursor_step(cur)
+            assert (cs.block, cs.phase, cs.inputs, cs.op) == (sp.block, sp.phase, sp.inputs, sp.op), (pw, steps)
+            assert cursor_payload(cur)["inputs"] == sp.inputs
+            assert cur.current_phase == sp.phase and cur.c_blocks == st.c_blocks
+            exp = cur.challenge.expected[cur.pos]
+            wrong = list(exp)
+            wrong[rng.randrange(len(wrong))] += rng.randrange(1, 50)
+            other = "A" if sp.phase != "A" else "B"
+            for phase, vec in ((sp.phase, wrong), (other, exp)):   # vector o fase incorrectos: no avanza
+                assert cursor_validate(cur, phase, vec)[0] is False
+                assert validate_step(st, phase, vec)[0] is False
+                assert cur.errors == st.errors and next_step(st).phase == cur.current_phase == sp.phase
+            assert cursor_validate(cur, sp.phase, exp) == validate_step(st, sp.phase, exp) == (True, None)
+            steps += 1
+        assert cur.finished and steps == len(cur.challenge) == 2 + 4 * len(st.v_blocks)
+        assert cur.c_blocks == st.c_blocks == cur.challenge.c_blocks
+        assert cursor_validate(cur, "A", [0] * n) == (False, "El reto ya está resuelto.")
+        assert cursor_validate(cur, "Z", [0] * n)[0] is False
+
+# ===== cache de claves =====
+@contextlib.contextmanager
+def fake_clock(t0: float = 1000.0):
+    """Reloj manual para KeyCache: el bloque avanza el tiempo con clock[0] += s."""
+    clock = [t0]
+    saved = hascill_demo.time
+    hascill_demo.time = types.SimpleNamespace(monotonic=lambda: clock[0])
+    try:
+        yield clock
+    finally:
+        hascill_demo.time = saved
+
+def test_key_cache_lru_eviction():
+    c = KeyCache(capacity=2)
+    a, b = c.get("AAAA", 2, 1), c.get("BBBB", 2, 1)
+    assert c.get("AAAA", 2, 1) is a                 # hit: A pasa a ser la más reciente
+    c.get("CCCC", 2, 1)                              # expulsa B, la menos usada
+    assert c.get("AAAA", 2, 1) is a and c.get("BBBB", 2, 1) is not b
+    # al volver B sale C; (password, n, rounds) distintos son claves distintas
+    assert c.get("AAAA", 3, 1).n == 3
+    st = c.stats()
+    assert (st["size"], st["hits"], st["misses"], st["evictions"], st["expirations"]) == (2, 2, 5, 3, 0), st
+    assert st["hit_rate"] == 2 / 7
+
+def test_key_cache_ttl_and_get_key():
+    with fake_clock() as clock:
+        c = KeyCache(capacity=4, ttl=10.0)
+        k = c.get(PASSWORD, 2, 1)
+        clock[0] += 9.9
+        assert c.get(PASSWORD, 2, 1) is k
+        clock[0] += 0.1                              # cumple ttl desde que se creó, no desde el último hit
+        k2 = c.get(PASSWORD, 2, 1)
+        assert k2 is not k and c.stats()["expirations"] == 1 and c.stats()["misses"] == 2
+        assert get_key(PASSWORD, 2, 1, cache=c) is k2
+    assert get_key(k2) is k2                          # un HascillKey pasa tal cual
+    fresh = get_key(PASSWORD, 2, 1, cache=None)
+    assert isinstance(fresh, HascillKey) and fresh is not k2 and fresh.m == k2.m
+    try:
+        KeyCache(capacity=0)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("KeyCache aceptó capacity=0")
+
+# ===== contenedor binario =====
+def must_fail(fn, *args):
+    try:
+        fn(*args)
+    except ValueError:
+        return
+    raise AssertionError(f"{fn.__name__} aceptó una entrada inválida: {args!r:.80}")
+
+def test_container_roundtrip_and_truncation():
+    key = get_key(PASSWORD, 4, 3)
+    blocks = encrypt(key, "Hola mundo, contenedor")
+    data = pack_container(blocks, key.n, key.rounds, key.m)
+    for py in engines():
+        with pure_python(py):
+            hdr, vals = unpack_container(data)
+            assert hdr == ContainerHeader(4, 3, key.m, len(blocks)) and container_blocks(hdr, vals) == blocks
+            for k in range(len(data)):        # cualquier corte de cabecera o payload
+                must_fail(unpack_container, data[:k])
+            # COUNT_UNKNOWN: los bloques se cuentan hasta EOF; un bloque a medias es error
+            open_ended = ContainerHeader(4, 3, key.m).pack() + data[CONTAINER_HDR.size:]
+            hdr, vals = unpack_container(open_ended)
+            assert hdr.count == len(blocks) and container_blocks(hdr, vals) == blocks
+            for cut in (1, 2, 7):
+                must_fail(unpack_container, open_ended[:-cut])
+            hdr, vals = unpack_container(ContainerHeader(4, 3, key.m).pack())
+            assert hdr.count == 0 and container_blocks(hdr, vals) == []
+
+def test_container_bad_headers():
+    payload = b"\x00\x01" * 8
+    for hdr in (ContainerHeader(0, 3, 257), ContainerHeader(0, 3, 257, 2), ContainerHeader(4, 0, 257, 2)):
+        must_fail(unpack_container, hdr.pack() + payload)
+    good = ContainerHeader(4, 3, 257, 2).pack()
+    must_fail(unpack_container, b"XSCL" + good[4:] + payload)         # magic
+    must_fail(unpack_container, good[:4] + b"\x09" + good[5:] + payload)   # versión
+    must_fail(unpack_container, b"")
+
+def test_read_container_mmap():
+    key = get_key(PASSWORD, 3, 2)
+    blocks = encrypt(key, "x" * 200)
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "c.hscl")
+        write_container(path, blocks, key.n, key.rounds, key.m)
+        for py in engines():
+            with pure_python(py):
+                hdr, vals = read_container(path)
+                assert hdr == ContainerHeader(3, 2, key.m, len(blocks)) and container_blocks(hdr, vals) == blocks
+        empty = os.path.join(d, "vacio.hscl")
+        open(empty, "wb").close()
+        must_fail(read_container, empty)
+
+# ===== streaming =====
+def chunked(data: bytes, size: int) -> list:
+    return [data[k:k+size] for k in range(0, len(data), size)]
+
+def test_stream_matches_one_shot():
+    for n, rounds in SHAPES:
+        key = get_key(PASSWORD, n, rounds)
+        for msg in MESSAGES + ["y" * (3 * n)]:   # también un múltiplo exacto de n (bloque de padding entero)
+            ct = blocks_to_bytes(encrypt(key, msg))
+            # tamaños que cortan bloques (y enteros de 2 bytes) en todos los puntos posibles
+            for size in sorted({1, max(1, n - 1), n, n + 1, 2 * n - 1, 2 * n + 1}):
+                got = b"".join(encrypt_stream(key, chunked(msg.encode("ascii"), size)))
+                assert got == ct, (n, rounds, msg, size)
+                back = b"".join(decrypt_stream(key, chunked(ct, size)))
+                assert back == decrypt(key, encrypt(key, msg)).encode("ascii") == msg.encode("ascii"), (n, size)
+
+def test_stream_cbc_carries_across_chunks():
+    # el mismo bloque repetido: con CBC cada copia cifra distinto, también tras un corte de trozo
+    key = get_key(PASSWORD, 4, 3)
+    pieces = list(encrypt_stream(key, [b"ABCD", b"ABCD", b"AB", b"CDAB", b"CD"]))
+    ct = b"".join(pieces)
+    assert len(pieces) == 5 and ct == blocks_to_bytes(encrypt(key, "ABCD" * 4))
+    blocks = [ct[k:k+8] for k in range(0, len(ct), 8)]
+    assert len(set(blocks)) == len(blocks)
+    must_fail(lambda: b"".join(decrypt_stream(key, [ct[:-1]])))   # corte a mitad de bloque
+    must_fail(lambda: b"".join(decrypt_stream(key, [])))
+
+def test_run_stream_files():
+    msg = ("HASCILL streaming " * 500).encode("ascii")
+    with tempfile.TemporaryDirectory() as d, contextlib.redirect_stderr(io.StringIO()):
+        src, enc, dec = (os.path.join(d, x) for x in ("in.txt", "out.hscl", "back.txt"))
+        with open(src, "wb") as f:
+            f.write(msg)
+        run_stream("enc", PASSWORD, src, enc, 4, 10)
+        hdr, vals = read_container(enc)
+        assert hdr.count != COUNT_UNKNOWN and container_blocks(hdr, vals) == encrypt(PASSWORD, msg.decode())
+        run_stream("dec", PASSWORD, enc, dec, 4, 10)
+        with open(dec, "rb") as f:
+            assert f.read() == msg
+
+# ===== server: cola de salida =====
+class BrokenWriter:
+    """Transporte falso cuyo write falla con un OSError cualquiera."""
+    def __init__(self):
+        self.transport = self
+        self.aborted = False
+
+    def get_extra_info(self, key):
+        return ("test", 0)
+
+    def writelines(self, frames):
+        raise OSError("disco lleno")
+
+    def abort(self):
+        self.aborted = True
+
+def test_outbox_closes_on_unexpected_error():
+    async def run():
+        w = BrokenWriter()
+        ob = Outbox(w)
+        ob.put(b"frame")
+        await asyncio.sleep(0.05)
+        assert ob.closed and w.aborted and ob.task.done()
+        assert not ob.put(b"otro")
+    logging.disable(logging.ERROR)
+    try:
+        asyncio.run(run())
+    finally:
+        logging.disable(logging.NOTSET)
+
+def test_broadcast_encodes_once_per_proto():
+    async def run():
+        conns = [fake_conn() for _ in range(5)]
+        for cc in conns[3:]:
+            cc.proto = PROTO_BIN
+        obj = {"type": "turn", "current": 3, "you_turn": False, "order": [3, 1, 2]}
+        broadcast(conns, obj)
+        frames = [cc.outbox.q[-1] for cc in conns]
+        assert {k for k, _ in frames} == {"turn"}
+        js, bn = [f for _, f in frames[:3]], [f for _, f in frames[3:]]
+        assert js[0] == encode_frame(obj, PROTO_JSON) and bn[0] == encode_frame(obj, PROTO_BIN)
+        assert all(f is js[0] for f in js) and all(f is bn[0] for f in bn), "un encode por versión"
+        await asyncio.sleep(0.01)
+        assert [cc.outbox.writer.chunks for cc in conns] == [[f] for _, f in frames]
+        for cc in conns:
+            cc.close()
+        await asyncio.sleep(0.01)
+    asyncio.run(run())
+
+# ===== protocolo (hascill_wire) =====
+CHALLENGES = [("PAZ9", "Hils", 2), ("k3y!", "Race", 3), ("ABCD", "zzzz", 1), ("PAZ9", "Hola", 4)]   # (password, mensaje, n)
+
+def wire_samples():
+    """Todos los steps de varios retos más los demás mensajes con layout binario."""
+    out = []
+    for pw, msg, n in CHALLENGES:
+        for k, p in enumerate(build_challenge(pw, msg, n).payloads):
+            out.append(dict(p, turn_cid=(None if k % 3 == 0 else k), you_turn=(k % 2 == 0)))
+    out += [
+        {"type": "turn", "current": 7, "you_turn": True, "order": [7, 8, 9]},
+        {"type": "turn", "current": None, "you_turn": False, "order": []},
+        {"type": "ok", "for": "block2_phaseC"},
+        {"type": "error", "msg": "⛔ No es tu turno. Espera tu turno."},
+        {"type": "ping", "ts": 1760000000.125, "proto": PROTO_BIN},
+        {"type": "step_answer", "phase": "C", "block": 1, "vector": [0, 300, 70000]},
+        {"type": "step_answer", "phase": "TPW", "block": -1, "vector": [80, 65, 90, 57]},
+    ]
+    return out
+
+def test_wire_roundtrip():
+    for proto in (PROTO_JSON, PROTO_BIN):
+        for obj in wire_samples():
+            body = encode_body(obj, proto)
+            assert (body[0] == 0x7B) == (proto == PROTO_JSON), f"v{proto} no usó su layout: {obj}"
+            assert decode_body(body) == obj, (proto, obj)
+
+def test_wire_truncated_bodies_raise():
+    for proto in (PROTO_JSON, PROTO_BIN):
+        for obj in wire_samples():
+            body = encode_body(obj, proto)
+            for k in range(len(body)):
+                try:
+                    decode_body(body[:k])
+                except ValueError:
+                    continue
+                raise AssertionError(f"proto {proto}: cuerpo truncado a {k}/{len(body)} no falló: {obj}")
+
+def test_step_from_delta_rebuilds_payloads():
+    for pw, msg, n in CHALLENGES:
+        ch = build_challenge(pw, msg, n)
+        static = challenge_static(ch)
+        for k, p in enumerate(ch.payloads):
+            assert step_from_delta(static, step_delta(ch, k)) == p, (n, k)
+            # con la cola de turno, igual que llega por la red
+            d = dict(step_delta(ch, k), turn_cid=5, you_turn=True)
+            assert step_from_delta(static, d) == dict(p, turn_cid=5, you_turn=True), (n, k)
+
+def test_step_frames_match_encode_frame():
+    for pw, msg, n in CHALLENGES:
+        ch = build_challenge(pw, msg, n)
+        sf = StepFrames(ch)
+        assert sf.static_frame == encode_frame(challenge_static(ch))
+        for pos in range(len(ch)):
+            for delta, base in ((False, ch.payloads[pos]), (True, step_delta(ch, pos))):
+                for proto in (PROTO_JSON, PROTO_BIN):
+                    for cid in (None, 0, 7, 300):
+                        yes, no = sf.frames(pos, cid, proto, delta)
+                        assert yes == encode_frame(dict(base, turn_cid=cid, you_turn=True), proto), (pos, proto, delta)
+                        assert no == encode_frame(dict(base, turn_cid=cid, you_turn=False), proto), (pos, proto, delta)
+
+# ===== server: parser de frames (FrameConn) =====
+class FakeTransport:
+    def __init__(self):
+        self.closed = self.paused = False
+
+    def get_extra_info(self, key, default=None):
+        return ("test", 0)
+
+    def pause_reading(self):
+        self.paused = True
+
+    def resume_reading(self):
+        self.paused = False
+
+    def close(self):
+        self.closed = True
+
+def feed_frames(chunks, eof: bool = True) -> list:
+    """Pasa los chunks por un FrameConn y devuelve lo que recv entregó hasta el None.
+
+    Sin eof, el None sólo puede venir de un frame inválido: si el parser se
+    quedara esperando, wait_for lo hace fallar en vez de colgarse.
+    """
+    async def run():
+        got = []
+        async def handler(r, w):
+            while (m := await r.recv()) is not None:
+                got.append(m)
+        conn = FrameConn(handler)
+        conn.connection_made(FakeTransport())
+        for c in chunks:
+            conn.data_received(c)
+            await asyncio.sleep(0)
+        if eof:
+            conn.eof_received()
+        await asyncio.wait_for(conn._task, 1.0)
+        return got
+    return asyncio.run(run())
+
+def mixed_stream(objs):
+    """Stream de bytes con los mensajes alternando v1 (JSON) y v2 (binario)."""
+    return b"".join(encode(o, PROTO_JSON if k % 2 else PROTO_BIN) for k, o in enumerate(objs))
+
+def test_frame_conn_many_frames_in_one_chunk():
+    objs = wire_samples()[:12] + wire_samples()[-7:]
+    stream = mixed_stream(objs)
+    assert feed_frames([stream]) == objs
+    assert feed_frames([stream[k:k+1] for k in range(len(stream))]) == objs   # byte a byte
+
+def test_frame_conn_split_at_every_byte():
+    objs = wire_samples()[-4:]
+    stream = mixed_stream(objs)
+    for k in range(1, len(stream)):
+        assert feed_frames([stream[:k], stream[k:]]) == objs, k
+
+def test_frame_conn_bad_frames_close():
+    good = encode({"type": "ready"}, PROTO_JSON)
+    bad_frames = [
+        (MAX_FRAME + 1).to_bytes(4, "big") + b"x",   # largo fuera de rango
+        (0).to_bytes(4, "big"),                      # largo cero
+        frame(b"{no es json"),                       # cuerpo v1 roto
+        frame(b"\x01\x02"),                          # tag v2 desconocido / truncado
+    ]
+    for bad in bad_frames:
+        # el frame bueno previo llega; el malo cierra sin esperar más bytes
+        assert feed_frames([good + bad + good], eof=False) == [{"type": "ready"}], bad
+        assert feed_frames([good, bad[:3], bad[3:], good], eof=False) == [{"type": "ready"}], bad
+
+# ===== server: rate limit =====
+def test_token_bucket_burst_and_refill():
+    b = TokenBucket(2.0, 3)
+    t = b.stamp
+    assert [b.take(t) for _ in range(4)] == [True, True, True, False]   # ráfaga de 3
+    assert not b.take(t + 0.25)           # medio token
+    assert b.take(t + 0.5)                # 2/s: a los 0,5 s hay uno entero
+    assert not b.take(t + 0.5)
+    # una pausa larga no acumula más que la ráfaga
+    t += 100.0
+    assert [b.take(t) for _ in range(4)] == [True, True, True, False]
+    assert b.tokens < 1 and b.burst == 3
+
+def test_parse_rate_limits():
+    assert parse_rate_limits([]) == RATE_LIMITS
+    got = parse_rate_limits(["step_answer=10/20", "*=0.5/1", "chat=2.5/4"])
+    assert got["step_answer"] == (10.0, 20.0) and got["*"] == (0.5, 1.0) and got["chat"] == (2.5, 4.0)
+    assert got["ready"] == RATE_LIMITS["ready"]
+    for bad in ("bad", "x=1", "x=a/b", "=1/2", "x=0/5", "x=-1/3", "x=1/0", "x=1/2/3", "x="):
+        try:
+            parse_rate_limits([bad])
+        except ValueError:
+            continue
+        raise AssertionError(f"se aceptó un rate limit inválido: {bad!r}")
+
+# ===== server: rueda de timers =====
+class FakeWriter:
+    """Transporte en memoria: guarda lo que la escritora le entrega."""
+    def __init__(self):
+        self.transport = self
+        self.chunks = []
+        self.closed = False
+
+    def get_extra_info(self, key):
+        return ("test", 0)
+
+    def writelines(self, frames):
+        self.chunks.extend(frames)
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    abort = close
+
+def fake_conn() -> ClientConn:
+    w = FakeWriter()
+    return ClientConn(None, w, Outbox(w))
+
+def test_timer_wheel_rounds_and_cancel():
+    w = TimerWheel(tick=1.0, slots=128)
+    fired = []
+    for d in (1, 5, 127, 128, 129, 256, 300, 0.2):
+        w.call_later(d, fired.append, d)
+    gone = w.call_later(10, fired.append, "cancelado")
+    gone.cancel()
+    at = {}
+    for tick in range(1, 310):
+        before = len(fired)
+        w.advance()
+        for d in fired[before:]:
+            at[d] = tick
+    # cada timer dispara en ceil(delay / tick), aunque dé vueltas a la rueda
+    assert at == {0.2: 1, 1: 1, 5: 5, 127: 127, 128: 128, 129: 129, 256: 256, 300: 300}, at
+    assert "cancelado" not in fired and len(w) == 0
+
+def test_timer_wheel_rearm_from_callback():
+    w = TimerWheel(tick=1.0, slots=8)
+    ticks = []
+    def beat(k):
+        ticks.append(k)
+        if k < 3:
+            w.call_later(8, beat, k + 1)   # re-agendar cae una vuelta después, no en este advance
+    w.call_later(8, beat, 0)
+    fired_at = []
+    for tick in range(1, 40):
+        before = len(ticks)
+        w.advance()
+        fired_at += [tick] * (len(ticks) - before)
+    assert ticks == [0, 1, 2, 3] and fired_at == [8, 16, 24, 32]
+
+def test_turn_deadline_skips_to_next_player():
+    async def run():
+        wheel = TimerWheel(tick=1.0)
+        room = Room("t", "PAZ9", "Hils", "phase", wheel=wheel, turn_timeout=3.0)
+        ts = room.get_team(1)
+        ts.conns = {1: fake_conn(), 2: fake_conn()}
+        ts.turn_order = deque([1, 2])
+        ts.game = ChallengeCursor(room.challenge)
+        room.start_flag = True
+        await room.push_next_task(ts)
+        for _ in range(2):
+            wheel.advance()
+        await asyncio.sleep(0)
+        assert ts.current_player() == 1          # todavía dentro del plazo
+        wheel.advance()                          # tick 3: vence
+        for _ in range(3):
+            await asyncio.sleep(0)
+        assert ts.current_player() == 2 and ts.game.pos == 0
+        # el deadline se re-arma para el nuevo dueño del turno
+        for _ in range(3):
+            wheel.advance()
+        for _ in range(3):
+            await asyncio.sleep(0)
+        assert ts.current_player() == 1
+        # un deadline viejo no salta a nadie si el paso ya avanzó
+        ts.game.pos += 1
+        ts.rotate_phase()
+        await room.push_next_task(ts)
+        seq = ts.turn_seq
+        room._turn_expired(ts, seq - 1)
+        await asyncio.sleep(0)
+        assert ts.current_player() == 2 and ts.turn_seq == seq
+        for cc in ts.conns.values():
+            cc.close(flush=False)
+        await asyncio.sleep(0.01)   # que las escritoras salgan del drain antes de cerrar el loop
+    asyncio.run(run())
+
+# ===== server: journal y restauración =====
+class FakeWire(FakeWriter):
+    """Las dos puntas de un FrameConn en memoria: lo que el cliente manda y lo que recibe."""
+    def __init__(self):
+        super().__init__()
+        self.inbox: asyncio.Queue = asyncio.Queue()
+
+    async def recv(self):
+        return await self.inbox.get()
+
+    def write(self, data):
+        self.chunks.append(data)
+
+    async def wait_closed(self):
+        pass
+
+    def received(self):
+        return [decode_body(f[4:]) for f in self.chunks]
+
+def answer_for(ts) -> dict:
+    """step_answer correcto para el paso en curso del equipo."""
+    g = ts.game
+    sp = g.challenge.steps[g.pos]
+    return {"type": "step_answer", "phase": sp.phase, "block": sp.block, "vector": g.challenge.expected[g.pos]}
+
+def test_disconnect_detaches_only_mid_race():
+    async def run():
+        room = Room("t", "PAZ9", "Hils", "phase")
+        ts = room.get_team(1)
+        for cid in (1, 2, 3):
+            ts.conns[cid] = fake_conn()
+            ts.turn_order.append(cid)
+            room.attach_session(ts, cid, f"tok{cid}")
+        await room.on_disconnect(1, 1, ts.conns[1])          # lobby: se va del todo
+        assert 1 not in ts.turn_order and "tok1" not in room.sessions and not ts.detached
+        room.start_flag = True
+        ts.game = ChallengeCursor(room.challenge)
+        await room.on_disconnect(1, 2, ts.conns[2])          # en carrera: queda caído
+        assert list(ts.turn_order) == [3, 2] and set(ts.detached) == {2} and "tok2" in room.sessions
+        await room.on_step_answer(1, 3, answer_for(ts))
+        ts.game.pos = len(room.challenge) - 1                # último paso: game_over
+        await room.on_step_answer(1, 3, answer_for(ts))
+        assert room.game_over and list(ts.turn_order) == [3] and not ts.detached and "tok2" not in room.sessions
+        await room.on_disconnect(1, 3, ts.conns[3])          # tras game_over: tampoco queda caído
+        assert not ts.turn_order and not room.sessions
+        await asyncio.sleep(0.01)
+    with contextlib.redirect_stdout(io.StringIO()):
+        asyncio.run(run())
+
+def test_rooms_do_not_share_state():
+    def kinds(ts):
+        return [decode_body(f[4:])["type"] for cc in ts.conns.values() for f in cc.outbox.writer.chunks]
+
+    async def run():
+        srv = HillServer("PAZ9", "Hils", "phase")
+        a = srv.rooms[DEFAULT_ROOM]
+        b = srv.create_room("aula2", "k3y!", "Race")
+        twin = srv.create_room("aula3", "PAZ9", "Hils")
+        assert twin.challenge is a.challenge and twin.step_frames is a.step_frames   # reto cacheado
+        assert b.challenge is not a.challenge and b.challenge.expected[0] != a.challenge.expected[0]
+        teams = {}
+        for room, cids in ((a, (1, 2)), (b, (3, 4))):
+            ts = teams[room] = room.get_team(1)
+            for cid in cids:
+                ts.conns[cid] = fake_conn()
+                ts.turn_order.append(cid)
+            room.start_flag = True
+            ts.game = ChallengeCursor(room.challenge)
+        ta, tb = teams[a], teams[b]
+        assert ta is not tb and not {id(c) for c in a.conns()} & {id(c) for c in b.conns()}
+        good_a = answer_for(ta)
+        await a.on_step_answer(1, 1, good_a)
+        await b.on_step_answer(1, 3, good_a)        # la respuesta de otra sala no sirve aquí
+        assert (ta.game.pos, ta.game.errors, tb.game.pos) == (1, 0, 0) and tb.game.errors > 0
+        assert list(ta.turn_order) == [2, 1] and list(tb.turn_order) == [3, 4]
+        ta.game.pos = len(a.challenge) - 1
+        await a.on_step_answer(1, 2, answer_for(ta))
+        assert a.game_over and a.winner_team == 1
+        assert not b.game_over and b.winner_team is None and not twin.game_over and not twin.teams
+        await asyncio.sleep(0.01)
+        assert "game_over" in kinds(ta) and "ok" in kinds(ta)
+        assert "game_over" not in kinds(tb) and "ok" not in kinds(tb) and "error" in kinds(tb)
+        for cc in a.conns() + b.conns():
+            cc.close()
+        await asyncio.sleep(0.01)
+    with contextlib.redirect_stdout(io.StringIO()):
+        asyncio.run(run())
+
+def test_team_locks_are_independent():
+    async def run():
+        room = Room("t", "PAZ9", "Hils", "phase")
+        t1, t2 = room.get_team(1), room.get_team(2)
+        t1.conns[1], t2.conns[2] = fake_conn(), fake_conn()
+        await room.on_ready(1, 1)
+        await room.on_ready(2, 2)
+        # el countdown corre como tarea, sin retener el lock de la sala
+        assert room.starting and not room.lock.locked() and not room.start_flag
+        room.schedule_start(countdown=0)
+        await room._start_task
+        assert room.start_flag and t1.game is not None and t2.game is not None
+        # equipo 1 ocupado: el 2 avanza igual y el 1 espera su lock
+        await t1.lock.acquire()
+        pending = asyncio.create_task(room.on_step_answer(1, 1, answer_for(t1)))
+        await asyncio.wait_for(room.on_step_answer(2, 2, answer_for(t2)), 1.0)
+        await asyncio.sleep(0.01)
+        assert t2.game.pos == 1 and t1.game.pos == 0 and not pending.done()
+        t1.lock.release()
+        await asyncio.wait_for(pending, 1.0)
+        assert t1.game.pos == 1 and t2.game.pos == 1
+        for cc in room.conns():
+            cc.close()
+        await asyncio.sleep(0.01)
+    with contextlib.redirect_stdout(io.StringIO()):
+        asyncio.run(run())
+
+def test_journal_restore_after_torn_tail():
+    async def settle():
+        for _ in range(5):
+            await asyncio.sleep(0)
+
+    async def run(d):
+        # 1) carrera en curso: dos miembros, un par de pasos antes y después del snapshot
+        j = Journal(d, snapshot_every=10**6)
+        room = Room(DEFAULT_ROOM, "PAZ9", "Hils", "phase", journal=j)
+        room._journal("room_create", room_state=True)
+        ts = room.get_team(1)
+        for cid in (1, 2):
+            ts.conns[cid] = fake_conn()
+            ts.turn_order.append(cid)
+            room.attach_session(ts, cid, f"tok{cid}")
+            room._journal("join", ts, team=1, cid=cid)
+        ts.ready = {1, 2}
+        room._journal("ready", ts, team=1, cid=2)
+        room.start_flag, room.start_time = True, time.time()
+        ts.game = ChallengeCursor(room.challenge)
+        room._journal("start", ts, room_state=True)
+        for k in range(4):
+            if k == 2:
+                await j.snapshot()
+            await room.on_step_answer(1, ts.current_player(), answer_for(ts))
+        assert ts.game.pos == 4
+        # 2) crash: el último write quedó a medias y no hubo snapshot de cierre
+        j.f.flush()
+        j._task.cancel()
+        j.f.close()
+        for cc in ts.conns.values():
+            cc.close(flush=False)
+        log = os.path.join(d, LOG_NAME)
+        good = os.path.getsize(log)
+        with open(log, "ab") as f:
+            f.write(b'{"ev":"answer","room":"default","te')
+
+        # 3) sin gracia de sesión nadie puede volver: turnos y ready quedan vacíos
+        j = Journal(d)
+        assert j.restored and j.tail == 2 and os.path.getsize(log) == good
+        srv = HillServer("ABCD", "zzzz", "phase", journal=j, session_grace=0)
+        ts = srv.rooms[DEFAULT_ROOM].teams[1]
+        assert ts.game.pos == 4 and not ts.turn_order and not ts.ready and not ts.detached
+        assert srv.next_client_id == 2
+        j.f.close()
+
+        # 4) con gracia: 1 retoma su sesión, 2 no vuelve y entra uno nuevo a mitad de carrera
+        j = Journal(d)
+        srv = HillServer("ABCD", "zzzz", "phase", journal=j,
+                         rate_limits=dict(RATE_LIMITS, step_answer=(1000.0, 1000)))
+        room = srv.rooms[DEFAULT_ROOM]
+        ts = room.teams[1]
+        assert list(ts.turn_order) == [1, 2] and set(ts.detached) == {1, 2} and not ts.ready
+        wires, tasks = {}, []
+        for cid, join in ((1, {"type": "join", "team": 1, "session": "tok1"}),
+                          (3, {"type": "join", "team": 1})):
+            w = wires[cid] = FakeWire()
+            tasks.append(asyncio.create_task(srv.handle_conn(w, w)))
+            w.inbox.put_nowait(join)
+            await settle()
+        got = wires[1].received()
+        resume = next(m for m in got if m["type"] == "resume")
+        assert resume["msgs"][0]["your_id"] == 1 and resume["msgs"][-1]["type"] == "step"
+        assert any(m["type"] == "joined" and m["your_id"] == 3 for m in wires[3].received())
+        assert list(ts.turn_order) == [1, 2, 3]
+        answered = set()
+        while not room.game_over:
+            cur = ts.current_player()
+            assert cur in (1, 3), ts.turn_order
+            pos = ts.game.pos
+            wires[cur].inbox.put_nowait(answer_for(ts))
+            await settle()
+            assert ts.game.pos == pos + 1
+            answered.add(cur)
+        assert answered == {1, 3} and room.winner_team == 1
+        for w in wires.values():
+            w.inbox.put_nowait(None)
+        await asyncio.gather(*tasks)
+        srv._wheel_task.cancel()
+        await j.close()
+        await asyncio.sleep(0.01)
+
+    logging.disable(logging.WARNING)
+    try:
+        with tempfile.TemporaryDirectory() as d, contextlib.redirect_stdout(io.StringIO()):
+            asyncio.run(run(d))
+    finally:
+        logging.disable(logging.NOTSET)
+
+def test_journal_clips_rejected_answers():
+    async def run(d):
+        j = Journal(d, snapshot_every=10**6)
+        room = Room(DEFAULT_ROOM, "PAZ9", "Hils", "phase", journal=j)
+        room._journal("room_create", room_state=True)
+        ts = room.get_team(1)
+        ts.conns[1] = fake_conn()
+        ts.turn_order.append(1)
+        room.start_flag = True
+        ts.game = ChallengeCursor(room.challenge)
+        room._journal("start", ts, room_state=True)
+        junk = [
+            {"phase": "TPW", "block": -1, "vector": list(range(200_000))},   # largo equivocado
+            {"phase": "TPW", "block": -1, "vector": [10 ** 4000, 1, 2, 3]},  # forma bien, entero enorme
+            {"phase": "x" * 100_000, "block": "y" * 100_000, "vector": "z" * 100_000},
+        ]
+        for m in junk:
+            await room.on_step_answer(1, 1, m)
+        await room.on_step_answer(1, 1, answer_for(ts))
+        bad = answer_for(ts)
+        bad["vector"] = [0] * len(bad["vector"])              # mala, pero con forma
+        await room.on_step_answer(1, 1, bad)
+        j.f.flush()
+        events = read_events(os.path.join(d, LOG_NAME))[0]
+        answers = [e for e in events if e["ev"] == "answer"]
+        assert [e["ok"] for e in answers] == [False, False, False, True, False]
+        assert answers[0]["vec_len"] == 200_000 and answers[2]["vec_len"] == 100_000
+        assert all(len(json.dumps(e["vec"])) < 200 and len(json.dumps(e["phase"])) < 40 for e in answers)
+        assert answers[4]["vec"] == bad["vector"]   # una respuesta bien formada queda entera para el replay
+        assert os.path.getsize(os.path.join(d, LOG_NAME)) < 20_000
+        await j.close()
+        ts.conns[1].close(flush=False)
+        await asyncio.sleep(0.01)
+        out = io.StringIO()
+        replay(d, out=out, verbose=False)
+        assert "0 divergencias" in out.getvalue(), out.getvalue()
+    with tempfile.TemporaryDirectory() as d, contextlib.redirect_stdout(io.StringIO()):
+        asyncio.run(run(d))
+
+def test_restored_sessions_expire_without_joins():
+    async def run(d):
+        j = Journal(d, snapshot_every=10**6)
+        room = Room(DEFAULT_ROOM, "PAZ9", "Hils", "phase", journal=j)
+        room._journal("room_create", room_state=True)
+        ts = room.get_team(1)
+        ts.turn_order.append(1)
+        room.attach_session(ts, 1, "tok1")
+        room.start_flag = True
+        ts.game = ChallengeCursor(room.challenge)
+        room._journal("start", ts, room_state=True)
+        await j.close()
+        j = Journal(d)
+        srv = HillServer("ABCD", "zzzz", "phase", journal=j, session_grace=2.0)
+        ts = srv.rooms[DEFAULT_ROOM].teams[1]
+        assert set(ts.detached) == {1}
+        srv.start_wheel()                  # lo que hace run_server justo tras restaurar
+        assert srv._wheel_task is not None
+        srv._wheel_task.cancel()
+        for _ in range(3):                 # la gracia vence sin que nadie se conecte
+            srv.wheel.advance()
+        for _ in range(3):
+            await asyncio.sleep(0)
+        assert not ts.detached and not ts.turn_order and "tok1" not in srv.rooms[DEFAULT_ROOM].sessions
+        await j.close()
+    logging.disable(logging.WARNING)
+    try:
+        with tempfile.TemporaryDirectory() as d:
+            asyncio.run(run(d))
+    finally:
+        logging.disable(logging.NOTSET)
+
+def test_join_timeout_closes_silent_connection():
+    async def run():
+        srv = HillServer("PAZ9", "Hils", "phase", idle_timeout=0.05)
+        w = FakeWire()
+        await asyncio.wait_for(srv.handle_conn(w, w), 2.0)   # nunca manda el join
+        assert w.closed and [m["type"] for m in w.received()] == ["hello", "error"]
+        assert not srv.rooms[DEFAULT_ROOM].conns()
+    asyncio.run(run())
+
+# ===== cluster (hascill_cluster) =====
+def test_shard_map_stable_when_adding_workers():
+    rooms = [DEFAULT_ROOM] + [f"aula{i}" for i in range(3000)]
+    ports = list(range(6001, 6010))
+    for k in range(1, len(ports)):
+        old, new = ShardMap(None, ports[:k]), ShardMap(None, ports[:k + 1])
+        moved = [r for r in rooms if new.owner(r) != old.owner(r)]
+        # rendezvous: sólo se mueven salas hacia el worker nuevo, ~1/(k+1) de ellas
+        assert all(new.owner(r) == k for r in moved), k
+        assert abs(len(moved) - len(rooms) / (k + 1)) < 0.2 * len(rooms) / (k + 1), (k, len(moved))
+        assert all(new.port_of(r) == ports[new.owner(r)] for r in rooms[:50])
+    # el mismo mapa en cada proceso: un HillServer sólo aloja lo suyo
+    shards = [ShardMap(me, ports[:3]) for me in range(3)]
+    for r in rooms[:200]:
+        assert [s.owner(r) == s.me for s in shards].count(True) == 1
+    owner = shards[0].owner(DEFAULT_ROOM)
+    srvs = [HillServer("PAZ9", "Hils", "phase", shard=s) for s in shards]
+    assert [DEFAULT_ROOM in srv.rooms for srv in srvs] == [me == owner for me in range(3)]
+
+# ===== métricas =====
+def test_histogram_render():
+    h = Histogram("h", "ayuda", (0.1, 1, 2.5), label="phase")
+    for v, k in ((0.05, "A"), (0.1, "A"), (0.5, "A"), (5, "A"), (1, "B")):
+        h.observe(v, k)
+    assert h.count("A") == 4 and h.count("C") == 0
+    # acumulados por bucket; un valor justo en el borde cae en le=<borde>
+    assert render([h], lambda: metric("g", "x", 3)) == "\n".join([
+        "# HELP h ayuda",
+        "# TYPE h histogram",
+        'h_bucket{phase="A",le="0.1"} 2',
+        'h_bucket{phase="A",le="1"} 3',
+        'h_bucket{phase="A",le="2.5"} 3',
+        'h_bucket{phase="A",le="+Inf"} 4',
+        'h_sum{phase="A"} 5.65',
+        'h_count{phase="A"} 4',
+        'h_bucket{phase="B",le="0.1"} 0',
+        'h_bucket{phase="B",le="1"} 1',
+        'h_bucket{phase="B",le="2.5"} 1',
+        'h_bucket{phase="B",le="+Inf"} 1',
+        'h_sum{phase="B"} 1',
+        'h_count{phase="B"} 1',
+        "# HELP g x",
+        "# TYPE g gauge",
+        "g 3",
+    ]) + "\n"
+    plain = Histogram("p", "sin etiqueta", (1,))
+    plain.observe(2)
+    assert plain.render()[2:] == ['p_bucket{le="1"} 0', 'p_bucket{le="+Inf"} 1', "p_sum 2", "p_count 1"]
+
+
+if __name__ == "__main__":
+    for name, fn in list(globals().items()):
+        if name.startswith("test_") and callable(fn):
+            fn()
+            print(f"[TEST] OK: {name}")